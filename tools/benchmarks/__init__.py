@@ -0,0 +1,7 @@
+"""
+benchmarks: timing scripts for the slow parts of the builder
+
+These aren't tests and don't run in CI. Each module builds its own synthetic
+inputs in a temporary directory and prints how long the builder takes on them.
+Run them with poe, e.g. `poetry poe benchmark-unpack-tar`.
+"""
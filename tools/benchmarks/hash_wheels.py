@@ -0,0 +1,93 @@
+"""
+benchmarks.hash_wheels: time hashing a synthetic dist tree for the index
+
+Makes a tree of a few thousand multi-MB files named like wheels, and compares
+hashing them in chunks across a thread pool against reading each whole file
+into memory and hashing them one at a time, which is how the index used to be
+hashed.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable
+
+from builder.generate_index.package_leaf import hash_distributions
+
+
+def make_tree(root: Path, wheels: int, wheel_mb: int) -> list[Path]:
+    # different content per file, so nothing can be deduplicated along the way
+    block = os.urandom(2**20)
+    paths = []
+    for index in range(wheels):
+        package_dir = root / f"package{index % 100}"
+        package_dir.mkdir(exist_ok=True)
+        path = (
+            package_dir / f"package{index % 100}-{index}-cp310-cp310-linux_armv7l.whl"
+        )
+        with open(path, "wb") as wheel:
+            wheel.write(index.to_bytes(8, "little"))
+            for _ in range(wheel_mb):
+                wheel.write(block)
+        paths.append(path)
+    return paths
+
+
+def serial_whole_file(paths: list[Path]) -> dict[Path, str]:
+    """The hashing this benchmark compares against."""
+    return {path: sha256(open(path, "rb").read()).hexdigest() for path in paths}
+
+
+def measure(
+    name: str,
+    hasher: Callable[[list[Path]], dict[Path, str]],
+    paths: list[Path],
+    trace_memory: bool,
+) -> dict[Path, str]:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    digests = hasher(paths)
+    elapsed = time.perf_counter() - start
+    peak = ""
+    if trace_memory:
+        peak = (
+            f", peak python memory {tracemalloc.get_traced_memory()[1] / 2**20:.1f} MiB"
+        )
+        tracemalloc.stop()
+    print(f"{name}: {elapsed:.2f}s{peak}")
+    return digests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--wheels", type=int, default=2000)
+    parser.add_argument("--wheel-mb", type=int, default=4)
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also report peak python memory",
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        paths = make_tree(Path(tmp), args.wheels, args.wheel_mb)
+        print(
+            f"made {args.wheels} wheels of {args.wheel_mb} MiB "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        # the files were just written, so they're all in the page cache for both
+        parallel = measure(
+            "chunked, parallel", hash_distributions, paths, args.trace_memory
+        )
+        serial = measure(
+            "whole file, serial", serial_whole_file, paths, args.trace_memory
+        )
+        assert parallel == serial
+
+
+if __name__ == "__main__":
+    main()
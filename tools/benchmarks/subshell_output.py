@@ -0,0 +1,85 @@
+"""
+benchmarks.subshell_output: time pushing lots of output through an SDK subshell
+
+Runs a command that prints a million compiler-ish lines in a subshell, echoing
+them to a verbose build log the way package builds do, and compares the chunked
+output pump against reading and echoing one line at a time, which is how
+subshell output used to be read.
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from builder.package_build.shell_environment import (
+    SDKSubshell,
+    _SubshellHandles,
+)
+from builder.package_build.types import GlobalBuildContext
+
+
+class LineAtATimeSubshell(SDKSubshell):
+    """The subshell output reader this benchmark compares against."""
+
+    def _shellcall(
+        self,
+        cmd: str,
+        handles: _SubshellHandles,
+        *,
+        command_echo_is_verbose: bool = False,
+    ) -> tuple[int, str]:
+        cmd += ' ; echo "xxxresultxxx:xxx$?xxx"\n'
+        self._echo(cmd)
+        handles.stdin.write(cmd)
+        stdout = self._proc.stdout
+        assert stdout
+        lines: list[str] = []
+        while True:
+            line = stdout.readline()
+            self._echo_verbose(line)
+            lines.append(line)
+            if match := self._result_re.search(line):
+                return int(match.group(1)), "".join(lines[:-1])
+
+
+def measure(name: str, subshell_type: type[SDKSubshell], sdk: Path, lines: int) -> None:
+    with open(os.devnull, "w") as devnull:
+        context = GlobalBuildContext(output=devnull, verbose=True, sdk_path=sdk)
+        with subshell_type.scoped(
+            sdk,
+            sdk,
+            SDKSubshell.echo_wrap_prevent_double_newlines(context.write),
+            SDKSubshell.echo_wrap_prevent_double_newlines(context.write_verbose),
+        ) as shell:
+            start = time.perf_counter()
+            start_cpu = time.process_time()
+            output = shell.run(
+                [
+                    "awk",
+                    f"BEGIN {{ for (i = 0; i < {lines}; i++) "
+                    'printf "arm-buildroot-linux-gnueabihf-gcc -c pandas/_libs/m%d.c '
+                    '-o build/m%d.o -O2 -fPIC\\n", i, i }',
+                ]
+            )
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+    print(
+        f"{name}: {elapsed:.2f}s, {cpu:.2f}s of builder cpu, "
+        f"{len(output) / 2**20:.1f} MiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        sdk = Path(tmp)
+        (sdk / "environment-setup").write_text("export FAKE_SDK=1\n")
+        measure("chunked", SDKSubshell, sdk, args.lines)
+        measure("line at a time", LineAtATimeSubshell, sdk, args.lines)
+
+
+if __name__ == "__main__":
+    main()
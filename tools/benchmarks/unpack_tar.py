@@ -0,0 +1,104 @@
+"""
+benchmarks.unpack_tar: time unpacking a synthetic sdist with lots of members
+
+Compares the streaming tar unpacker against listing and sorting every member
+before extracting, which is how tarballs used to be unpacked.
+"""
+import argparse
+import io
+import os
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable
+
+from builder.package_build.download import _unpack_tar_to, _unpack_member_to
+from builder.package_build.types import GlobalBuildContext
+
+CONTEXT = GlobalBuildContext(output=None, verbose=False, sdk_path=Path("unused"))
+
+
+def make_archive(path: Path, members: int, per_directory: int = 500) -> Path:
+    """Make a tar.gz shaped like an sdist, with members small files."""
+    archive = path / "synthetic-1.0.0.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for index in range(members):
+            if index % per_directory == 0:
+                directory = tarfile.TarInfo(
+                    f"synthetic-1.0.0/src/dir{index // per_directory}"
+                )
+                directory.type = tarfile.DIRTYPE
+                directory.mode = 0o755
+                tf.addfile(directory)
+            content = f"# module {index}\n".encode() * 8
+            info = tarfile.TarInfo(
+                f"synthetic-1.0.0/src/dir{index // per_directory}/mod{index}.py"
+            )
+            info.size = len(content)
+            info.mode = 0o644
+            tf.addfile(info, io.BytesIO(content))
+    return archive
+
+
+def sorted_unpack(
+    path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
+) -> Path:
+    """The unpacker this benchmark compares against."""
+    with tarfile.open(archive, "r") as tf:
+        members = sorted(tf.getmembers(), key=lambda m: m.name, reverse=True)
+        unpacked = [
+            _unpack_member_to(tf, path, member, from_archive_path, context=context)
+            for member in members
+        ]
+        return Path(os.path.commonpath([p for p in unpacked if p]))
+
+
+def measure(
+    name: str,
+    unpacker: Callable[..., Path],
+    archive: Path,
+    work: Path,
+    trace_memory: bool,
+) -> None:
+    target = work / name
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    unpacker(target, archive, Path("."), context=CONTEXT)
+    elapsed = time.perf_counter() - start
+    peak = ""
+    if trace_memory:
+        peak = (
+            f", peak python memory {tracemalloc.get_traced_memory()[1] / 2**20:.1f} MiB"
+        )
+        tracemalloc.stop()
+    print(f"{name}: {elapsed:.2f}s{peak}")
+    rmtree(target)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also report peak python memory (slows everything down)",
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        start = time.perf_counter()
+        archive = make_archive(work, args.members)
+        print(
+            f"made {args.members}-member archive of {archive.stat().st_size / 2**20:.1f} "
+            f"MiB in {time.perf_counter() - start:.2f}s"
+        )
+        measure("streaming", _unpack_tar_to, archive, work, args.trace_memory)
+        measure("list and sort", sorted_unpack, archive, work, args.trace_memory)
+
+
+if __name__ == "__main__":
+    main()
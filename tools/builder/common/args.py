@@ -3,6 +3,13 @@
 import sys
 import argparse
 
+#: How --dist-placement can put wheels in the index, and how it does by default.
+#: These are builder.generate_index.placement's DIST_PLACEMENTS and
+#: DEFAULT_DIST_PLACEMENT, which can't be imported here because that module
+#: needs the container's python and dependencies; a test keeps them the same.
+DIST_PLACEMENTS = ("auto", "copy", "hardlink", "reflink", "symlink")
+DEFAULT_DIST_PLACEMENT = "auto"
+
 
 def add_common_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
@@ -68,9 +75,160 @@ def add_common_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
     parser.add_argument(
         "--build-type",
         action="store",
-        choices=["packages-only", "index-only", "both"],
+        choices=["packages-only", "index-only", "both", "prefetch-deps"],
         default="both",
-        help="Just build packages; just build index from previous package build; do both",
+        help=(
+            "Just build packages; just build index from previous package build; do both; "
+            "or just download and build the build dependencies of every package "
+            "into the wheelhouse"
+        ),
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "How many packages to build at once. Each package builds in its own "
+            "process, and its log is written all at once when it finishes. default: 1"
+        ),
+    )
+    parser.add_argument(
+        "--compile-jobs",
+        action="store",
+        type=int,
+        default=None,
+        help=(
+            "How many files each package's build_ext compiles at once, unless the "
+            "package's build.py says otherwise. default: the CPUs available to the "
+            "container, divided by --jobs"
+        ),
+    )
+    parser.add_argument(
+        "--command-timeout",
+        action="store",
+        type=float,
+        default=None,
+        help=(
+            "Kill any one package build command (a pip install, a setup.py command) "
+            "that runs for longer than this many seconds. default: no limit"
+        ),
+    )
+    parser.add_argument(
+        "--package-timeout",
+        action="store",
+        type=float,
+        default=None,
+        help=(
+            "Kill a package's build if compiling it takes longer than this many "
+            "seconds. default: no limit"
+        ),
+    )
+    parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help=(
+            "Keep building other packages after one fails, and fail at the end if "
+            "any did"
+        ),
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store",
+        type=int,
+        default=0,
+        help=(
+            "How many upcoming packages to fetch and unpack in the background while "
+            "the current package compiles. Only used when --jobs is 1. default: 0"
+        ),
+    )
+    parser.add_argument(
+        "--stream-unpack",
+        action="store_true",
+        help=(
+            "Unpack tar sources as they download, rather than writing the whole "
+            "archive to disk first. Archives are still added to the download cache."
+        ),
+    )
+    parser.add_argument(
+        "--force-rebuild",
+        action="store_true",
+        help=(
+            "Build every package, even ones whose build inputs are unchanged since "
+            "their last build and whose wheel is still in the dist tree. Implies "
+            "--full-index"
+        ),
+    )
+    parser.add_argument(
+        "--full-index",
+        action="store_true",
+        help=(
+            "Rewrite the whole index, rather than just the parts whose distributions "
+            "changed since the last index build"
+        ),
+    )
+    parser.add_argument(
+        "--cache-root",
+        action="store",
+        default="./cache",
+        help="Location for caches that are kept between builds, like downloaded sources",
+    )
+    parser.add_argument(
+        "--download-cache-max-mb",
+        action="store",
+        type=int,
+        default=10240,
+        help=(
+            "How big the cache of downloaded sources may get, in MiB. The least "
+            "recently used sources are removed when it grows past this. default: 10240"
+        ),
+    )
+    parser.add_argument(
+        "--use-wheelhouse",
+        action="store_true",
+        help=(
+            "Install build dependencies only from the wheelhouse in the cache root, "
+            "which --build-type=prefetch-deps fills, without touching pypi"
+        ),
+    )
+    parser.add_argument(
+        "--no-ccache",
+        action="store_true",
+        help="Don't cache C and C++ compiles with ccache in the cache root",
+    )
+    parser.add_argument(
+        "--dist-placement",
+        action="store",
+        choices=DIST_PLACEMENTS,
+        default=DEFAULT_DIST_PLACEMENT,
+        help=(
+            "How to put wheels from the dist tree into the index. reflink and "
+            "hardlink share the file with the dist tree instead of copying it, and "
+            "copy if they can't (like when the trees are on different filesystems); "
+            "symlink links to the dist tree. auto tries a reflink, then a hardlink, "
+            "then copies. default: auto"
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        action="store",
+        default=None,
+        help=(
+            "Write a timeline of the build's phases (fetching, unpacking, venv setup, "
+            "each setup.py command, index hashing and copying) to this path, in the "
+            "Chrome trace event format that Perfetto and chrome://tracing load"
+        ),
+    )
+    parser.add_argument(
+        "--cache-volume",
+        action="store",
+        default=None,
+        help=(
+            "Name of a docker volume to keep caches in, instead of the cache root. "
+            "The volume outlives the build container, so later builds can use it."
+        ),
     )
 
     return parser
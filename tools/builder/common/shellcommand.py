@@ -1,15 +1,21 @@
 """builder.common.shellcommand: utilities for nicer shell processing"""
 
-import subprocess
+import codecs
+import collections
 import io
-import time
-from typing import List, Optional
+import os
+import selectors
+import subprocess
+from typing import Deque, List, Optional
 
 
 class ShellCommandFailed(RuntimeError):
     def __init__(
         self, command: str, returncode: int, message: str, output: str
     ) -> None:
+        # pass everything up so the exception survives pickling, which it needs
+        # to when it is raised in a package build worker process
+        super().__init__(command, returncode, message, output)
         self.command = command
         self.returncode = returncode
         self.message = message
@@ -22,6 +28,23 @@ class ShellCommandFailed(RuntimeError):
         return f"<ShellCommandFailed: {self.command} returned {self.returncode}>"
 
 
+class ShellCommandTimedOut(ShellCommandFailed):
+    """A shell command was killed because it ran for too long."""
+
+    def __str__(self) -> str:
+        return f"{self.message}: {self.command}"
+
+    def __repr__(self) -> str:
+        return f"<ShellCommandTimedOut: {self.command}: {self.message}>"
+
+
+# how much of a command's output run_simple keeps to report if it fails
+_TAIL_LINES = 200
+# how often run_simple checks whether the process exited while its output pipe
+# stays open, which happens when it leaves a child running
+_EXIT_CHECK_INTERVAL = 0.5
+
+
 def run_simple(
     args: List[str],
     name: str,
@@ -31,40 +54,92 @@ def run_simple(
 ) -> str:
     """Run a shell command simple enough to run with the list-args subprocess Popen.
 
-    Should stream the output of the process to output. Raises RuntimeError if the
-    process fails, and cancels the process and propagates KeyboardInterrupt.
+    Streams the output of the process to output if verbose. Returns the last
+    lines of output, and raises ShellCommandFailed with them if the process
+    fails. Cancels the process and propagates KeyboardInterrupt.
     """
     if verbose:
         print(" ".join(args), file=output)
     proc = subprocess.Popen(
         args,
-        bufsize=100,
         cwd=cwd,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        text=True,
     )
     if not proc.stdout:
         raise RuntimeError(f"failed to communicate with {name} process")
-    accumulated = []
+    tail = _OutputTail(_TAIL_LINES)
     try:
-        while proc.poll() is None:
-            # always read to prevent blocking on the pipe
-            procwrote = proc.stdout.readline()
-            accumulated.append(procwrote)
-            # but only echo if verbose
-            if verbose:
-                output.write(procwrote)
-                output.flush()
-            else:
-                time.sleep(0.1)
+        _drain(proc, tail, output if verbose else None)
+        proc.wait()
     except KeyboardInterrupt:
         proc.terminate()
+        proc.wait()
+        raise
+    finally:
+        proc.stdout.close()
     if proc.returncode != 0:
         raise ShellCommandFailed(
             command=" ".join(args),
             returncode=proc.returncode,
             message=f"{name} failed",
-            output="\n".join(accumulated),
+            output=tail.text(),
         )
-    return "\n".join(accumulated)
+    return tail.text()
+
+
+class _OutputTail:
+    """The last lines of a process's output, decoded as it arrives."""
+
+    def __init__(self, max_lines: int) -> None:
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._lines: Deque[str] = collections.deque(maxlen=max_lines)
+        self._partial = ""
+
+    def feed(self, data: bytes) -> str:
+        text = self._decoder.decode(data, final=not data)
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        self._lines.extend(lines)
+        return text
+
+    def text(self) -> str:
+        return "\n".join(list(self._lines) + ([self._partial] if self._partial else []))
+
+
+def _drain(
+    proc: "subprocess.Popen[bytes]",
+    tail: _OutputTail,
+    echo: Optional[io.TextIOBase],
+) -> None:
+    """Read the process's output as soon as it is written until the process
+    exits, echoing it if there's somewhere to echo it."""
+    assert proc.stdout
+    fd = proc.stdout.fileno()
+    os.set_blocking(fd, False)
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            ready = selector.select(timeout=_EXIT_CHECK_INTERVAL)
+            exited = proc.poll() is not None
+            if not ready and not exited:
+                continue
+            # once the process is gone, read whatever it left in the pipe and
+            # stop, even if something it started still holds the pipe open
+            if not _read_available(fd, tail, echo) or exited:
+                return
+
+
+def _read_available(fd: int, tail: _OutputTail, echo: Optional[io.TextIOBase]) -> bool:
+    """Read everything in the pipe right now. False if it's closed."""
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return True
+        text = tail.feed(data)
+        if echo and text:
+            echo.write(text)
+            echo.flush()
+        if not data:
+            return False
@@ -0,0 +1,156 @@
+"""
+builder.common.trace: record a timeline of the build
+
+Phases of the build (fetching a source, creating a venv, each setup.py command,
+hashing files for the index, ...) are wrapped in spans. While a trace is being
+recorded, each span adds begin and end events to it, which can be written out in
+the Chrome trace event format to load in Perfetto (ui.perfetto.dev) or
+chrome://tracing. When nothing is recording, spans do nothing.
+
+Besides spans, the build can note facts about what it did (how many bytes it
+downloaded, whether a cache hit) as instant events, which the build report
+reads back out of the trace.
+
+Each span goes on the track of whatever is running it - a package, or the
+index build - so that every package gets its own row in the timeline. Workers
+in other processes record their own traces and send the events back, to be
+merged into the main one.
+
+This is in common so that it can be used anywhere, which means it can only use
+the standard library.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+Event = Dict[str, Any]
+
+MAIN_TRACK = "build"
+INDEX_TRACK = "index"
+
+# what's recording, if anything. this is process-wide rather than a context var
+# so that spans in thread pool threads are recorded without any extra work.
+_recording: Optional["Trace"] = None
+_track = ContextVar("opentrons_build_trace_track", default=MAIN_TRACK)
+
+
+class Trace:
+    """The events recorded so far."""
+
+    def __init__(self) -> None:
+        self.events: List[Event] = []
+        self._lock = threading.Lock()
+
+    def add(self, event: Event) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def merge(self, events: List[Event]) -> None:
+        """Add events recorded somewhere else, like a worker process."""
+        with self._lock:
+            self.events.extend(events)
+
+    def write(self, path: str) -> None:
+        """Write the trace as a Chrome trace event JSON file."""
+        with self._lock:
+            events = list(self.events)
+        # tracks are threads of a single process in the trace format, and they
+        # are numbered in the order they first appear
+        track_ids: Dict[str, int] = {}
+        trace_events: List[Event] = [_metadata("process_name", 0, "package build")]
+        for event in events:
+            track = event["track"]
+            if track not in track_ids:
+                track_ids[track] = len(track_ids)
+                trace_events.append(_metadata("thread_name", track_ids[track], track))
+            entry = {key: value for key, value in event.items() if key != "track"}
+            entry.update(pid=0, tid=track_ids[track])
+            trace_events.append(entry)
+        with open(path, "w") as trace_file:
+            json.dump(
+                {"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file
+            )
+
+
+def _metadata(name: str, tid: int, value: str) -> Event:
+    return {"name": name, "ph": "M", "pid": 0, "tid": tid, "args": {"name": value}}
+
+
+def _now_us() -> int:
+    # the monotonic clock is shared by every process on the machine, so events
+    # from workers line up with the main process's
+    return time.monotonic_ns() // 1000
+
+
+@contextmanager
+def recording() -> Iterator[Trace]:
+    """Record spans into a new trace for as long as this is entered."""
+    global _recording
+    previous = _recording
+    _recording = Trace()
+    try:
+        yield _recording
+    finally:
+        _recording = previous
+
+
+def recording_active() -> bool:
+    """Whether there's a trace to record to, for spans and notes whose details
+    take work to find out."""
+    return _recording is not None
+
+
+def note(name: str, *, track: Optional[str] = None, **args: Any) -> None:
+    """Record a fact about the build, with the details in args, on the current
+    track or the named one."""
+    trace = _recording
+    if trace is None:
+        return
+    trace.add(
+        {
+            "name": name,
+            "ph": "i",
+            "s": "t",
+            "ts": _now_us(),
+            "track": track or _track.get(),
+            "args": args,
+        }
+    )
+
+
+def merge(events: List[Event]) -> None:
+    """Add events recorded somewhere else to the trace being recorded, if any."""
+    trace = _recording
+    if trace is not None:
+        trace.merge(events)
+
+
+@contextmanager
+def track(name: str) -> Iterator[None]:
+    """Put the spans in this block on the named track."""
+    token = _track.set(name)
+    try:
+        yield
+    finally:
+        _track.reset(token)
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Iterator[None]:
+    """Record the time this block takes as a phase of the build. args are shown
+    with the span in the trace viewer."""
+    trace = _recording
+    if trace is None:
+        yield
+        return
+    track_name = _track.get()
+    trace.add(
+        {"name": name, "ph": "B", "ts": _now_us(), "track": track_name, "args": args}
+    )
+    try:
+        yield
+    finally:
+        trace.add({"name": name, "ph": "E", "ts": _now_us(), "track": track_name})
@@ -3,15 +3,22 @@ builder.container.run: run the build inside a container
 """
 import argparse
 import io
-from typing import Literal
+from contextlib import contextmanager
+from typing import Iterator, Literal
 from pathlib import Path
-from builder.common import args
+from builder.common import args, trace
 from builder import __version__
-from builder.package_build.orchestrate import discover_build_packages_sync
+from builder.package_build.orchestrate import (
+    discover_build_packages_sync,
+    prefetch_build_dependencies,
+)
+from builder.package_build.report import REPORT_NAME, write_report
 from builder.package_build.types import GlobalBuildContext
 from builder.common.shellcommand import ShellCommandFailed
 from builder.generate_index import generate as build_index
+from builder.generate_index.placement import DEFAULT_DIST_PLACEMENT, DistPlacement
 import sys
+import time
 
 
 def run_from_cmdline() -> None:
@@ -46,6 +53,25 @@ def run_from_cmdline() -> None:
             parsed_args.build_type,
             parsed_args.output,
             parsed_args.verbose,
+            jobs=parsed_args.jobs,
+            compile_jobs=parsed_args.compile_jobs,
+            command_timeout=parsed_args.command_timeout,
+            package_timeout=parsed_args.package_timeout,
+            keep_going=parsed_args.keep_going,
+            prefetch=parsed_args.prefetch,
+            stream_unpack=parsed_args.stream_unpack,
+            force_rebuild=parsed_args.force_rebuild,
+            full_index=parsed_args.full_index,
+            cache_root=_ensure_path(repo_base, Path(parsed_args.cache_root)),
+            download_cache_max_bytes=parsed_args.download_cache_max_mb * 2**20,
+            use_wheelhouse=parsed_args.use_wheelhouse,
+            ccache=not parsed_args.no_ccache,
+            dist_placement=parsed_args.dist_placement,
+            trace_path=(
+                _ensure_path(repo_base, Path(parsed_args.trace))
+                if parsed_args.trace
+                else None
+            ),
         )
     except ShellCommandFailed as scf:
         # Invert the usual verbosity logic here because if we're verbose, then
@@ -83,9 +109,25 @@ def run_build(
     dist_tree_root: Path,
     index_tree_root: Path,
     index_root_url: str,
-    build_type: Literal["packages-only", "index-only", "both"],
+    build_type: Literal["packages-only", "index-only", "both", "prefetch-deps"],
     output: io.TextIOBase,
     verbose: bool,
+    *,
+    jobs: int = 1,
+    compile_jobs: int | None = None,
+    command_timeout: float | None = None,
+    package_timeout: float | None = None,
+    keep_going: bool = False,
+    prefetch: int = 0,
+    stream_unpack: bool = False,
+    force_rebuild: bool = False,
+    full_index: bool = False,
+    cache_root: Path | None = None,
+    download_cache_max_bytes: int = 10 * 2**30,
+    use_wheelhouse: bool = False,
+    ccache: bool = True,
+    dist_placement: DistPlacement = DEFAULT_DIST_PLACEMENT,
+    trace_path: Path | None = None,
 ) -> None:
     """Run the build.
 
@@ -99,17 +141,117 @@ def run_build(
     dist_tree_root: path to the tree where distributables should go
     output: a text io that can be used to write build logs
     verbose: whether those logs should be verbose
+    jobs: how many packages to build at once
+    compile_jobs: how many files each package compiles at once, or None for auto
+    command_timeout: seconds any one build command may run for, or None
+    package_timeout: seconds a package's compile may take, or None
+    keep_going: whether to keep building other packages after one fails
+    prefetch: how many upcoming packages to fetch while one compiles, if jobs is 1
+    stream_unpack: whether to unpack tar sources while they download
+    force_rebuild: build packages even if they're up to date, and rewrite the
+        whole index
+    full_index: rewrite the whole index, not just what changed since the last
+        index build
+    cache_root: path to the tree of caches kept between builds, or None to not cache
+    download_cache_max_bytes: the size limit of the downloaded source cache
+    use_wheelhouse: whether to install build dependencies only from the wheelhouse
+    ccache: whether to cache compiles with ccache
+    dist_placement: how wheels are put in the index (see generate_index.placement)
+    trace_path: where to write a Chrome trace event timeline of the build, or None
+
+    If packages are built, a JSON report of the build is written next to the dist
+    tree.
     """
+    build_report = None
     if build_type in ("packages-only", "both"):
-        print(f"Building with tools version {__version__}", file=output)
-        context = GlobalBuildContext(
-            output=output, verbose=verbose, sdk_path=buildroot_sdk_base
+        build_report = dist_tree_root.parent / REPORT_NAME
+    context = GlobalBuildContext(
+        output=output,
+        verbose=verbose,
+        sdk_path=buildroot_sdk_base,
+        jobs=jobs,
+        compile_jobs=compile_jobs,
+        command_timeout=command_timeout,
+        package_timeout=package_timeout,
+        keep_going=keep_going,
+        prefetch=prefetch,
+        stream_unpack=stream_unpack,
+        force_rebuild=force_rebuild,
+        cache_root=cache_root,
+        download_cache_max_bytes=download_cache_max_bytes,
+        use_wheelhouse=use_wheelhouse,
+        ccache=ccache,
+        trace_path=trace_path,
+        build_report=build_report,
+    )
+    with _recorded(trace_path, build_report, output):
+        _run_build_type(
+            build_type,
+            package_tree_root,
+            build_tree_root,
+            dist_tree_root,
+            index_tree_root,
+            index_root_url,
+            output,
+            context=context,
+            full_index=full_index or force_rebuild,
+            dist_placement=dist_placement,
         )
+
+
+@contextmanager
+def _recorded(
+    trace_path: Path | None, build_report: Path | None, output: io.TextIOBase
+) -> Iterator[None]:
+    """Record a trace of the build in this block, and write the trace and the
+    build report from it when it ends - even if the build fails, since that's
+    when they're most useful."""
+    started = time.monotonic()
+    with trace.recording() as recorded:
+        try:
+            yield
+        finally:
+            if trace_path:
+                recorded.write(str(trace_path))
+                print(f"Wrote build trace to {trace_path}", file=output)
+            if build_report:
+                write_report(build_report, recorded.events, time.monotonic() - started)
+                print(f"Wrote build report to {build_report}", file=output)
+
+
+def _run_build_type(
+    build_type: Literal["packages-only", "index-only", "both", "prefetch-deps"],
+    package_tree_root: Path,
+    build_tree_root: Path,
+    dist_tree_root: Path,
+    index_tree_root: Path,
+    index_root_url: str,
+    output: io.TextIOBase,
+    *,
+    context: GlobalBuildContext,
+    full_index: bool,
+    dist_placement: DistPlacement,
+) -> None:
+    if build_type == "prefetch-deps":
+        print("Prefetching build dependencies", file=output)
+        prefetch_build_dependencies(
+            package_tree_root, build_tree_root, dist_tree_root, context=context
+        )
+        print(f"Build dependencies are in {context.wheelhouse}", file=output)
+    if build_type in ("packages-only", "both"):
+        print(f"Building with tools version {__version__}", file=output)
         discover_build_packages_sync(
             package_tree_root, build_tree_root, dist_tree_root, context=context
         )
         print("Package build complete!", file=output)
     if build_type in ("index-only", "both"):
         print("Building pypi index", file=output)
-        index_files = build_index(index_root_url, index_tree_root, dist_tree_root)
+        with trace.track(trace.INDEX_TRACK), trace.span("generate index"):
+            index_files = build_index(
+                index_root_url,
+                index_tree_root,
+                dist_tree_root,
+                incremental=not full_index,
+                placement=dist_placement,
+            )
         print(f"Index build complete in {index_files[0]}", file=output)
@@ -0,0 +1,125 @@
+"""
+generate_index.dist_cache: remember what's in each distribution between index builds
+
+Generating the index needs the sha256 and the project name of every
+distribution, which means reading every wheel in full and opening each one to
+read its metadata. A wheel never changes once it's built, so what was read from
+it is kept in a sidecar cache file in the dist tree and reused for as long as
+the file has the same path, size, modification time and inode.
+"""
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Iterable
+
+from pkginfo import Wheel  # type: ignore
+
+from builder.common import trace
+from .package_leaf import hash_distributions
+
+CACHE_NAME = ".index-dist-cache.json"
+
+
+@dataclass(frozen=True)
+class DistInfo:
+    sha256: str
+    #: The sha256 hex digest of the distribution
+    name: str
+    #: The project name, normalized as in PEP 503
+    version: str
+    #: The project version
+    requires_python: str | None
+    #: The distribution's Requires-Python, if it has one
+    metadata: str
+    #: The distribution's core metadata (a wheel's METADATA file)
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a project name as in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def read_dist_info(dist: Path, digest: str) -> DistInfo:
+    wheel = Wheel(str(dist))
+    if not wheel.name or not wheel.version:
+        raise ValueError(f"{dist} has no name or version in its metadata")
+    return DistInfo(
+        sha256=digest,
+        name=normalize_name(wheel.name),
+        version=wheel.version,
+        requires_python=wheel.requires_python,
+        metadata=wheel.read().decode("utf-8", errors="replace"),
+    )
+
+
+class DistInfoCache:
+    """
+    DistInfo for distributions, by path, along with the size, modification time
+    and inode each distribution had when it was read. If the cache has no path,
+    nothing is kept between index builds.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self._path = path
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._used: set[str] = set()
+        if path is None:
+            return
+        try:
+            entries = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    def lookup(self, dists: Iterable[Path]) -> dict[Path, DistInfo]:
+        """DistInfo for each distribution, read from the ones that aren't cached
+        or that changed since they were."""
+        found: dict[Path, DistInfo] = {}
+        misses: list[Path] = []
+        for dist in dists:
+            cached = self._cached(dist)
+            if cached:
+                found[dist] = cached
+            else:
+                misses.append(dist)
+        with trace.span("read distributions", cached=len(found), read=len(misses)):
+            for dist, digest in hash_distributions(misses).items():
+                found[dist] = read_dist_info(dist, digest)
+                self._entries[str(dist)] = dict(
+                    asdict(found[dist]), stat=_stat_key(dist)
+                )
+        self._used.update(str(dist) for dist in found)
+        return found
+
+    def _cached(self, dist: Path) -> DistInfo | None:
+        entry = self._entries.get(str(dist))
+        if not entry or entry.get("stat") != _stat_key(dist):
+            return None
+        try:
+            return DistInfo(
+                **{key: value for key, value in entry.items() if key != "stat"}
+            )
+        except TypeError:
+            # written by a version of the builder with a different DistInfo
+            return None
+
+    def save(self) -> None:
+        """Write out the entries for the distributions looked up since the cache
+        was loaded, forgetting any that weren't."""
+        if self._path is None:
+            return
+        entries = {
+            path: entry for path, entry in self._entries.items() if path in self._used
+        }
+        temporary = self._path.with_name(f".{self._path.name}.{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(entries))
+        os.replace(temporary, self._path)
+
+
+def _stat_key(dist: Path) -> list[int]:
+    stat = dist.stat()
+    # a list rather than a tuple so it compares equal after a trip through json
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
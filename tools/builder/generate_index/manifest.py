@@ -0,0 +1,66 @@
+"""
+generate_index.manifest: what the last index build put in the index
+
+Each index build records where the index is, the url it was generated for, how
+distributions were placed in it, and the files in each project's leaf directory
+with their sha256 digests. The next build compares the distributions it has
+against that to find which pages need to be rewritten, so that everything else
+in the index is left alone.
+
+The manifest is kept in the dist tree rather than the index, since everything in
+the index gets published.
+"""
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+MANIFEST_NAME = ".index-manifest.json"
+
+
+@dataclass
+class IndexManifest:
+    index_root: str
+    #: The directory the index was generated in
+    index_root_url: str
+    #: The url the index was generated to be served from
+    projects: dict[str, dict[str, str]]
+    #: For each project, the sha256 hex digest of each file in its leaf
+    #: directory, by file name
+    placement: str = "copy"
+    #: How distributions were put in the index (see placement.place_dist)
+
+    @classmethod
+    def load(cls, manifest_path: Path) -> "IndexManifest | None":
+        """The manifest the last index build wrote, if there is one."""
+        try:
+            recorded = json.loads(manifest_path.read_text())
+            return cls(
+                index_root=str(recorded["index_root"]),
+                index_root_url=str(recorded["index_root_url"]),
+                projects={
+                    str(project): {
+                        str(name): str(digest) for name, digest in files.items()
+                    }
+                    for project, files in recorded["projects"].items()
+                },
+                placement=str(recorded["placement"]),
+            )
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def write(self, manifest_path: Path) -> None:
+        temporary = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+        temporary.write_text(
+            json.dumps(
+                {
+                    "index_root": self.index_root,
+                    "index_root_url": self.index_root_url,
+                    "projects": self.projects,
+                    "placement": self.placement,
+                },
+                indent=2,
+                sort_keys=True,
+            )
+        )
+        os.replace(temporary, manifest_path)
@@ -2,23 +2,55 @@
 
 from pathlib import Path
 from pkginfo import Wheel  # type: ignore
-from shutil import copyfile
+from shutil import rmtree
 from glob import iglob
 from itertools import chain
-from typing import Iterable, Iterator
-from .root_index import generate as generate_root
-from .package_leaf import generate as generate_leaf
+from typing import Container, Iterable, Iterator, Mapping
+from .manifest import MANIFEST_NAME, IndexManifest
+from .placement import DistPlacement, place_dist
+from .root_index import generate as generate_root, generate_json as generate_root_json
+from .package_leaf import generate as generate_leaf, generate_json as generate_leaf_json
+from .dist_cache import (
+    CACHE_NAME as DIST_CACHE_NAME,
+    DistInfo,
+    DistInfoCache,
+    normalize_name,
+)
 from collections import defaultdict
 from urllib.parse import urljoin
 
+from builder.common import trace
 
-def generate(index_root_url: str, index_root: Path, dist_root: Path) -> list[Path]:
+
+def generate(
+    index_root_url: str,
+    index_root: Path,
+    dist_root: Path,
+    incremental: bool = False,
+    placement: DistPlacement = "copy",
+) -> list[Path]:
     """
     Inspect a tree of package distributions and build an index in index_root for them.
+
+    What's read from each distribution is cached in the dist tree, so that
+    distributions that haven't changed since the last index build aren't read
+    again, and so is the manifest of what that build put in the index. If
+    incremental, only the parts of the index whose distributions changed
+    since the last index build are written. placement is how distributions are
+    put in the index. See generate_for_distributions for both.
     """
-    return generate_for_distributions(
-        index_root_url, index_root, distributions_from_tree(dist_root)
+    dist_cache = DistInfoCache(dist_root / DIST_CACHE_NAME)
+    index_files = generate_for_distributions(
+        index_root_url,
+        index_root,
+        distributions_from_tree(dist_root),
+        dist_cache,
+        manifest_path=dist_root / MANIFEST_NAME,
+        incremental=incremental,
+        placement=placement,
     )
+    dist_cache.save()
+    return index_files
 
 
 def distributions_from_tree(dist_root: Path) -> Iterator[Path]:
@@ -27,7 +59,13 @@ def distributions_from_tree(dist_root: Path) -> Iterator[Path]:
 
 
 def generate_for_distributions(
-    index_root_url: str, index_root_path: Path, distributions: Iterable[Path]
+    index_root_url: str,
+    index_root_path: Path,
+    distributions: Iterable[Path],
+    dist_cache: DistInfoCache | None = None,
+    manifest_path: Path | None = None,
+    incremental: bool = False,
+    placement: DistPlacement = "copy",
 ) -> list[Path]:
     """
     Generate an index for a list of packages in a root path.
@@ -48,32 +86,158 @@ def generate_for_distributions(
                      That means files will be under index_root/simple/.
     distributions: A list of paths to package distributions. A package might have
                    multiple distributions.
+    dist_cache: Where to look up what's in the distributions, so that ones that
+                were read before don't have to be read again. If not given, every
+                distribution is read.
+    manifest_path: Where to keep the manifest of what's in the index (see
+                   manifest.IndexManifest), outside the index so that it isn't
+                   published with it. If not given, there's no manifest, so every
+                   page is written and projects from earlier builds aren't removed.
+    incremental: Whether to only update what changed since the last index build in
+                 index_root_path, as recorded in the manifest: leaf directories
+                 whose files changed, and the root page if the projects changed.
+                 Files for everything else are left untouched. Otherwise, every
+                 page and distribution is written.
+    placement: How to put distributions in the index: copy them, or share them
+               with the dist tree by reflink, hardlink or symlink, or auto to
+               share them any way the filesystem allows. See placement.place_dist.
 
     Returns
     -------
     A list of paths to each file and directory in the index, with the root as the first.
+
+    Each page is written both as PEP503 html (index.html) and PEP691 json
+    (index.json), from the same distributions.
     """
-    by_package = collate_to_packages(distributions)
+    # read every distribution at once, rather than a package at a time, so the
+    # hashing pool stays busy even when most packages only have one or two
+    dist_infos = (dist_cache or DistInfoCache()).lookup(distributions)
+    by_package = collate_to_packages(dist_infos.keys(), dist_infos)
+    digests = {dist: info.sha256 for dist, info in dist_infos.items()}
     if not index_root_url.endswith("/"):
         index_root_url += "/"
-    return (
+    manifest = IndexManifest(
+        index_root=str(index_root_path.resolve()),
+        index_root_url=index_root_url,
+        projects={
+            package: {dist.name: digests[dist] for dist in dists}
+            for package, dists in by_package.items()
+        },
+        placement=placement,
+    )
+    previous = IndexManifest.load(manifest_path) if manifest_path else None
+    if previous and previous.index_root != manifest.index_root:
+        # it's about some other index
+        previous = None
+    # if the url changed, so did every link in the index, and if the placement
+    # changed, every distribution has to be placed again
+    reuse = bool(
+        incremental
+        and previous
+        and previous.index_root_url == index_root_url
+        and previous.placement == placement
+    )
+    index_files = (
         [index_root_path]
-        + generate_simple_index_dir(
-            index_root_url,
-            index_root_path,
-            package_dirs_from_names(index_root_path, by_package.keys()),
+        + _update_simple_index_dir(
+            index_root_url, index_root_path, manifest, previous if reuse else None
         )
         + list(
             chain.from_iterable(
                 [
-                    generate_and_fill_package_dir(
-                        index_root_url, index_root_path, package, dists
+                    _update_package_dir(
+                        index_root_url,
+                        index_root_path,
+                        package,
+                        by_package[package],
+                        dist_infos,
+                        previous.projects.get(package) if previous else None,
+                        reuse=reuse,
+                        placement=placement,
                     )
-                    for package, dists in by_package.items()
+                    for package in sorted(by_package)
                 ]
             )
         )
     )
+    if previous:
+        _remove_projects(index_root_path, previous.projects.keys() - by_package.keys())
+    if manifest_path:
+        manifest.write(manifest_path)
+    return index_files
+
+
+def _update_simple_index_dir(
+    index_root_url: str,
+    index_root_path: Path,
+    manifest: IndexManifest,
+    previous: IndexManifest | None,
+) -> list[Path]:
+    """Write the root page, unless the previous build wrote one with the same
+    projects."""
+    simple_fs_root = simple_root_from_index_root(index_root_path)
+    index_pages = [simple_fs_root / "index.html", simple_fs_root / "index.json"]
+    if (
+        previous
+        and previous.projects.keys() == manifest.projects.keys()
+        and all(page.exists() for page in index_pages)
+    ):
+        return [simple_fs_root] + index_pages
+    return generate_simple_index_dir(
+        index_root_url,
+        index_root_path,
+        package_dirs_from_names(index_root_path, sorted(manifest.projects)),
+    )
+
+
+def _update_package_dir(
+    index_root_url: str,
+    index_root_path: Path,
+    package_name: str,
+    dists: set[Path],
+    dist_infos: Mapping[Path, DistInfo],
+    previous_files: Mapping[str, str] | None,
+    *,
+    reuse: bool,
+    placement: DistPlacement,
+) -> list[Path]:
+    """Fill and write a project's leaf directory, unless it can reuse what the
+    previous build wrote and that had the same files. Files the previous build
+    put there that aren't distributions anymore are removed either way."""
+    package_dir = simple_root_from_index_root(index_root_path) / package_name
+    leaf_files = [package_dir / dist.name for dist in sorted(dists)]
+    leaf_pages = [package_dir / "index.html", package_dir / "index.json"]
+    current_files = {dist.name: dist_infos[dist].sha256 for dist in dists}
+    previous_files = previous_files or {}
+    if (
+        reuse
+        and previous_files == current_files
+        and all(path.exists() for path in leaf_files + leaf_pages)
+    ):
+        return [package_dir] + leaf_pages + leaf_files
+    for name in previous_files.keys() - current_files.keys():
+        (package_dir / name).unlink(missing_ok=True)
+    return generate_and_fill_package_dir(
+        index_root_url,
+        index_root_path,
+        package_name,
+        dists,
+        dist_infos,
+        unchanged={
+            name
+            for name, digest in previous_files.items()
+            if reuse and current_files.get(name) == digest
+        },
+        placement=placement,
+    )
+
+
+def _remove_projects(index_root_path: Path, projects: Iterable[str]) -> None:
+    """Remove the leaf directories of projects that are gone from the dist tree."""
+    for project in projects:
+        rmtree(
+            simple_root_from_index_root(index_root_path) / project, ignore_errors=True
+        )
 
 
 def simple_root_from_index_root(index_root: Path) -> Path:
@@ -97,6 +261,7 @@ def package_dirs_from_names(
 def generate_simple_index_dir(
     index_root_url: str, index_root_path: Path, package_dirs: Iterable[Path]
 ) -> list[Path]:
+    package_dirs = list(package_dirs)
     simple_fs_root = simple_root_from_index_root(index_root_path)
     simple_fs_root.mkdir(parents=True, exist_ok=True)
     simple_url_root = simple_url_from_index_url(index_root_url)
@@ -106,43 +271,87 @@ def generate_simple_index_dir(
     simple_root_index_path = simple_fs_root / "index.html"
     with open(simple_root_index_path, "w") as simple_root_index:
         simple_root_index.write(simple_root_index_contents)
-    return [simple_fs_root, simple_root_index_path]
+    simple_root_json_path = simple_fs_root / "index.json"
+    with open(simple_root_json_path, "w") as simple_root_json:
+        simple_root_json.write(generate_root_json(package_dirs))
+    return [simple_fs_root, simple_root_index_path, simple_root_json_path]
 
 
 def generate_and_fill_package_dir(
-    index_root_url: str, index_root_path: Path, package_name: str, dists: set[Path]
+    index_root_url: str,
+    index_root_path: Path,
+    package_name: str,
+    dists: set[Path],
+    dist_infos: Mapping[Path, DistInfo] | None = None,
+    unchanged: Container[str] = (),
+    placement: DistPlacement = "copy",
 ) -> list[Path]:
+    if dist_infos is None:
+        dist_infos = DistInfoCache().lookup(dists)
+    digests = {dist: dist_infos[dist].sha256 for dist in dists}
     simple_fs_root = simple_root_from_index_root(index_root_path)
     package_dir = simple_fs_root / package_name
     package_dir.mkdir(parents=True, exist_ok=True)
-    dists_in_package = list(copy_dists_to_leaf(package_dir, dists))
+    dists_in_package = list(
+        copy_dists_to_leaf(package_dir, sorted(dists), unchanged, digests, placement)
+    )
     simple_root_url = simple_url_from_index_url(index_root_url)
     package_url = urljoin(simple_root_url, f"{package_dir.name}/")
+    digests_by_name = {dist.name: digest for dist, digest in digests.items()}
     leaf_index_contents = generate_leaf(
-        package_url,
-        package_dir,
-        dists_in_package,
+        package_url, package_dir, dists_in_package, digests_by_name
     )
     leaf_index_path = package_dir / "index.html"
     with open(leaf_index_path, "w") as leaf_index:
         leaf_index.write(leaf_index_contents)
-    return [package_dir, leaf_index_path] + dists_in_package
+    leaf_json_contents = generate_leaf_json(
+        package_url,
+        package_dir,
+        dists_in_package,
+        digests_by_name,
+        {dist.name: dist_infos[dist].requires_python for dist in dists},
+    )
+    leaf_json_path = package_dir / "index.json"
+    with open(leaf_json_path, "w") as leaf_json:
+        leaf_json.write(leaf_json_contents)
+    return [package_dir, leaf_index_path, leaf_json_path] + dists_in_package
 
 
-def copy_dists_to_leaf(package_dir: Path, dists: Iterable[Path]) -> Iterator[Path]:
-    """Copy distribution files to the leaf directory"""
+def copy_dists_to_leaf(
+    package_dir: Path,
+    dists: Iterable[Path],
+    unchanged: Container[str] = (),
+    digests: Mapping[Path, str] | None = None,
+    placement: DistPlacement = "copy",
+) -> Iterator[Path]:
+    """Place distribution files in the leaf directory (see place_dist), except
+    the ones named in unchanged that are already there."""
     for dist in dists:
         target_path = package_dir / dist.name
-        copyfile(dist, target_path)
+        if dist.name not in unchanged or not target_path.exists():
+            with trace.span("place", file=dist.name, placement=placement):
+                place_dist(
+                    dist,
+                    target_path,
+                    digests.get(dist) if digests else None,
+                    placement,
+                )
         yield target_path
 
 
-def collate_to_packages(distributions: Iterable[Path]) -> dict[str, set[Path]]:
+def collate_to_packages(
+    distributions: Iterable[Path], dist_infos: Mapping[Path, DistInfo] | None = None
+) -> dict[str, set[Path]]:
     """
-    Turns the flat list of paths to distributions into a mapping of package names to
-    a set of distributions for the package.
+    Turns the flat list of paths to distributions into a mapping of normalized
+    package names to a set of distributions for the package. The names come from
+    dist_infos if they're there, and the distributions' metadata if not.
     """
     result: defaultdict[str, set[Path]] = defaultdict(set)
     for dist in distributions:
-        result[Wheel(dist).name].add(dist)
+        if dist_infos and dist in dist_infos:
+            name = dist_infos[dist].name
+        else:
+            name = normalize_name(str(Wheel(dist).name))
+        result[name].add(dist)
     return result
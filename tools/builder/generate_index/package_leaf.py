@@ -1,17 +1,28 @@
 """generate_index.package_leaf: generate metadata in a package leaf dir"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from hashlib import sha256
-from typing import Iterable
-from binascii import hexlify
+from typing import Iterable, Mapping
 from urllib.parse import urljoin
 
 from airium import Airium  # type: ignore[import]
 
+from builder.common import trace
+from .root_index import API_VERSION
+
+# how much of a file to hash at once. big enough that the loop overhead
+# doesn't matter, small enough that hashing lots of files at once doesn't need
+# much memory
+_HASH_CHUNK_BYTES = 1024 * 1024
+
 
 def generate(
     package_url: str,
     package_path: Path,
     distributions: Iterable[Path],
+    digests: Mapping[str, str] | None = None,
 ) -> str:
     """Generate a package leaf directory with index and hashes
 
@@ -22,11 +33,19 @@ def generate(
     distributions: iterable of the files to serve for the package. these paths should be true
                    filesystem paths (we need to read the files to get their hex digests) and
                    should be in the package directory.
+    digests: the sha256 hex digests of the distributions by file name, if they were
+             already hashed (see hash_distributions). otherwise, they're hashed here.
 
     Returns
     -------
     The generated html file
     """
+    distributions = list(distributions)
+    if digests is None:
+        digests = {
+            dist.name: digest
+            for dist, digest in hash_distributions(distributions).items()
+        }
     idx = Airium()
     idx("<!DOCTYPE html>")
     with idx.html():
@@ -35,17 +54,93 @@ def generate(
                 idx(f"{package_path.name} at Opentrons Python Package Index")
         with idx.body():
             for dist in distributions:
-                digest = hexlify(sha256(open(dist, "rb").read()).digest())
                 with idx.a(
                     href=(
                         str(
                             urljoin(
                                 package_url,
                                 str(dist.relative_to(package_path))
-                                + f"#sha256={digest.decode()}",
+                                + f"#sha256={digests[dist.name]}",
                             )
                         )
                     )
                 ):
                     idx(dist.name)
     return str(idx)
+
+
+def generate_json(
+    package_url: str,
+    package_path: Path,
+    distributions: Iterable[Path],
+    digests: Mapping[str, str],
+    requires_python: Mapping[str, str | None] | None = None,
+) -> str:
+    """Generate a PEP691 (with PEP700) compliant JSON project page.
+
+    Params
+    ------
+    package_url: the url that locates the package directory
+    package_path: the path to the package directory
+    distributions: iterable of the files to serve for the package, in the package
+                   directory. their sizes are read from the filesystem.
+    digests: the sha256 hex digests of the distributions by file name
+    requires_python: the Requires-Python of the distributions by file name, for
+                     the ones that have one
+
+    Returns
+    -------
+    The generated json file
+    """
+    requires_python = requires_python or {}
+    files = []
+    versions: set[str] = set()
+    for dist in distributions:
+        file = {
+            "filename": dist.name,
+            "url": str(urljoin(package_url, str(dist.relative_to(package_path)))),
+            "hashes": {"sha256": digests[dist.name]},
+            "yanked": False,
+            "size": dist.stat().st_size,
+        }
+        if requires_python.get(dist.name):
+            file["requires-python"] = requires_python[dist.name]
+        files.append(file)
+        # a wheel's file name is its project name, then its version
+        versions.add(dist.name.split("-")[1])
+    return json.dumps(
+        {
+            "meta": {"api-version": API_VERSION},
+            "name": package_path.name,
+            "versions": sorted(versions),
+            "files": files,
+        }
+    )
+
+
+def hash_distributions(
+    distributions: Iterable[Path], max_workers: int | None = None
+) -> dict[Path, str]:
+    """The sha256 hex digest of each distribution.
+
+    Files are hashed a chunk at a time across a pool of threads. hashlib releases
+    the GIL while it hashes, so the threads really do hash in parallel.
+    """
+    distributions = list(distributions)
+    if not distributions:
+        return {}
+    workers = max_workers or min(len(distributions), os.cpu_count() or 1)
+    with trace.span("hash", files=len(distributions)):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(distributions, executor.map(file_sha256, distributions)))
+
+
+def file_sha256(path: Path) -> str:
+    """The sha256 hex digest of a file, read in chunks into a reused buffer."""
+    digest = sha256()
+    buffer = bytearray(_HASH_CHUNK_BYTES)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as distfile:
+        while read := distfile.readinto(buffer):
+            digest.update(view[:read])
+    return digest.hexdigest()
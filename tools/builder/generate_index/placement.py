@@ -0,0 +1,111 @@
+"""
+generate_index.placement: put distributions from the dist tree into the index
+
+Copying every wheel into the index doubles the disk space and I/O the wheels
+take. When the dist tree and the index are on the same filesystem, a
+distribution can instead be a copy-on-write clone (a reflink, on filesystems like
+btrfs and xfs) or a hardlink of the file in the dist tree, which takes no extra
+space and no time to write. A symlink works anywhere, as long as the dist tree
+is served alongside the index.
+
+Sharing the file is safe because package builds never write into a wheel in the
+dist tree: a rebuilt wheel is built elsewhere and then replaces the old one as a
+new file (see package_build.orchestrate.compile_package), so the index keeps the
+wheel it was generated from until the index is generated again.
+
+Whatever the placement, a distribution that's already in the index with the same
+content is left alone, unless it's there as a symlink and shouldn't be (or the
+other way around), or it should be a hardlink of the distribution and isn't.
+"""
+import errno
+import fcntl
+import os
+from pathlib import Path
+from shutil import copyfile
+from typing import Callable, Literal, get_args
+
+from .package_leaf import file_sha256
+
+DistPlacement = Literal["auto", "copy", "hardlink", "reflink", "symlink"]
+DIST_PLACEMENTS: tuple[str, ...] = get_args(DistPlacement)
+#: What builds place distributions with unless they're told otherwise
+DEFAULT_DIST_PLACEMENT: DistPlacement = "auto"
+
+# from linux/fs.h; the fcntl module doesn't have it
+_FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+# errors that mean a link or clone can't be made here, so a copy is needed
+_CANT_SHARE = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL}
+
+
+def place_dist(
+    source: Path, target: Path, digest: str | None, placement: DistPlacement
+) -> str | None:
+    """
+    Put a distribution at target, unless it's already there with the same size
+    and sha256 digest (if digest is given).
+
+    auto tries a reflink, then a hardlink, then copies. reflink and hardlink fall
+    back to copying when the dist tree and the index can't share the file, like
+    when they're on different filesystems.
+
+    Returns how the file was placed, or None if it was already there.
+    """
+    if _identical(source, target, digest, placement):
+        return None
+    temporary = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    temporary.unlink(missing_ok=True)
+    try:
+        method = _place(source, temporary, placement)
+        os.replace(temporary, target)
+    finally:
+        temporary.unlink(missing_ok=True)
+    return method
+
+
+def _identical(
+    source: Path, target: Path, digest: str | None, placement: DistPlacement
+) -> bool:
+    # switching to or from symlinks replaces everything
+    if target.is_symlink() != (placement == "symlink"):
+        return False
+    try:
+        if os.path.samefile(source, target):
+            return True
+        if placement == "hardlink":
+            return False
+        if source.stat().st_size != target.stat().st_size:
+            return False
+    except FileNotFoundError:
+        return False
+    return digest is not None and file_sha256(target) == digest
+
+
+def _place(source: Path, target: Path, placement: DistPlacement) -> str:
+    if placement == "symlink":
+        # relative, so the index and dist tree can be moved together
+        target.symlink_to(os.path.relpath(source.resolve(), target.parent.resolve()))
+        return "symlink"
+    if placement in ("auto", "reflink") and _try(_reflink, source, target):
+        return "reflink"
+    if placement in ("auto", "hardlink") and _try(os.link, source, target):
+        return "hardlink"
+    copyfile(source, target)
+    return "copy"
+
+
+def _try(share: Callable[[Path, Path], None], source: Path, target: Path) -> bool:
+    """Share source's content at target. False if they can't share it."""
+    try:
+        share(source, target)
+    except OSError as exc:
+        if exc.errno not in _CANT_SHARE:
+            raise
+        target.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def _reflink(source: Path, target: Path) -> None:
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
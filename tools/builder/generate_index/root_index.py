@@ -1,10 +1,15 @@
 """generate_index.root_index: generate the root page for the index"""
+import json
 from pathlib import Path
 from typing import Iterable
 from urllib.parse import urljoin
 
 from airium import Airium  # type: ignore[import]
 
+#: The version of the simple api the JSON pages are written in: PEP691, with
+#: the file sizes and project versions from PEP700
+API_VERSION = "1.1"
+
 
 def generate(
     simple_root_url: str, simple_root_path: Path, package_dirs: Iterable[Path]
@@ -44,3 +49,23 @@ def generate(
                 ):
                     idx(package.name)
     return str(idx)
+
+
+def generate_json(package_dirs: Iterable[Path]) -> str:
+    """Generate a PEP691 compliant JSON simple index root.
+
+    Params
+    ------
+    package_dirs: the paths to the package directories. their names are the
+                  project names.
+
+    Returns
+    -------
+    The generated json file
+    """
+    return json.dumps(
+        {
+            "meta": {"api-version": API_VERSION},
+            "projects": [{"name": package.name} for package in package_dirs],
+        }
+    )
@@ -0,0 +1,119 @@
+"""
+generate_index.serve: serve a generated index locally
+
+Every page in the index is written as both PEP503 html (index.html) and PEP691
+json (index.json). This serves the index like a static file server would, except
+that a request for a directory with both gets whichever the client asks for in
+its Accept header (or the format query parameter), the way PEP691 describes. pip
+and uv ask for json first.
+
+    python -m builder.generate_index.serve [--directory ../index] [PORT]
+"""
+import argparse
+import os
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import BinaryIO
+from urllib.parse import parse_qs, urlsplit
+
+JSON_TYPE = "application/vnd.pypi.simple.v1+json"
+HTML_TYPE = "application/vnd.pypi.simple.v1+html"
+
+# what each type a client might accept gets served as, in the order to prefer
+# them when a client likes more than one equally
+_SERVED_AS = {
+    JSON_TYPE: ("index.json", JSON_TYPE),
+    "application/vnd.pypi.simple.latest+json": ("index.json", JSON_TYPE),
+    HTML_TYPE: ("index.html", HTML_TYPE),
+    "application/vnd.pypi.simple.latest+html": ("index.html", HTML_TYPE),
+    "text/html": ("index.html", "text/html"),
+    "*/*": ("index.html", "text/html"),
+}
+
+
+def negotiate(accept: str | None) -> tuple[str, str] | None:
+    """
+    The page to serve for an Accept header, and the content type to serve it as.
+    Clients that don't say what they accept get html. None if the client accepts
+    nothing the index has.
+    """
+    if not accept:
+        return _SERVED_AS["text/html"]
+    quality: dict[str, float] = {}
+    for entry in accept.split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type.lower() in _SERVED_AS:
+            quality[media_type.lower()] = q
+    preferences = list(_SERVED_AS)
+    best = max(
+        (media_type for media_type, q in quality.items() if q > 0),
+        key=lambda media_type: (quality[media_type], -preferences.index(media_type)),
+        default=None,
+    )
+    return _SERVED_AS[best] if best else None
+
+
+class IndexRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files like SimpleHTTPRequestHandler, negotiating index pages."""
+
+    def send_head(self) -> BinaryIO | None:
+        path = self.translate_path(self.path)
+        url = urlsplit(self.path)
+        if (
+            not url.path.endswith("/")
+            or not os.path.isdir(path)
+            or not os.path.exists(os.path.join(path, "index.json"))
+        ):
+            return super().send_head()
+        requested = parse_qs(url.query).get("format")
+        served = negotiate(requested[0] if requested else self.headers["Accept"])
+        if served is None:
+            self.send_error(
+                HTTPStatus.NOT_ACCEPTABLE, f"Available: {JSON_TYPE}, {HTML_TYPE}"
+            )
+            return None
+        page, content_type = served
+        try:
+            page_file = open(os.path.join(path, page), "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.fstat(page_file.fileno()).st_size))
+        # caches have to keep the html and json apart
+        self.send_header("Vary", "Accept")
+        self.end_headers()
+        return page_file
+
+
+def run_from_cmdline() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve a generated index, with PEP691 content negotiation"
+    )
+    parser.add_argument("port", type=int, nargs="?", default=8000)
+    parser.add_argument("--bind", default="", help="The address to listen on")
+    parser.add_argument(
+        "--directory", default=os.getcwd(), help="The index to serve, by its root"
+    )
+    args = parser.parse_args()
+    handler = partial(IndexRequestHandler, directory=args.directory)
+    with ThreadingHTTPServer((args.bind, args.port), handler) as server:
+        print(f"Serving {args.directory} on port {args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    run_from_cmdline()
@@ -9,6 +9,8 @@ from builder.common.shellcommand import run_simple
 
 CONTAINER_NAME = "ghcr.io/opentrons/python-package-builder"
 DEFAULT_TAG = "main"
+# where a cache volume is mounted inside the container
+CONTAINER_CACHE_PATH = "/build-environment/cache"
 
 
 def run_container(
@@ -17,6 +19,7 @@ def run_container(
     root_path: str,
     output: io.TextIOBase,
     verbose: bool = False,
+    cache_volume: Optional[str] = None,
 ) -> None:
     """Run the container with a forwarded argv.
 
@@ -25,10 +28,13 @@ def run_container(
     forwarded_argv: the arguments to pass to the container
     root_path: the path to the root of the packages repo
     output: an output file stream for capturing the container
+    cache_volume: the name of a docker volume to mount for the build's caches
     """
     print("Running build", file=output)
     run_simple(
-        _container_run_invoke_cmd(container_str, forwarded_argv, root_path),
+        _container_run_invoke_cmd(
+            container_str, forwarded_argv, root_path, cache_volume=cache_volume
+        ),
         name="package build",
         output=output,
         verbose=verbose,
@@ -168,14 +174,22 @@ def _build_container(
 
 
 def _container_run_invoke_cmd(
-    container_str: str, forwarded_argv: List[str], root_path: str
+    container_str: str,
+    forwarded_argv: List[str],
+    root_path: str,
+    cache_volume: Optional[str] = None,
 ) -> List[str]:
-    """Build the string to run the container."""
+    """Build the string to run the container.
+
+    If cache_volume is specified, that docker volume is mounted in the container
+    and the build is told to keep its caches there.
+    """
     volume_path = os.path.realpath(os.path.join(root_path, os.path.pardir))
-    return [
-        "docker",
-        "run",
-        "--rm",
-        f"--volume={volume_path}:/build-environment/python-package-index:rw,delegated",
-        container_str,
-    ] + forwarded_argv
+    volumes = [
+        f"--volume={volume_path}:/build-environment/python-package-index:rw,delegated"
+    ]
+    if cache_volume:
+        volumes.append(f"--volume={cache_volume}:{CONTAINER_CACHE_PATH}:rw")
+        # a later argument wins, so this overrides any --cache-root given
+        forwarded_argv = forwarded_argv + [f"--cache-root={CONTAINER_CACHE_PATH}"]
+    return ["docker", "run", "--rm"] + volumes + [container_str] + forwarded_argv
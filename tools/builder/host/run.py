@@ -82,7 +82,14 @@ def run_build(argv: List[str], parsed_args: argparse.Namespace) -> None:
     )
     if parsed_args.prep_container_only:
         return
-    run_container(container_str, argv[1:], ROOT_PATH, parsed_args.output, True)
+    run_container(
+        container_str,
+        argv[1:],
+        ROOT_PATH,
+        parsed_args.output,
+        True,
+        cache_volume=parsed_args.cache_volume,
+    )
 
 
 def build_arg_parser() -> argparse.ArgumentParser:
@@ -18,13 +18,20 @@ def github_source(
     tag: str,
     sdist_archive: str,
     name: str | None = None,
+    sha256: str | None = None,
 ) -> GithubReleaseSDistSource:
     pass
 
 
 @overload
 def github_source(
-    *, org: str, repo: str, tag: str, name: str | None = None, path: str | None = None
+    *,
+    org: str,
+    repo: str,
+    tag: str,
+    name: str | None = None,
+    path: str | None = None,
+    sha256: str | None = None,
 ) -> GithubDevSource:
     pass
 
@@ -37,6 +44,7 @@ def github_source(
     sdist_archive: str | None = None,
     name: str | None = None,
     path: str | None = None,
+    sha256: str | None = None,
 ) -> GithubDevSource | GithubReleaseSDistSource:
     """
     Tell the system this package is fetched from github.
@@ -55,14 +63,28 @@ def github_source(
                          should be the directory containing the package metadata - the
                          pyproject.toml or setup.py or whatever.
     name: Optional str - a name for the source. If not specified, repo is used.
+    sha256: Optional str - the expected sha256 hex digest of the downloaded archive.
+                           if specified, the build fails as soon as the download
+                           finishes if the archive doesn't match, and the archive
+                           can be found in the download cache by its digest.
     """
     sourcename = name or repo
     if sdist_archive:
         return GithubReleaseSDistSource(
-            name=sourcename, org=org, repo=repo, tag=tag, package_name=sdist_archive
+            name=sourcename,
+            org=org,
+            repo=repo,
+            tag=tag,
+            package_name=sdist_archive,
+            sha256=sha256,
         )
     return GithubDevSource(
-        name=sourcename, org=org, repo=repo, tag=tag, package_source_path=path
+        name=sourcename,
+        org=org,
+        repo=repo,
+        tag=tag,
+        package_source_path=path,
+        sha256=sha256,
     )
 
 
@@ -0,0 +1,63 @@
+"""
+builder.package_build._pep517_runner - build a wheel with a PEP 517 build backend
+
+This is not imported by the builder. build_wheel runs it as a script with the
+build venv's python, inside the SDK environment, since the builder itself isn't
+installed in build venvs - so it can only use the standard library and what's in
+the build venv.
+
+It calls the package's build backend in-process. Building through pip instead
+would make a fresh isolated environment and install the package's build
+requirements into it on every build, when the (possibly cached) build venv
+already has them.
+
+usage: python _pep517_runner.py SOURCE_DIR WHEEL_DIR
+"""
+import importlib
+import os
+import sys
+from typing import Any
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+# what pip uses for a source tree that doesn't name a backend
+_DEFAULT_BACKEND = "setuptools.build_meta:__legacy__"
+
+
+def load_backend(source_dir: str) -> Any:
+    """Import the build backend that source_dir's pyproject.toml names."""
+    build_system: dict[str, Any] = {}
+    pyproject = os.path.join(source_dir, "pyproject.toml")
+    if os.path.exists(pyproject):
+        with open(pyproject, "rb") as pyproject_file:
+            build_system = tomllib.load(pyproject_file).get("build-system", {})
+    # in-tree backends are found through backend-path, relative to the source
+    for path in reversed(build_system.get("backend-path", [])):
+        sys.path.insert(0, os.path.join(source_dir, path))
+    module_name, _, attrs = build_system.get(
+        "build-backend", _DEFAULT_BACKEND
+    ).partition(":")
+    backend = importlib.import_module(module_name)
+    for attr in filter(None, attrs.split(".")):
+        backend = getattr(backend, attr)
+    return backend
+
+
+def main(argv: list[str]) -> None:
+    source_dir, wheel_dir = (os.path.abspath(arg) for arg in argv)
+    # backends run with the source tree as their working directory
+    os.chdir(source_dir)
+    backend = load_backend(source_dir)
+    get_requires = getattr(backend, "get_requires_for_build_wheel", None)
+    if get_requires:
+        print(f"build backend requires: {' '.join(get_requires()) or 'nothing more'}")
+    os.makedirs(wheel_dir, exist_ok=True)
+    wheel = backend.build_wheel(wheel_dir)
+    print(f"built wheel: {wheel}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
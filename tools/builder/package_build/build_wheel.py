@@ -1,14 +1,24 @@
 """build.build_wheel - utilities to build a single wheel"""
 from .shell_environment import SDKSubshell
 from pathlib import Path
-from .types import GlobalBuildContext
+from .types import BuildBackend, GlobalBuildContext
+from .venv_cache import VenvCache
+from .compiler_cache import CompilerCache
 import re
+from contextlib import contextmanager
 from typing import Iterator
 
+from builder.common import trace
 
-def args_for_build_ext(source_dir: Path, build_dir: Path, dist_dir: Path) -> list[str]:
+
+def args_for_build_ext(
+    source_dir: Path, build_dir: Path, dist_dir: Path, compile_jobs: int = 1
+) -> list[str]:
     """args for build ext"""
-    return [f"--build-lib={build_dir}", f"--build-temp={build_dir}"]
+    args = [f"--build-lib={build_dir}", f"--build-temp={build_dir}"]
+    if compile_jobs > 1:
+        args.append(f"--parallel={compile_jobs}")
+    return args
 
 
 def args_for_bdist_wheel(
@@ -23,13 +33,17 @@ def args_for_bdist_wheel(
 
 
 def args_for_command(
-    command: str, source_dir: Path, build_dir: Path, dist_dir: Path
+    command: str,
+    source_dir: Path,
+    build_dir: Path,
+    dist_dir: Path,
+    compile_jobs: int = 1,
 ) -> list[str]:
     """Different setup.py commands use different arguments. Look them up."""
 
     match command:
         case "build_ext":
-            return args_for_build_ext(source_dir, build_dir, dist_dir)
+            return args_for_build_ext(source_dir, build_dir, dist_dir, compile_jobs)
         case "bdist_wheel":
             return args_for_bdist_wheel(source_dir, build_dir, dist_dir)
         case _:
@@ -53,6 +67,145 @@ def update_build_dependencies(deps: list[str]) -> Iterator[str]:
             yield dep
 
 
+def build_venv_dependencies(
+    deps: list[str], backend: BuildBackend = "setup.py"
+) -> list[str]:
+    """Everything that gets installed into a package's build venv: the
+    package's build dependencies as they are, and what the build itself needs."""
+    extras = ["wheel"]
+    if backend == "pep517":
+        # for the build runner to read pyproject.toml with
+        extras.append('tomli; python_version < "3.11"')
+    return list(deps) + extras
+
+
+def _pip(shell: SDKSubshell, pip_args: list[str]) -> None:
+    # we have to allow importing from the system python path because
+    # with the activated buildroot sdk, we'll be using the python in there,
+    # and that python doesn't have ssl, and we need ssl to use pypi. things
+    # still get installed to the venv if we don't provide a path that includes
+    # site-packages.
+    own_paths = [
+        "/usr/local/lib/python3.10",
+        "/usr/local/lib/python3.10/lib-dynload",
+    ]
+    shell.run([f'PYTHONPATH={":".join(own_paths)}', "python", "-m", "pip"] + pip_args)
+
+
+def _install_build_dependencies(
+    shell: SDKSubshell, dependencies: list[str], *, context: GlobalBuildContext
+) -> None:
+    if not context.use_wheelhouse:
+        _pip(shell, ["install"] + dependencies)
+        return
+    if context.wheelhouse is None:
+        raise RuntimeError("Installing from the wheelhouse needs a cache root")
+    _pip(
+        shell,
+        ["install", "--no-index", f"--find-links={context.wheelhouse}"] + dependencies,
+    )
+
+
+def fill_wheelhouse(
+    dependency_sets: list[list[str]],
+    work_dir: Path,
+    *,
+    context: GlobalBuildContext,
+) -> None:
+    """
+    Download (and build, if there isn't a wheel on pypi) wheels of build
+    dependencies into the wheelhouse, so that later builds can install them
+    without pypi.
+
+    Each set of dependencies is resolved on its own, since different packages
+    can pin different versions of the same thing. Wheels already in the
+    wheelhouse are used instead of fetched again.
+    """
+    wheelhouse = context.wheelhouse
+    if wheelhouse is None:
+        raise RuntimeError("Prefetching build dependencies needs a cache root")
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    venv_dir = work_dir / "venv"
+    with SDKSubshell.scoped(
+        work_dir,
+        context.sdk_path,
+        SDKSubshell.echo_wrap_prevent_double_newlines(context.write),
+        SDKSubshell.echo_wrap_prevent_double_newlines(context.write_verbose),
+        command_timeout=context.command_timeout,
+    ) as shell:
+        # the wheels have to be made by the same python that builds use
+        shell.run(["python", "-m", "venv", "--clear", str(venv_dir)])
+        shell.run(["source", str(venv_dir / "bin" / "activate")])
+        for dependencies in dependency_sets:
+            context.write(f"Prefetching {' '.join(dependencies)} to {wheelhouse}")
+            _pip(
+                shell,
+                [
+                    "wheel",
+                    f"--wheel-dir={wheelhouse}",
+                    f"--find-links={wheelhouse}",
+                ]
+                + dependencies,
+            )
+
+
+@contextmanager
+def _build_shell(
+    source_dir: Path,
+    build_dir: Path,
+    venv_dir: Path,
+    dependencies: list[str],
+    *,
+    context: GlobalBuildContext,
+    deadline: float | None,
+) -> Iterator[SDKSubshell]:
+    """An SDK subshell in source_dir with the build venv set up and activated,
+    ready to build python."""
+    with SDKSubshell.scoped(
+        source_dir,
+        context.sdk_path,
+        SDKSubshell.echo_wrap_prevent_double_newlines(context.write),
+        SDKSubshell.echo_wrap_prevent_double_newlines(context.write_verbose),
+        command_timeout=context.command_timeout,
+        deadline=deadline,
+    ) as shell:
+        venvs = VenvCache.for_context(context)
+        venv_key = venvs.key(dependencies) if venvs else ""
+        restored = False
+        if venvs:
+            with trace.span("restore venv"):
+                restored = venvs.restore(venv_key, venv_dir)
+        trace.note("venv", cached=restored)
+        if restored:
+            context.write(f"Using cached build venv {venv_key}")
+        else:
+            with trace.span("create venv"):
+                # over a clean venv, not whatever the last build left there
+                shell.run(["python", "-m", "venv", "--clear", str(venv_dir)])
+        shell.run(["source", str(venv_dir / "bin" / "activate")])
+        if not restored:
+            with trace.span("install build dependencies", dependencies=dependencies):
+                _install_build_dependencies(shell, dependencies, context=context)
+            if venvs:
+                with trace.span("save venv"):
+                    venvs.save(venv_key, venv_dir, dependencies)
+        compiler_cache = CompilerCache.for_build(source_dir, build_dir, context=context)
+        shell.initiate_python_environment(context.sdk_path, compiler_cache)
+        try:
+            yield shell
+        finally:
+            if compiler_cache:
+                stats = compiler_cache.stats()
+                context.write(stats.summary())
+                trace.note(
+                    "ccache",
+                    hits=stats.hits,
+                    misses=stats.misses,
+                    uncacheable=stats.uncacheable,
+                )
+
+
 def build_with_setup_py(
     commands: list[str],
     source_dir: Path,
@@ -62,40 +215,80 @@ def build_with_setup_py(
     build_dependencies: list[str],
     *,
     context: GlobalBuildContext,
+    compile_jobs: int = 1,
+    deadline: float | None = None,
 ) -> Path:
-    """Build a package."""
+    """Build a package. compile_jobs is how many files build_ext compiles at
+    once. If deadline (a time.monotonic() time) is given, any build command
+    still running then is killed."""
     context.write(f'Building package with python setup.py {" ".join(commands)}')
-    with SDKSubshell.scoped(
+    with _build_shell(
         source_dir,
-        context.sdk_path,
-        SDKSubshell.echo_wrap_prevent_double_newlines(context.write),
-        SDKSubshell.echo_wrap_prevent_double_newlines(context.write_verbose),
+        build_dir,
+        venv_dir,
+        build_venv_dependencies(build_dependencies),
+        context=context,
+        deadline=deadline,
     ) as shell:
-        shell.run(["python", "-m", "venv", str(venv_dir)])
-        shell.run(["source", str(venv_dir / "bin" / "activate")])
-        # we have to allow importing from the system python path because
-        # with the activated buildroot sdk, we'll be using the python in there,
-        # and that python doesn't have ssl, and we need ssl to use pypi. things
-        # still get installed to the venv if we don't provide a path that includes
-        # site-packages.
-        own_paths = [
-            "/usr/local/lib/python3.10",
-            "/usr/local/lib/python3.10/lib-dynload",
-        ]
-        shell.run(
-            [f'PYTHONPATH={":".join(own_paths)}', "python", "-m", "pip", "install"]
-            + [dep for dep in build_dependencies]
-            + ["wheel"]
-        )
-        shell.initiate_python_environment(context.sdk_path)
         output = ""
         for command in commands:
-            output += shell.run(
-                ["python", "setup.py", command]
-                + args_for_command(command, source_dir, build_dir, dist_dir)
-            )
+            with trace.span(f"setup.py {command}"):
+                output += shell.run(
+                    ["python", "setup.py", command]
+                    + args_for_command(
+                        command, source_dir, build_dir, dist_dir, compile_jobs
+                    )
+                )
         wheelname = re.search(r"^creating.*?([\w\-\.]*\.whl).*$", output, re.MULTILINE)
         if not wheelname:
             context.write("Build failed: could not find wheelname")
             raise RuntimeError()
         return dist_dir / wheelname.group(1)
+
+
+def build_with_pep517(
+    source_dir: Path,
+    build_dir: Path,
+    dist_dir: Path,
+    venv_dir: Path,
+    build_dependencies: list[str],
+    *,
+    context: GlobalBuildContext,
+    deadline: float | None = None,
+) -> Path:
+    """
+    Build a package by calling its PEP 517 build backend directly, in the build
+    venv. The backend and its requirements must be in build_dependencies, the
+    same as for setup.py builds, since nothing is installed in isolation.
+    deadline is as for build_with_setup_py.
+    """
+    context.write("Building package with its PEP 517 build backend")
+    with _build_shell(
+        source_dir,
+        build_dir,
+        venv_dir,
+        build_venv_dependencies(build_dependencies, backend="pep517"),
+        context=context,
+        deadline=deadline,
+    ) as shell:
+        # backends tag wheels with the platform sysconfig reports, which for
+        # setup.py builds is set with bdist_wheel --plat-name instead
+        with trace.span("pep517 build_wheel"):
+            output = shell.run(
+                [
+                    f"_PYTHON_HOST_PLATFORM={_PEP517_PLATFORM}",
+                    "python",
+                    str(_PEP517_RUNNER),
+                    str(source_dir),
+                    str(dist_dir),
+                ]
+            )
+        wheelname = re.search(r"^built wheel: (\S+\.whl)$", output, re.MULTILINE)
+        if not wheelname:
+            context.write("Build failed: could not find wheelname")
+            raise RuntimeError()
+        return dist_dir / wheelname.group(1)
+
+
+_PEP517_RUNNER = Path(__file__).parent / "_pep517_runner.py"
+_PEP517_PLATFORM = "linux-armv7l"
@@ -0,0 +1,103 @@
+"""
+builder.package_build.compiler_cache - cache compiled objects between builds
+
+Packages with C extensions (especially cythonized ones like pandas) recompile
+everything on every build, even when nothing about the C changed. When ccache is
+available, package builds wrap the SDK's cross compilers in it, with the cache
+kept under the cache root so that it persists between builds.
+
+Each package build has ccache log the result of every compile to a stats log in
+the package's build directory, so that the hits and misses of one package can be
+summarized even when several packages share the cache at once.
+"""
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+from .types import GlobalBuildContext
+
+STATS_LOG_NAME = "ccache-stats.log"
+
+
+@dataclass(frozen=True)
+class CompilerCache:
+    cache_dir: Path
+    #: Where ccache keeps its cache
+    base_dir: Path
+    #: Paths under this are hashed relative to the working directory, so the
+    #: same source in a different build directory still hits
+    stats_log: Path
+    #: Where ccache logs the result of each compile
+
+    @classmethod
+    def for_build(
+        cls, source_dir: Path, build_dir: Path, *, context: GlobalBuildContext
+    ) -> "CompilerCache | None":
+        """The compiler cache for a package build, or None if the build is not
+        caching compiles."""
+        if not context.ccache or context.cache_root is None:
+            return None
+        if not shutil.which("ccache"):
+            context.write("ccache is not installed, compiles will not be cached")
+            return None
+        cache = cls(
+            cache_dir=context.cache_root / "ccache",
+            base_dir=Path(os.path.commonpath([source_dir, build_dir])),
+            stats_log=build_dir / STATS_LOG_NAME,
+        )
+        cache.cache_dir.mkdir(parents=True, exist_ok=True)
+        cache.stats_log.unlink(missing_ok=True)
+        return cache
+
+    def environment(self) -> dict[str, str]:
+        """ccache configuration, as environment variables."""
+        return {
+            "CCACHE_DIR": str(self.cache_dir),
+            "CCACHE_BASEDIR": str(self.base_dir),
+            # the sdk is unpacked fresh in each container, so its compilers'
+            # mtimes can't tell whether they changed
+            "CCACHE_COMPILERCHECK": "content",
+            "CCACHE_STATSLOG": str(self.stats_log),
+        }
+
+    def stats(self) -> "CompilerCacheStats":
+        try:
+            lines = self.stats_log.read_text().splitlines()
+        except FileNotFoundError:
+            lines = []
+        return CompilerCacheStats.from_stats_log(lines)
+
+
+@dataclass(frozen=True)
+class CompilerCacheStats:
+    hits: int
+    #: Compiles whose result came from the cache
+    misses: int
+    #: Compiles that ran and were added to the cache
+    uncacheable: int
+    #: Compiler calls ccache passed through, like links
+
+    @classmethod
+    def from_stats_log(cls, lines: list[str]) -> "CompilerCacheStats":
+        """Summarize a ccache stats log: a "# <file>" line for each compiler
+        call, followed by the names of the statistics it counted toward."""
+        calls: list[set[str]] = []
+        for line in (line.strip() for line in lines):
+            if line.startswith("#"):
+                calls.append(set())
+            elif line and calls:
+                calls[-1].add(line)
+        hits = sum(
+            1 for call in calls if any(stat.endswith("_cache_hit") for stat in call)
+        )
+        misses = sum(1 for call in calls if "cache_miss" in call)
+        return cls(hits=hits, misses=misses, uncacheable=len(calls) - hits - misses)
+
+    def summary(self) -> str:
+        compiles = self.hits + self.misses
+        rate = f" ({100 * self.hits / compiles:.0f}%)" if compiles else ""
+        return (
+            f"ccache: {self.hits} hits{rate}, {self.misses} misses, "
+            f"{self.uncacheable} uncacheable calls"
+        )
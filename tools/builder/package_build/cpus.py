@@ -0,0 +1,48 @@
+"""
+builder.package_build.cpus - how many CPUs the build can actually use
+
+Builds run in a container, which docker may limit to a fraction of the host's
+CPUs with a CFS quota (docker run --cpus). os.cpu_count() still reports every
+CPU on the host in that case, so sizing parallel work from it would oversubscribe
+the container. This reads the quota from the container's cgroup instead.
+"""
+import math
+import os
+from pathlib import Path
+
+_CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def available_cpus(cgroup_root: Path = _CGROUP_ROOT) -> int:
+    """The number of CPUs this process can use: the CPUs it may be scheduled
+    on, limited by the cgroup CPU quota if there is one."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def cgroup_cpu_quota(cgroup_root: Path = _CGROUP_ROOT) -> float | None:
+    """The cgroup CPU quota, in CPUs, or None if there isn't one."""
+    try:
+        # cgroup v2: "<quota> <period>", where quota may be "max"
+        quota, period = (cgroup_root / "cpu.max").read_text().split()
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: a quota of -1 means no limit
+        cpu_dir = cgroup_root / "cpu"
+        quota_us = int((cpu_dir / "cpu.cfs_quota_us").read_text())
+        period_us = int((cpu_dir / "cpu.cfs_period_us").read_text())
+    except (OSError, ValueError):
+        return None
+    if quota_us <= 0 or period_us <= 0:
+        return None
+    return quota_us / period_us
@@ -3,29 +3,151 @@ builder.package_build.download - tools to download package sources
 """
 
 import os
+import shutil
 import zipfile
 import tarfile
 import requests
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, ContextManager
 from .types import HTTPFetchableSource, GlobalBuildContext
+from .download_cache import DownloadCache, place_cached
+from .cpus import available_cpus
+from .http_download import download, stream, SourceDigestMismatch, RETRYABLE
+from builder.common import trace
+
+__all__ = [
+    "fetch_source",
+    "unpack_source",
+    "fetch_and_unpack_source",
+    "SourceDigestMismatch",
+]
 
 
 def fetch_source(
-    source: HTTPFetchableSource, to_path: Path, *, context: GlobalBuildContext
+    source: HTTPFetchableSource,
+    to_path: Path,
+    *,
+    context: GlobalBuildContext,
+    session: requests.Session | None = None,
 ) -> Path:
-    """Fetch a source to a specified download directory."""
-    context.write(f"Fetching {source.name} from {source.url()}")
+    """Fetch a source to a specified download directory.
+
+    If the build has a download cache and the source is in it, it is taken from
+    the cache without touching the network; otherwise, it is downloaded and added
+    to the cache. If the source has a pinned sha256, the download is hashed as it
+    arrives and SourceDigestMismatch is raised if it doesn't match. Dropped
+    connections are retried and resumed.
+
+    Pass a session to reuse its pooled connections across several fetches."""
     download_to = to_path / source.archive_name()
-    with (
-        requests.get(source.url(), stream=True) as response,
-        open(download_to, "wb") as writefile,
-    ):
-        response.raise_for_status()
-        for chunk in response.iter_content(chunk_size=None):
-            writefile.write(chunk)
+    cache = DownloadCache.for_context(context)
+    cached = _cached_source(cache, source) if cache else None
+    if cached:
+        context.write(f"Using cached {source.name} from {cached}")
+        place_cached(cached, download_to)
+        trace.note("download", bytes=0, cached=True)
+        return download_to
+    context.write(f"Fetching {source.name} from {source.url()}")
+    digest = download(
+        source.url(),
+        download_to,
+        session=session,
+        expected_sha256=source.sha256,
+        log=context.write,
+    )
+    if cache:
+        cache.store(source.url(), download_to, digest)
+    trace.note("download", bytes=download_to.stat().st_size, cached=False)
     return download_to
 
 
+def _cached_source(cache: DownloadCache, source: HTTPFetchableSource) -> Path | None:
+    # a pinned source must have exactly the content it is pinned to, wherever
+    # that content came from
+    if source.sha256:
+        return cache.lookup_digest(source.sha256)
+    return cache.lookup(source.url())
+
+
+def fetch_and_unpack_source(
+    source: HTTPFetchableSource,
+    download_dir: Path,
+    unpack_dir: Path,
+    from_archive_path: Path,
+    *,
+    context: GlobalBuildContext,
+    session: requests.Session | None = None,
+) -> Path:
+    """
+    Fetch a source and unpack it, like fetch_source followed by unpack_source.
+
+    Tar sources that aren't already cached are unpacked straight from the
+    download as it arrives, without writing the archive to disk and reading it
+    back. If the build has a download cache, the archive is copied into it on
+    the way past. If the stream is interrupted, this falls back to a regular
+    download, which can retry and resume.
+    """
+    cache = DownloadCache.for_context(context)
+    cached = _cached_source(cache, source) if cache else None
+    if not cached and ".tar" in source.archive_name():
+        try:
+            return _stream_unpack_tar(
+                source,
+                download_dir,
+                unpack_dir,
+                from_archive_path,
+                cache,
+                context=context,
+                session=session,
+            )
+        except (*RETRYABLE, tarfile.ReadError) as exc:
+            context.write(f"Streaming {source.name} failed ({exc}), downloading it")
+    fetched = fetch_source(source, download_dir, context=context, session=session)
+    return unpack_source(unpack_dir, fetched, from_archive_path, context=context)
+
+
+def _stream_unpack_tar(
+    source: HTTPFetchableSource,
+    download_dir: Path,
+    unpack_dir: Path,
+    from_archive_path: Path,
+    cache: DownloadCache | None,
+    *,
+    context: GlobalBuildContext,
+    session: requests.Session | None,
+) -> Path:
+    context.write(f"Streaming {source.name} from {source.url()} into {unpack_dir}")
+    tee_path = download_dir / f".{source.archive_name()}.part"
+    tee: ContextManager[BinaryIO | None] = (
+        open(tee_path, "wb") if cache else nullcontext(None)
+    )
+    try:
+        with (
+            tee as tee_file,
+            stream(source.url(), session=session, tee=tee_file) as reader,
+            tarfile.open(fileobj=reader, mode="r|*") as tf,  # type: ignore[call-overload]
+        ):
+            unpacked = _unpack_tar_stream(
+                tf, unpack_dir, from_archive_path, context=context
+            )
+            reader.drain()
+        digest = reader.hexdigest()
+        if source.sha256 and digest != source.sha256.lower():
+            shutil.rmtree(unpack_dir)
+            unpack_dir.mkdir()
+            raise SourceDigestMismatch(source.url(), source.sha256, digest)
+        if cache:
+            cache.store(source.url(), tee_path, digest)
+    finally:
+        tee_path.unlink(missing_ok=True)
+    context.write(f"Streamed {reader.bytes_read} bytes with sha256 {digest}")
+    trace.note("download", bytes=reader.bytes_read, cached=False)
+    return unpacked
+
+
 def unpack_source(
     path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
 ) -> Path:
@@ -56,12 +178,16 @@ def _verify_tar_member(
     dest = path / member.name
     match member.type:
         case tarfile.LNKTYPE | tarfile.SYMTYPE:
-            target_realpath = Path(os.path.realpath(path / member.linkname))
+            # hardlinks name their target from the top of the archive, and
+            # symlinks from their own directory
+            link_base = path if member.islnk() else (path / member.name).parent
+            target_realpath = Path(os.path.realpath(link_base / member.linkname))
+            unpack_dir = Path(os.path.realpath(path))
             try:
-                common = Path(os.path.commonpath([unpack_to, target_realpath]))
+                common = Path(os.path.commonpath([unpack_dir, target_realpath]))
             except ValueError:
                 pass
-            if common != unpack_to:
+            if common != unpack_dir:
                 raise RuntimeError(
                     f"Will not unpack archive member {member.name}: links outside unpack dir"
                 )
@@ -96,45 +222,196 @@ def _unpack_member_to(
         return None
     destpath = path / Path(verified.name).relative_to(from_archive_path)
     context.write_verbose(f"unpack: {path} -> {destpath}")
-    tf.extract(verified, path, set_attrs=True)
+    if verified.islnk():
+        _unpack_hardlink(path, verified)
+    else:
+        # directory attributes are set once everything is unpacked, in case they
+        # would prevent writing their contents
+        tf.extract(verified, path, set_attrs=not verified.isdir())
     return destpath
 
 
+def _unpack_hardlink(path: Path, member: tarfile.TarInfo) -> None:
+    """
+    Unpack a hardlink member from the file it links to, which is always earlier in
+    the archive and so already unpacked. When tarfile can't link, it looks for the
+    file among the members it remembers and reads it out of the archive again,
+    which a stream can't do.
+    """
+    target = path / member.linkname
+    dest = path / member.name
+    if not target.is_file():
+        raise RuntimeError(
+            f"Cannot unpack {member.name}: it links to {member.linkname}, which "
+            "was not unpacked"
+        )
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # left from an earlier unpack into the same place
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(target, dest)
+    except OSError:
+        # the filesystem can't hardlink
+        shutil.copy2(target, dest)
+
+
 def _unpack_tar_to(
     path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
 ) -> Path:
     context.write(f"Untarring {archive} to {path}")
-    with tarfile.open(archive, "r") as tf:
-        members = sorted(tf.getmembers(), key=lambda m: m.name, reverse=True)
-        unpacked = [
-            _unpack_member_to(tf, path, member, from_archive_path, context=context)
-            for member in members
-        ]
-        return Path(
-            os.path.commonpath(
-                [unpacked_file for unpacked_file in unpacked if unpacked_file]
-            )
+    with tarfile.open(archive, "r|*") as tf:
+        return _unpack_tar_stream(tf, path, from_archive_path, context=context)
+
+
+def _unpack_tar_stream(
+    tf: tarfile.TarFile,
+    path: Path,
+    from_archive_path: Path,
+    *,
+    context: GlobalBuildContext,
+) -> Path:
+    """
+    Unpack a tarfile in a single pass, verifying and extracting each member as it
+    is read. This works on tarfiles opened in stream mode, so the archive is
+    decompressed exactly once, and only the directory members are kept around.
+    """
+    unpacked: Path | None = None
+    directories: list[tuple[tarfile.TarInfo, Path]] = []
+    while (member := tf.next()) is not None:
+        # the tarfile remembers every member it reads; we don't need it to, and
+        # for big archives that adds up. (it would use them to unpack hardlinks
+        # it can't link, but _unpack_hardlink does that without them.)
+        tf.members = []  # type: ignore[attr-defined]
+        destpath = _unpack_member_to(
+            tf, path, member, from_archive_path, context=context
+        )
+        if not destpath:
+            continue
+        if member.isdir():
+            directories.append((member, path / member.name))
+        unpacked = (
+            destpath
+            if unpacked is None
+            else Path(os.path.commonpath([unpacked, destpath]))
         )
+    # deepest first, so a directory's attributes are set after its children's
+    for directory, dirpath in sorted(
+        directories, key=lambda d: d[0].name, reverse=True
+    ):
+        tf.chown(directory, str(dirpath), numeric_owner=False)
+        tf.utime(directory, str(dirpath))
+        tf.chmod(directory, str(dirpath))
+    if unpacked is None:
+        raise RuntimeError(f"Nothing to unpack from {from_archive_path}")
+    return unpacked
 
 
 def _unpack_zip_to(
     path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
 ) -> Path:
     context.write(f"Unzipping {archive} to {path}")
-    unzipped: list[Path] = []
     with zipfile.ZipFile(archive) as zf:
-        for member in zf.infolist():
-            # skip archive members not in the from_archive_path
-            try:
-                common = Path(os.path.commonpath([member.filename, from_archive_path]))
-            except ValueError:
-                pass
-            if common != from_archive_path:
-                continue
-            # and then just extract them, because zipfile extraction prevents
-            # traversal unlike tarfile extraction
+        selection = _ZipSelection.select(zf.infolist(), from_archive_path)
+        # directories (and the parents of every file) are made up front, so
+        # that the workers never race each other to create one
+        unzipped = [Path(zf.extract(member, path=path)) for member in selection.dirs]
+    for member in selection.files:
+        _zip_member_target(path, member).parent.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(_ZIP_MAX_WORKERS, available_cpus() // context.jobs))
+    batches = _balanced_batches(selection.files, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for extracted in executor.map(
+            lambda batch: _extract_zip_batch(archive, batch, path, context=context),
+            batches,
+        ):
+            unzipped.extend(extracted)
+    context.write(selection.report(from_archive_path))
+    if not unzipped:
+        raise RuntimeError(f"Nothing in {archive} is under {from_archive_path}")
+    return Path(os.path.commonpath(unzipped))
+
+
+# decompression and writing both release the GIL, but past a handful of threads
+# the disk is the bottleneck
+_ZIP_MAX_WORKERS = 8
+
+
+@dataclass
+class _ZipSelection:
+    """The members of a zip archive that are under from_archive_path."""
+
+    dirs: list[zipfile.ZipInfo] = field(default_factory=list)
+    files: list[zipfile.ZipInfo] = field(default_factory=list)
+    skipped_members: int = 0
+    skipped_bytes: int = 0
+
+    @classmethod
+    def select(
+        cls, members: list[zipfile.ZipInfo], from_archive_path: Path
+    ) -> "_ZipSelection":
+        wanted = PurePosixPath(from_archive_path).as_posix()
+        # every member is wanted if from_archive_path is the archive root;
+        # otherwise a member is wanted if it is from_archive_path (the
+        # directory entry for it has a trailing slash) or anything inside it
+        prefix = "" if wanted == "." else wanted.rstrip("/") + "/"
+        selection = cls()
+        for member in members:
+            if not (
+                member.filename.startswith(prefix) or member.filename + "/" == prefix
+            ):
+                selection.skipped_members += 1
+                selection.skipped_bytes += member.file_size
+            elif member.is_dir():
+                selection.dirs.append(member)
+            else:
+                selection.files.append(member)
+        return selection
+
+    def report(self, from_archive_path: Path) -> str:
+        extracted_bytes = sum(member.file_size for member in self.files)
+        return (
+            f"Unzipped {len(self.dirs) + len(self.files)} members "
+            f"({extracted_bytes} bytes) from {from_archive_path}, skipped "
+            f"{self.skipped_members} members ({self.skipped_bytes} bytes)"
+        )
+
+
+def _zip_member_target(path: Path, member: zipfile.ZipInfo) -> Path:
+    """Where ZipFile.extract will put a member: it drops empty, . and ..
+    components, which is what keeps archive members from escaping path."""
+    parts = [part for part in member.filename.split("/") if part not in ("", ".", "..")]
+    return path.joinpath(*parts)
+
+
+def _balanced_batches(
+    members: list[zipfile.ZipInfo], count: int
+) -> list[list[zipfile.ZipInfo]]:
+    """Split members into count batches of about the same compressed size,
+    biggest first so that one huge member doesn't end up with company."""
+    batches: list[list[zipfile.ZipInfo]] = [[] for _ in range(count)]
+    sizes = [0] * count
+    for member in sorted(members, key=lambda m: m.compress_size, reverse=True):
+        smallest = sizes.index(min(sizes))
+        batches[smallest].append(member)
+        sizes[smallest] += member.compress_size
+    return [batch for batch in batches if batch]
+
+
+def _extract_zip_batch(
+    archive: Path,
+    members: list[zipfile.ZipInfo],
+    path: Path,
+    *,
+    context: GlobalBuildContext,
+) -> list[Path]:
+    # each worker needs its own handle, since a ZipFile shares one file
+    # position between everything reading from it
+    with zipfile.ZipFile(archive) as zf:
+        extracted = []
+        for member in members:
+            # zipfile extraction prevents traversal unlike tarfile extraction
             context.write_verbose(
                 f"unpack: {member.filename} -> {path/member.filename}"
             )
-            unzipped.append(Path(zf.extract(member, path=path)))
-    return Path(os.path.commonpath(unzipped))
+            extracted.append(Path(zf.extract(member, path=path)))
+        return extracted
@@ -0,0 +1,124 @@
+"""
+builder.package_build.download_cache - a shared cache of downloaded sources
+
+Downloaded archives are stored by the sha256 of their content under
+objects/, and the url each was downloaded from is recorded under urls/ along
+with that digest. Because the store is content-addressed, a source that is
+pinned to a digest can be found even if it was downloaded from somewhere else.
+
+The cache is bounded in size. Each use of an archive touches its modification
+time, and when the cache grows past its limit the least recently used archives
+are removed.
+"""
+
+import json
+import os
+import shutil
+import uuid
+from hashlib import sha256
+from pathlib import Path
+
+from .types import GlobalBuildContext
+
+
+class DownloadCache:
+    """
+    A size-bounded, content-addressed cache of downloaded files.
+
+    It's safe for several package builds to share one cache directory at the
+    same time: everything is written to a temporary file and renamed into place.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self._objects = root / "objects"
+        self._urls = root / "urls"
+        self._max_bytes = max_bytes
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._urls.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def for_context(cls, context: GlobalBuildContext) -> "DownloadCache | None":
+        """The download cache for a build, or None if the build is not caching."""
+        if context.cache_root is None:
+            return None
+        return cls(context.cache_root / "downloads", context.download_cache_max_bytes)
+
+    def lookup(self, url: str) -> Path | None:
+        """Find the cached content for a url, if there is any."""
+        try:
+            record = json.loads(self._url_record(url).read_text())
+            digest = str(record["sha256"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return self.lookup_digest(digest)
+
+    def lookup_digest(self, digest: str) -> Path | None:
+        """Find cached content by its sha256 hex digest, if there is any."""
+        cached = self._objects / digest.lower()
+        try:
+            os.utime(cached)
+        except OSError:
+            return None
+        return cached
+
+    def store(self, url: str, downloaded: Path, digest: str) -> Path:
+        """Add a downloaded file to the cache, then evict old entries if the
+        cache is too big. Returns the path to the cached copy."""
+        cached = self._objects / digest.lower()
+        if not cached.exists():
+            temporary = self._temporary(cached)
+            _link_or_copy(downloaded, temporary)
+            os.replace(temporary, cached)
+        record = self._url_record(url)
+        temporary = self._temporary(record)
+        temporary.write_text(json.dumps({"url": url, "sha256": digest.lower()}))
+        os.replace(temporary, record)
+        self.evict(keep=cached)
+        return cached
+
+    def evict(self, keep: Path | None = None) -> list[Path]:
+        """Remove the least recently used entries until the cache fits in its
+        size limit. Returns the paths that were removed."""
+        entries = []
+        for entry in self._objects.iterdir():
+            if entry.name.startswith(".") or entry == keep:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        if keep and keep.exists():
+            total += keep.stat().st_size
+        removed: list[Path] = []
+        for _, size, entry in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            removed.append(entry)
+        return removed
+
+    def _url_record(self, url: str) -> Path:
+        return self._urls / f"{sha256(url.encode()).hexdigest()}.json"
+
+    @staticmethod
+    def _temporary(path: Path) -> Path:
+        # unique to the call, since prefetch threads can store the same thing at
+        # the same time
+        return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def place_cached(cached: Path, destination: Path) -> None:
+    """Put a cached file at a destination, sharing storage with the cache when
+    possible. The destination must not be written to afterwards."""
+    destination.unlink(missing_ok=True)
+    _link_or_copy(cached, destination)
+
+
+def _link_or_copy(source: Path, destination: Path) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,89 @@
+"""build.fingerprint - decide whether a package needs to be built again
+
+A package build is fully determined by its build.py, the source it fetches, the
+setup.py commands and build dependencies it uses, the SDK it builds with, and the
+version of this builder. After a successful build we record all of those in a
+manifest in the package's build directory; if they all match next time and the
+wheel is still in the dist directory, there's nothing to do.
+"""
+import json
+from dataclasses import dataclass, asdict
+from hashlib import sha256
+from pathlib import Path
+
+from builder import __version__
+from .types import HTTPFetchableSource
+
+MANIFEST_NAME = "fingerprint.json"
+
+
+@dataclass(frozen=True)
+class BuildFingerprint:
+    build_file_sha256: str
+    #: Digest of the package's build.py
+    source_url: str
+    #: Where the package source comes from
+    setup_py_commands: tuple[str, ...]
+    #: The setup.py commands run to build the package
+    build_dependencies: tuple[str, ...]
+    #: The python dependencies installed for the build
+    sdk: str
+    #: Identifies the buildroot sdk the package was compiled with
+    builder_version: str
+    #: The version of this builder
+
+
+def sdk_identity(sdk_path: Path) -> str:
+    """Something that changes if the sdk changes. The environment-setup script
+    has the sdk's toolchain and sysroot baked in, so a digest of it will do."""
+    try:
+        setup_digest = sha256((sdk_path / "environment-setup").read_bytes())
+    except OSError:
+        return str(sdk_path)
+    return f"{sdk_path}@sha256:{setup_digest.hexdigest()}"
+
+
+def fingerprint_package(
+    build_file: Path,
+    source: HTTPFetchableSource,
+    setup_py_commands: list[str],
+    build_dependencies: list[str],
+    sdk_path: Path,
+) -> BuildFingerprint:
+    """Build the fingerprint for a package build."""
+    return BuildFingerprint(
+        build_file_sha256=sha256(build_file.read_bytes()).hexdigest(),
+        source_url=source.url(),
+        setup_py_commands=tuple(setup_py_commands),
+        build_dependencies=tuple(build_dependencies),
+        sdk=sdk_identity(sdk_path),
+        builder_version=__version__,
+    )
+
+
+def up_to_date_wheel(
+    manifest: Path, fingerprint: BuildFingerprint, dist_dir: Path
+) -> Path | None:
+    """
+    Check a previous build's manifest against a fingerprint.
+
+    Returns the path to the previously built wheel if the fingerprints match and
+    the wheel still exists, or None if the package needs to be built.
+    """
+    try:
+        recorded = json.loads(manifest.read_text())
+        previous = recorded["fingerprint"]
+        wheel = dist_dir / str(recorded["wheel"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    # round-trip through json so tuples and lists compare equal
+    if previous != json.loads(json.dumps(asdict(fingerprint))) or not wheel.is_file():
+        return None
+    return wheel
+
+
+def record_build(manifest: Path, fingerprint: BuildFingerprint, wheel: Path) -> None:
+    """Record a successful build so it can be skipped next time."""
+    manifest.write_text(
+        json.dumps({"fingerprint": asdict(fingerprint), "wheel": wheel.name}, indent=2)
+    )
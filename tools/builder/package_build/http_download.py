@@ -0,0 +1,270 @@
+"""
+builder.package_build.http_download - download big files over unreliable connections
+
+Source archives can be hundreds of megabytes, and a connection dropping partway
+through one shouldn't fail the build. Downloads here go to a temporary file next
+to the destination; if the connection drops or times out, the download resumes
+from where it stopped with an HTTP Range request (or starts over, if the server
+doesn't support ranges) after an exponential backoff with jitter. The file is
+hashed as it arrives and only renamed to its destination once it's complete.
+"""
+
+import os
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from hashlib import sha256
+from io import BufferedWriter
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
+
+import requests
+
+# small enough that little is lost when a connection drops mid-chunk
+CHUNK_SIZE = 2**16
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 6
+    #: How many times to try the download before giving up
+    backoff_base: float = 1.0
+    #: Seconds to wait before the first retry. Doubles on each retry.
+    backoff_max: float = 60.0
+    #: The longest to wait before a retry
+    connect_timeout: float = 15.0
+    #: Seconds to wait for a connection to the server
+    read_timeout: float = 60.0
+    #: Seconds to wait for the server to send anything
+
+    def backoff(self, retry: int) -> float:
+        """How long to wait before a retry, with full jitter so that several
+        downloads failing at once don't all retry at once."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**retry))
+
+
+class DownloadFailed(RuntimeError):
+    def __init__(self, url: str, attempts: int, reason: str) -> None:
+        super().__init__(url, attempts, reason)
+        self.url = url
+        self.attempts = attempts
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return (
+            f"Could not download {self.url} after {self.attempts} tries: {self.reason}"
+        )
+
+
+class SourceDigestMismatch(RuntimeError):
+    def __init__(self, url: str, expected: str, actual: str) -> None:
+        super().__init__(url, expected, actual)
+        self.url = url
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self) -> str:
+        return (
+            f"Downloaded {self.url} has sha256 {self.actual} but {self.expected} "
+            "was expected"
+        )
+
+
+class _Incomplete(Exception):
+    """The server stopped sending before the whole file arrived."""
+
+
+class _RetryableStatus(Exception):
+    """The server returned a status that might go away if we ask again."""
+
+
+RETRYABLE = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    _Incomplete,
+    _RetryableStatus,
+)
+
+
+def download(
+    url: str,
+    destination: Path,
+    *,
+    session: requests.Session | None = None,
+    policy: RetryPolicy = RetryPolicy(),
+    expected_sha256: str | None = None,
+    log: Callable[[str], None] = lambda _: None,
+) -> str:
+    """
+    Download a url to a destination, retrying and resuming as needed.
+
+    Params
+    ------
+    url: what to download
+    destination: where to put it. Nothing is written here until the download
+                 is complete (and verified, if expected_sha256 is given).
+    session: a requests session to use for its pooled connections
+    policy: how hard to try
+    expected_sha256: if given, the download must have this hex digest, or
+                     SourceDigestMismatch is raised and nothing is written
+    log: called with messages about retries
+
+    Returns
+    -------
+    The sha256 hex digest of the downloaded file.
+    """
+    partial = destination.with_name(f".{destination.name}.part")
+    with (
+        _session_or_new(session) as http,
+        open(partial, "wb") as out,
+    ):
+        try:
+            digest = _ResumableTransfer(url, out, http, policy).run(log)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+    if expected_sha256 and digest != expected_sha256.lower():
+        partial.unlink()
+        raise SourceDigestMismatch(url, expected_sha256, digest)
+    os.replace(partial, destination)
+    return digest
+
+
+class HashingReader:
+    """
+    A file-like view of a response body that hashes everything read from it
+    and, optionally, copies it to another file as it goes.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], tee: BinaryIO | None) -> None:
+        self._chunks = chunks
+        self._tee = tee
+        self._buffer = bytearray()
+        self._digest = sha256()
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._digest.update(data)
+        if self._tee:
+            self._tee.write(data)
+        self.bytes_read += len(data)
+        return data
+
+    def drain(self) -> None:
+        """Read whatever is left, so the digest covers the whole body."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+@contextmanager
+def stream(
+    url: str,
+    *,
+    session: requests.Session | None = None,
+    policy: RetryPolicy = RetryPolicy(),
+    tee: BinaryIO | None = None,
+) -> Iterator[HashingReader]:
+    """
+    Open a url for reading as a stream, for consumers that can process it as
+    it arrives. There are no retries, since the consumer has already used
+    whatever arrived before a failure; on a failure, the exception is one of
+    RETRYABLE if trying again from the start might help.
+    """
+    with (
+        _session_or_new(session) as http,
+        http.get(
+            url,
+            stream=True,
+            timeout=(policy.connect_timeout, policy.read_timeout),
+        ) as response,
+    ):
+        _ResumableTransfer._check_status(response)
+        yield HashingReader(response.iter_content(chunk_size=CHUNK_SIZE), tee)
+
+
+@contextmanager
+def _session_or_new(session: requests.Session | None) -> Iterator[requests.Session]:
+    if session:
+        yield session
+        return
+    with requests.Session() as new_session:
+        yield new_session
+
+
+class _ResumableTransfer:
+    def __init__(
+        self,
+        url: str,
+        out: BufferedWriter,
+        session: requests.Session,
+        policy: RetryPolicy,
+    ) -> None:
+        self._url = url
+        self._out = out
+        self._session = session
+        self._policy = policy
+        self._digest = sha256()
+
+    def run(self, log: Callable[[str], None]) -> str:
+        for attempt in range(1, self._policy.attempts + 1):
+            try:
+                self._attempt()
+                return self._digest.hexdigest()
+            except RETRYABLE as exc:
+                if attempt == self._policy.attempts:
+                    raise DownloadFailed(self._url, attempt, str(exc)) from exc
+                delay = self._policy.backoff(attempt - 1)
+                log(
+                    f"Download of {self._url} interrupted at {self._out.tell()} bytes "
+                    f"({exc}), retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+        raise DownloadFailed(self._url, self._policy.attempts, "no attempts allowed")
+
+    def _attempt(self) -> None:
+        offset = self._out.tell()
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self._session.get(
+            self._url,
+            stream=True,
+            headers=headers,
+            timeout=(self._policy.connect_timeout, self._policy.read_timeout),
+        ) as response:
+            self._check_status(response)
+            if offset and response.status_code != 206:
+                # the server sent the whole thing instead of the range we asked for
+                self._restart()
+            length = response.headers.get("Content-Length")
+            expected = self._out.tell() + int(length) if length else None
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                self._out.write(chunk)
+                self._digest.update(chunk)
+            if expected is not None and self._out.tell() < expected:
+                raise _Incomplete(
+                    f"got {self._out.tell()} of {expected} bytes before the connection closed"
+                )
+
+    @staticmethod
+    def _check_status(response: requests.Response) -> None:
+        if response.status_code == 429 or response.status_code >= 500:
+            raise _RetryableStatus(f"server returned {response.status_code}")
+        response.raise_for_status()
+
+    def _restart(self) -> None:
+        self._out.seek(0)
+        self._out.truncate()
+        self._digest = sha256()
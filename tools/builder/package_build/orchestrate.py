@@ -3,13 +3,65 @@ from .types import (
     GithubReleaseSDistSource,
     GlobalBuildContext,
     PackageBuildContext,
+    PackageBuildSpec,
+    BuildBackend,
     BuildPaths,
 )
-from .download import fetch_source, unpack_source
-from .build_wheel import build_with_setup_py
+from .download import fetch_source, unpack_source, fetch_and_unpack_source
+from .build_wheel import (
+    build_with_setup_py,
+    build_with_pep517,
+    build_venv_dependencies,
+    fill_wheelhouse,
+)
+from .fingerprint import (
+    MANIFEST_NAME,
+    BuildFingerprint,
+    fingerprint_package,
+    up_to_date_wheel,
+    record_build,
+)
+from .venv_cache import normalize_dependencies
+from .cpus import available_cpus
+from .report import historical_durations
 from typing import Iterator
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from io import StringIO
 
 from pathlib import Path
+import math
+import os
+import shutil
+import time
+import uuid
+
+import requests
+
+from builder.common import trace
+from builder.common.shellcommand import ShellCommandFailed
+
+# The context for the package currently being built. build.py files call
+# build_package without any context of their own, so discover_build_package sets
+# this around the exec of each build.py. It's a context var rather than a module
+# global so that builds in different threads or worker processes can't see each
+# other's context.
+_package_build_context: ContextVar[PackageBuildContext] = ContextVar(
+    "opentrons_package_build_context"
+)
+
+# When build.py files are only being read to find out how to build their
+# packages, build_package adds the spec here instead of building.
+_collected_specs: ContextVar[list[PackageBuildSpec] | None] = ContextVar(
+    "opentrons_package_build_specs", default=None
+)
 
 
 def discover_build_packages_sync(
@@ -33,8 +85,55 @@ def discover_build_packages(
     context: GlobalBuildContext,
 ) -> Iterator[None]:
     context.write("Building all packages")
-    yield from build_packages(
-        discover_packages(package_root, build_root, dist_root, context=context),
+    packages = discover_packages(package_root, build_root, dist_root, context=context)
+    if context.jobs > 1 and context.build_report:
+        packages = iter(
+            _longest_first(list(packages), historical_durations(context.build_report))
+        )
+    yield from build_packages(packages, context=context)
+
+
+def _longest_first(
+    packages: list[BuildPaths], durations: dict[str, float]
+) -> list[BuildPaths]:
+    """Order packages by how long they took last time, longest first, so that a
+    parallel build doesn't end up waiting on one long package that started
+    late. Packages with no history might be long, so they go first."""
+    return sorted(
+        packages,
+        key=lambda package: -durations.get(_track_name(package.source_path), math.inf),
+    )
+
+
+def prefetch_build_dependencies(
+    package_root: Path,
+    build_root: Path,
+    dist_root: Path,
+    *,
+    context: GlobalBuildContext,
+) -> None:
+    """
+    Fill the wheelhouse with the build dependencies of every package, so that
+    packages can later be built with context.use_wheelhouse and no pypi.
+    """
+    context.write("Prefetching build dependencies")
+    specs = (
+        load_package_spec(package, context=context)
+        for package in discover_packages(
+            package_root, build_root, dist_root, context=context
+        )
+    )
+    dependency_sets = {
+        tuple(
+            normalize_dependencies(
+                build_venv_dependencies(spec.build_dependencies, spec.backend)
+            )
+        )
+        for spec in specs
+    }
+    fill_wheelhouse(
+        [list(dependencies) for dependencies in sorted(dependency_sets)],
+        build_root / "prefetch-deps",
         context=context,
     )
 
@@ -74,27 +173,306 @@ def discover_packages(
 def build_packages(
     packages: Iterator[BuildPaths], *, context: GlobalBuildContext
 ) -> Iterator[None]:
+    """
+    Build each package, yielding after each one completes.
+
+    If context.jobs is more than 1, packages are built concurrently in a pool of
+    worker processes and yielded in the order they complete. Otherwise, if
+    context.prefetch is more than 0, packages are built in order while the sources
+    of the next few are fetched and unpacked in the background.
+
+    The first package that fails to build stops the build, unless
+    context.keep_going is set; then the rest are built anyway, and
+    PackageBuildsFailed is raised at the end if any failed.
+    """
+    failures: list[tuple[Path, Exception]] = []
+    if context.jobs > 1:
+        yield from _build_packages_parallel(packages, failures, context=context)
+    elif context.prefetch > 0:
+        yield from _build_packages_pipelined(packages, failures, context=context)
+    else:
+        for package in packages:
+            try:
+                discover_build_package(package, context=context)
+            except Exception as exc:
+                _package_failed(package.source_path, exc, failures, context=context)
+            yield
+    if failures:
+        raise PackageBuildsFailed(failures)
+
+
+class PackageBuildsFailed(RuntimeError):
+    def __init__(self, failures: list[tuple[Path, Exception]]) -> None:
+        super().__init__(failures)
+        self.failures = failures
+
+    def __str__(self) -> str:
+        return f"{len(self.failures)} packages failed to build: " + ", ".join(
+            f"{package} ({error})" for package, error in self.failures
+        )
+
+
+def _package_failed(
+    package: Path,
+    error: Exception,
+    failures: list[tuple[Path, Exception]],
+    *,
+    context: GlobalBuildContext,
+    log: str = "",
+) -> None:
+    """Stop the build because a package failed, unless it keeps going. log is
+    the package's log, if it was captured."""
+    trace.note(
+        "status",
+        track=_track_name(package),
+        status="failed",
+        error=str(error),
+        log_tail=_log_tail(error, log),
+    )
+    if not context.keep_going:
+        raise error
+    context.write(f"Building {package} failed, moving on: {error}")
+    if isinstance(error, ShellCommandFailed) and not context.verbose:
+        # the output wasn't shown as it happened, and this is the only chance
+        context.write(error.output)
+    failures.append((package, error))
+
+
+def _log_tail(error: Exception, log: str) -> list[str]:
+    # a failed command's output is the part of the log that explains it
+    if isinstance(error, ShellCommandFailed):
+        log = error.output
+    return log.splitlines()[-_LOG_TAIL_LINES:]
+
+
+_LOG_TAIL_LINES = 50
+
+
+@dataclass
+class _WorkerResult:
+    log: str
+    #: Everything the work wrote to its output
+    error: Exception | None
+    #: The exception that failed the work, if it failed
+    result: Path | None = None
+    #: The path the work produced, if it produces one
+    trace_events: list[trace.Event] = field(default_factory=list)
+    #: What the work added to the build trace, if the build is being traced
+
+
+def _build_package_in_worker(
+    package: BuildPaths, context: GlobalBuildContext
+) -> _WorkerResult:
+    """Build one package in a worker process, capturing its log so it can be
+    written out in one piece rather than interleaved with other packages."""
+    log = StringIO()
+    worker_context = replace(context, output=log, jobs=1, prefetch=0)
+    error: Exception | None = None
+    # a forked worker inherits a copy of whatever the parent was recording, so
+    # it records its own trace to send back instead
+    with trace.recording() as recorded:
+        try:
+            discover_build_package(package, context=worker_context)
+        except Exception as exc:
+            error = exc
+    return _WorkerResult(log=log.getvalue(), error=error, trace_events=recorded.events)
+
+
+def _build_packages_parallel(
+    packages: Iterator[BuildPaths],
+    failures: list[tuple[Path, Exception]],
+    *,
+    context: GlobalBuildContext,
+) -> Iterator[None]:
+    context.write(f"Building packages with {context.jobs} jobs")
+    # output streams can't be sent to another process; workers make their own.
+    # workers build one package at a time, so they'd each size their compiles
+    # for the whole container unless they're told their share here.
+    worker_context = replace(
+        context, output=None, compile_jobs=_default_compile_jobs(context)
+    )
+    with ProcessPoolExecutor(max_workers=context.jobs) as executor:
+        futures = {
+            executor.submit(_build_package_in_worker, package, worker_context): package
+            for package in packages
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                context.write(result.log.rstrip("\n"))
+                trace.merge(result.trace_events)
+                if result.error:
+                    _package_failed(
+                        futures[future].source_path,
+                        result.error,
+                        failures,
+                        context=context,
+                        log=result.log,
+                    )
+                yield
+        except BaseException:
+            # don't start anything new, but let running builds finish so their
+            # subshells get cleaned up
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+_Prefetching = tuple[PackageBuildContext, PackageBuildSpec, Future[_WorkerResult]]
+
+
+def _build_packages_pipelined(
+    packages: Iterator[BuildPaths],
+    failures: list[tuple[Path, Exception]],
+    *,
+    context: GlobalBuildContext,
+) -> Iterator[None]:
+    context.write(f"Reading package specs to prefetch {context.prefetch} ahead")
+    specs = iter(_load_package_specs(packages, failures, context=context))
+    in_flight: deque[_Prefetching] = deque()
+    with (
+        requests.Session() as session,
+        ThreadPoolExecutor(max_workers=context.prefetch) as executor,
+    ):
+        try:
+            while True:
+                # keep sources for the next few packages coming while this one builds
+                while len(in_flight) <= context.prefetch and (
+                    next_spec := next(specs, None)
+                ):
+                    in_flight.append(
+                        (*next_spec, executor.submit(_prefetch, *next_spec, session))
+                    )
+                if not in_flight:
+                    return
+                package_context, spec, prefetching = in_flight.popleft()
+                context.write(
+                    f"Building package in directory {package_context.paths.source_path}"
+                )
+                source_path = package_context.paths.source_path
+                with trace.span("wait for prefetch", package=_track_name(source_path)):
+                    prefetched = prefetching.result()
+                context.write(prefetched.log.rstrip("\n"))
+                try:
+                    if prefetched.error:
+                        raise prefetched.error
+                    with trace.track(_track_name(source_path)):
+                        build_from_spec(
+                            spec, package_context, unpacked=prefetched.result
+                        )
+                except Exception as exc:
+                    _package_failed(
+                        package_context.paths.source_path,
+                        exc,
+                        failures,
+                        context=context,
+                    )
+                yield
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def _load_package_specs(
+    packages: Iterator[BuildPaths],
+    failures: list[tuple[Path, Exception]],
+    *,
+    context: GlobalBuildContext,
+) -> list[tuple[PackageBuildContext, PackageBuildSpec]]:
+    specs = []
     for package in packages:
-        discover_build_package(package, context=context)
-        yield
+        try:
+            spec = load_package_spec(package, context=context)
+        except Exception as exc:
+            _package_failed(package.source_path, exc, failures, context=context)
+            continue
+        specs.append((PackageBuildContext(paths=package, context=context), spec))
+    return specs
+
+
+def _prefetch(
+    package_context: PackageBuildContext,
+    spec: PackageBuildSpec,
+    session: requests.Session,
+) -> _WorkerResult:
+    """Fetch and unpack a package source in the background, capturing the log so
+    it can be written when the package builds."""
+    log = StringIO()
+    prefetch_context = replace(
+        package_context, context=replace(package_context.context, output=log)
+    )
+    with trace.track(_track_name(package_context.paths.source_path)), trace.span(
+        "prefetch"
+    ):
+        return _prefetch_in(spec, prefetch_context, session, log)
+
+
+def _prefetch_in(
+    spec: PackageBuildSpec,
+    prefetch_context: PackageBuildContext,
+    session: requests.Session,
+    log: StringIO,
+) -> _WorkerResult:
+    try:
+        if _check_up_to_date(spec, prefetch_context)[1]:
+            return _WorkerResult(log=log.getvalue(), error=None)
+        unpacked = prepare_source(spec, prefetch_context, session=session)
+    except Exception as exc:
+        return _WorkerResult(log=log.getvalue(), error=exc)
+    return _WorkerResult(log=log.getvalue(), error=None, result=unpacked)
 
 
 def discover_build_package(package: BuildPaths, *, context: GlobalBuildContext) -> None:
     context.write(f"Building package in directory {package.source_path}")
+    _exec_build_file(package, context=context)
+
+
+def load_package_spec(
+    package: BuildPaths, *, context: GlobalBuildContext
+) -> PackageBuildSpec:
+    """Run a package's build.py to find out how to build the package, without
+    building it."""
+    collected: list[PackageBuildSpec] = []
+    token = _collected_specs.set(collected)
+    try:
+        _exec_build_file(package, context=context)
+    finally:
+        _collected_specs.reset(token)
+    if len(collected) != 1:
+        raise RuntimeError(
+            f"{package.source_path / 'build.py'} must call build_package exactly once"
+        )
+    return collected[0]
+
+
+def _exec_build_file(package: BuildPaths, *, context: GlobalBuildContext) -> None:
     package_context = PackageBuildContext(paths=package, context=context)
     package_build_file = package.source_path / "build.py"
-    build_obj = compile(package_build_file.open().read(), package_build_file, "exec")
-    injected_globals = globals()
-    injected_globals["opentrons_package_build_context"] = package_context
-    exec(build_obj, injected_globals)
+    build_obj = compile(package_build_file.read_text(), package_build_file, "exec")
+    token = _package_build_context.set(package_context)
+    try:
+        with trace.track(_track_name(package.source_path)), trace.span("build.py"):
+            exec(
+                build_obj, {"__name__": "__main__", "__file__": str(package_build_file)}
+            )
+    finally:
+        _package_build_context.reset(token)
+
+
+def _track_name(source_path: Path) -> str:
+    """The trace track for a package: its directory in the package tree, which is
+    usually name/version. The build report names packages by it too."""
+    return f"{source_path.parent.name}/{source_path.name}"
 
 
 # This function is called by the exec'd build_package call in build.py
-# package build files. It relies on having the build paths in the globals.
+# package build files. It relies on discover_build_package having set the
+# package build context.
 def build_package(
     source: GithubDevSource | GithubReleaseSDistSource,
     setup_py_commands: list[str] | None = None,
     build_dependencies: list[str] | None = None,
+    compile_jobs: int | None = None,
+    backend: BuildBackend = "setup.py",
 ) -> Path:
     """
     Build a package. The main entry point for package builds.
@@ -110,49 +488,229 @@ def build_package(
     setup_py_command: The command to use with setup.py to build the package. If
                       not specified, build_wheel.
     build_dependencies: any python dependencies required for the build.
+    compile_jobs: how many files build_ext compiles at once. If not specified,
+                  --compile-jobs, or else as many as there are CPUs for. Set
+                  this to 1 if the package's extensions can't build in parallel.
+    backend: "setup.py" to build by running setup_py_commands, or "pep517" to
+             build by calling the build backend named in the package's
+             pyproject.toml. The backend and its requirements need to be in
+             build_dependencies. setup_py_commands and compile_jobs are only
+             used for setup.py builds.
+
+    If the package was built before with exactly the same inputs and its wheel
+    is still in the dist directory, the build is skipped.
+
+    Returns
+    -------
+    The path to the built wheel. If the build.py is only being read to find out
+    how to build the package, nothing is built and the package's dist directory
+    is returned.
+    """
+    try:
+        context = _package_build_context.get()
+    except LookupError:
+        raise RuntimeError(
+            "build_package must be called from a build.py run by the builder"
+        )
+    spec = PackageBuildSpec(
+        source=source,
+        setup_py_commands=setup_py_commands or ["bdist_wheel"],
+        build_dependencies=build_dependencies or [],
+        compile_jobs=compile_jobs,
+        backend=backend,
+    )
+    collected = _collected_specs.get()
+    if collected is not None:
+        collected.append(spec)
+        return context.paths.dist_path
+    return build_from_spec(spec, context)
+
+
+def build_from_spec(
+    spec: PackageBuildSpec,
+    context: PackageBuildContext,
+    *,
+    unpacked: Path | None = None,
+) -> Path:
+    """
+    Build a package from its spec, unless it is up to date.
+
+    Params
+    ------
+    spec: How to build the package
+    context: The context for this package's build
+    unpacked: The path to the package's unpacked source, if it was already fetched
+              and unpacked with prepare_source
 
     Returns
     -------
     The path to the built wheel.
     """
-    global opentrons_package_build_context
-    # this is injected as a global because this function gets called from an exec'd file
-    context: PackageBuildContext = opentrons_package_build_context  # type: ignore[name-defined]
     context.context.write_verbose(
-        f"building package {source.name}:\n"
+        f"building package {spec.source.name}:\n"
         f"{context.prettyprint()}\n"
-        f"{source.prettyprint()}"
+        f"{spec.source.prettyprint()}"
     )
-    context.paths.build_path.mkdir(parents=True, exist_ok=True)
-    context.paths.dist_path.mkdir(parents=True, exist_ok=True)
+    with trace.span("build", package=spec.source.name):
+        with trace.span("check up to date"):
+            fingerprint, previous = _check_up_to_date(spec, context)
+        if previous:
+            context.context.write(f"{spec.source.name} is up to date with {previous}")
+            _note_wheel(previous, "up to date")
+            return previous
+        context.paths.build_path.mkdir(parents=True, exist_ok=True)
+        if unpacked is None:
+            unpacked = prepare_source(spec, context)
+        wheelfile = compile_package(spec, context, unpacked)
+        record_build(context.paths.build_path / MANIFEST_NAME, fingerprint, wheelfile)
+        _note_wheel(wheelfile, "built")
+        return wheelfile
 
-    download_dir = context.paths.build_path / "download/"
-    build_dir = context.paths.build_path / "build/"
-    unpack_dir = context.paths.build_path / "unpack/"
-    venv_dir = context.paths.build_path / "venv"
 
-    commands = setup_py_commands or ["bdist_wheel"]
+def _note_wheel(wheelfile: Path, status: str) -> None:
+    trace.note("wheel", file=wheelfile.name, bytes=wheelfile.stat().st_size)
+    trace.note("status", status=status)
 
-    for dirname in (download_dir, build_dir, unpack_dir, venv_dir):
-        dirname.mkdir(exist_ok=True)
 
-    fetched = fetch_source(source, download_dir, context=context.context)
-    context.context.write(f"Fetched to {fetched}")
-    unpacked = unpack_source(
-        unpack_dir,
-        download_dir / source.archive_name(),
-        getattr(source, "package_source_path", None) or Path("."),
-        context=context.context,
+def _check_up_to_date(
+    spec: PackageBuildSpec, context: PackageBuildContext
+) -> tuple[BuildFingerprint, Path | None]:
+    """Fingerprint a package build, and find the wheel from its last build if that
+    build had the same fingerprint."""
+    fingerprint = fingerprint_package(
+        context.paths.source_path / "build.py",
+        spec.source,
+        spec.setup_py_commands,
+        spec.build_dependencies,
+        context.context.sdk_path,
     )
+    if context.context.force_rebuild:
+        return fingerprint, None
+    return fingerprint, up_to_date_wheel(
+        context.paths.build_path / MANIFEST_NAME, fingerprint, context.paths.dist_path
+    )
+
+
+def _work_dir(context: PackageBuildContext, name: str) -> Path:
+    work_dir = context.paths.build_path / name
+    work_dir.mkdir(parents=True, exist_ok=True)
+    return work_dir
+
+
+def prepare_source(
+    spec: PackageBuildSpec,
+    context: PackageBuildContext,
+    *,
+    session: requests.Session | None = None,
+) -> Path:
+    """Fetch and unpack a package's source. Returns the path to the unpacked
+    source."""
+    download_dir = _work_dir(context, "download")
+    from_archive_path = getattr(spec.source, "package_source_path", None) or Path(".")
+    if context.context.stream_unpack:
+        with trace.span("fetch and unpack", source=spec.source.name):
+            unpacked = fetch_and_unpack_source(
+                spec.source,
+                download_dir,
+                _work_dir(context, "unpack"),
+                from_archive_path,
+                context=context.context,
+                session=session,
+            )
+        context.context.write(f"Unpacked to {str(unpacked)}")
+        _note_unpacked(unpacked)
+        return unpacked
+    with trace.span("fetch", source=spec.source.name):
+        fetched = fetch_source(
+            spec.source, download_dir, context=context.context, session=session
+        )
+    context.context.write(f"Fetched to {fetched}")
+    with trace.span("unpack", archive=fetched.name):
+        unpacked = unpack_source(
+            _work_dir(context, "unpack"),
+            fetched,
+            from_archive_path,
+            context=context.context,
+        )
     context.context.write(f"Unpacked to {str(unpacked)}")
-    wheelfile = build_with_setup_py(
-        commands,
-        unpacked,
-        build_dir,
-        context.paths.dist_path,
-        venv_dir,
-        build_dependencies or [],
-        context=context.context,
+    _note_unpacked(unpacked)
+    return unpacked
+
+
+def _note_unpacked(unpacked: Path) -> None:
+    if not trace.recording_active():
+        return
+    trace.note(
+        "unpacked",
+        bytes=sum(
+            path.lstat().st_size for path in unpacked.rglob("*") if path.is_file()
+        ),
     )
+
+
+def compile_package(
+    spec: PackageBuildSpec, context: PackageBuildContext, unpacked: Path
+) -> Path:
+    """Build a wheel from a package's unpacked source. Returns the path to the
+    wheel."""
+    context.paths.dist_path.mkdir(parents=True, exist_ok=True)
+    # the wheel is built somewhere else and then put in the dist tree as a new
+    # file, since builds write wheels in place and the index can share the file
+    # in the dist tree (see generate_index.placement)
+    wheel_dir = _work_dir(context, "wheel")
+    shutil.rmtree(wheel_dir)
+    wheel_dir.mkdir()
+    deadline = None
+    if context.context.package_timeout:
+        deadline = time.monotonic() + context.context.package_timeout
+    if spec.backend == "pep517":
+        wheelfile = build_with_pep517(
+            unpacked,
+            _work_dir(context, "build"),
+            wheel_dir,
+            _work_dir(context, "venv"),
+            spec.build_dependencies,
+            context=context.context,
+            deadline=deadline,
+        )
+    else:
+        wheelfile = build_with_setup_py(
+            spec.setup_py_commands,
+            unpacked,
+            _work_dir(context, "build"),
+            wheel_dir,
+            _work_dir(context, "venv"),
+            spec.build_dependencies,
+            context=context.context,
+            compile_jobs=_compile_jobs(spec, context.context),
+            deadline=deadline,
+        )
+    wheelfile = _replace_in_dist(wheelfile, context.paths.dist_path)
     context.context.write(f"Built {wheelfile}")
     return wheelfile
+
+
+def _replace_in_dist(wheel: Path, dist_dir: Path) -> Path:
+    """Put a built wheel in the dist tree as a new file, replacing any wheel of
+    the same name there without writing to it."""
+    target = dist_dir / wheel.name
+    temporary = dist_dir / f".{wheel.name}.{uuid.uuid4().hex}.tmp"
+    try:
+        shutil.copyfile(wheel, temporary)
+        os.replace(temporary, target)
+    finally:
+        temporary.unlink(missing_ok=True)
+    return target
+
+
+def _compile_jobs(spec: PackageBuildSpec, context: GlobalBuildContext) -> int:
+    """How many files a package's build_ext should compile at once: what the
+    package asks for, else what the command line asks for, else an even share of
+    the container's CPUs between the packages building at once."""
+    if spec.compile_jobs:
+        return spec.compile_jobs
+    return _default_compile_jobs(context)
+
+
+def _default_compile_jobs(context: GlobalBuildContext) -> int:
+    return context.compile_jobs or max(1, available_cpus() // context.jobs)
@@ -0,0 +1,191 @@
+"""
+builder.package_build.report - a machine-readable summary of a package build
+
+After packages are built, a JSON report is written next to the dist tree with,
+for each package, how long each phase of its build took, how much it downloaded
+and unpacked, how big its wheel is, which caches it hit, and whether it built -
+with the end of its log if it didn't - and totals across the build at the top.
+CI can track build times across commits from it, and the next parallel build
+uses it to start the packages that took longest first. Packages that were up to
+date or failed carry over how long they took the last time they were built from
+the report before, so that history survives builds that don't build them.
+
+The report is made from the build's trace (see builder.common.trace): phase
+durations from its spans, and everything else from the notes the build makes
+along the way.
+"""
+import json
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+from builder.common import trace
+
+REPORT_NAME = "build-report.json"
+
+# tracks in the trace that aren't packages
+_NOT_PACKAGES = {trace.MAIN_TRACK, trace.INDEX_TRACK}
+
+
+@dataclass
+class PackageReport:
+    package: str
+    #: The package's directory in the package tree, like pandas/1.5.0
+    status: str = "unknown"
+    #: built, up to date, failed, or unknown if the build stopped first
+    duration_s: float = 0.0
+    #: How long the package took, not counting time waiting for other packages
+    build_duration_s: float | None = None
+    #: How long the package took the last time it was built, in this build or an
+    #: earlier one, if it's been built
+    phases_s: dict[str, float] = field(default_factory=dict)
+    #: How long each phase of the build took
+    bytes_downloaded: int = 0
+    #: How much of the source came over the network rather than from the cache
+    unpacked_bytes: int | None = None
+    #: How big the unpacked source is
+    wheel: str | None = None
+    #: The file name of the package's wheel
+    wheel_bytes: int | None = None
+    #: How big the wheel is
+    cache_hits: dict[str, bool | int] = field(default_factory=dict)
+    #: Whether each cache (download, venv) hit, and how many compiles ccache hit
+    #: and missed
+    error: str | None = None
+    #: Why the build failed, if it did
+    log_tail: list[str] = field(default_factory=list)
+    #: The end of the log of the failed build, if it failed
+
+
+@dataclass
+class ReportTotals:
+    duration_s: float
+    #: How long the whole build took
+    packages: int
+    #: How many packages there were
+    statuses: dict[str, int]
+    #: How many packages ended up with each status
+    phases_s: dict[str, float]
+    #: How long each phase took, across all packages
+    bytes_downloaded: int
+    #: How much was downloaded, across all packages
+    wheel_bytes: int
+    #: How big all the wheels are together
+
+
+def write_report(
+    report_path: Path, events: Iterable[trace.Event], duration_s: float
+) -> None:
+    """Write a report of a package build from the build's trace events, over
+    the report of the last build if there is one."""
+    packages = package_reports(events)
+    history = historical_durations(report_path)
+    for package in packages:
+        if package.status == "built":
+            package.build_duration_s = package.duration_s
+        else:
+            package.build_duration_s = history.get(package.package)
+    phases: Counter[str] = Counter()
+    for package in packages:
+        phases.update(package.phases_s)
+    totals = ReportTotals(
+        duration_s=round(duration_s, 3),
+        packages=len(packages),
+        statuses=dict(Counter(package.status for package in packages)),
+        phases_s={name: round(seconds, 3) for name, seconds in phases.items()},
+        bytes_downloaded=sum(package.bytes_downloaded for package in packages),
+        wheel_bytes=sum(package.wheel_bytes or 0 for package in packages),
+    )
+    report = {
+        "totals": asdict(totals),
+        "packages": [asdict(package) for package in packages],
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def package_reports(events: Iterable[trace.Event]) -> list[PackageReport]:
+    """Summarize the trace events on each package's track."""
+    reports: dict[str, PackageReport] = {}
+    # the spans open on each track, innermost last, with when they began and
+    # how many spans they were inside of
+    open_spans: defaultdict[str, list[tuple[str, int, int]]] = defaultdict(list)
+    # events from workers are merged in whenever their package finishes
+    for event in sorted(events, key=lambda event: event["ts"]):
+        track = event["track"]
+        if track in _NOT_PACKAGES:
+            continue
+        report = reports.setdefault(track, PackageReport(package=track))
+        if event["ph"] == "B":
+            spans = open_spans[track]
+            spans.append((event["name"], event["ts"], len(spans)))
+        elif event["ph"] == "E":
+            _end_span(report, open_spans[track], event)
+        elif event["ph"] == "i":
+            _apply_note(report, event["name"], event["args"])
+    for report in reports.values():
+        report.duration_s = round(report.duration_s, 3)
+        report.phases_s = {
+            name: round(seconds, 3) for name, seconds in report.phases_s.items()
+        }
+    return list(reports.values())
+
+
+def _end_span(
+    report: PackageReport,
+    open_spans: list[tuple[str, int, int]],
+    event: trace.Event,
+) -> None:
+    for index in reversed(range(len(open_spans))):
+        name, began, depth = open_spans[index]
+        if name == event["name"]:
+            break
+    else:
+        return
+    del open_spans[index]
+    seconds = (event["ts"] - began) / 1e6
+    report.phases_s[name] = report.phases_s.get(name, 0.0) + seconds
+    # the outermost spans together cover the whole time spent on the package
+    if depth == 0:
+        report.duration_s += seconds
+
+
+def _apply_note(report: PackageReport, name: str, args: dict[str, Any]) -> None:
+    match name:
+        case "download":
+            report.bytes_downloaded += args["bytes"]
+            report.cache_hits["download"] = args["cached"]
+        case "unpacked":
+            report.unpacked_bytes = args["bytes"]
+        case "venv":
+            report.cache_hits["venv"] = args["cached"]
+        case "ccache":
+            report.cache_hits["ccache_hits"] = args["hits"]
+            report.cache_hits["ccache_misses"] = args["misses"]
+        case "wheel":
+            report.wheel = args["file"]
+            report.wheel_bytes = args["bytes"]
+        case "status":
+            report.status = args["status"]
+            report.error = args.get("error")
+            report.log_tail = args.get("log_tail", [])
+
+
+def historical_durations(report_path: Path) -> dict[str, float]:
+    """How long each package in the report took the last time it was built.
+    Checking that a package is up to date says nothing about how long it takes
+    to build, so only builds count. Empty if there's no report."""
+    try:
+        report = json.loads(report_path.read_text())
+    except (OSError, ValueError):
+        return {}
+    durations = {}
+    for package in report.get("packages", []):
+        duration = package.get("build_duration_s")
+        if duration is None and package.get("status") == "built":
+            # written before reports carried build durations over
+            duration = package.get("duration_s")
+        if duration is not None:
+            durations[package["package"]] = duration
+    return durations
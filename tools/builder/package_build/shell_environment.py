@@ -1,24 +1,76 @@
 """shell_environment - utils for running commands through the shell."""
+import codecs
+import os
+import selectors
 import subprocess
 from pathlib import Path
 from contextlib import contextmanager
 from io import TextIOBase
 from dataclasses import dataclass
-from typing import Callable, TypeVar, Type, Iterator, cast
+from typing import IO, Any, Callable, TypeVar, Type, Iterator, cast
 import shlex
 import re
+import signal
 import time
-from functools import wraps
-from builder.common.shellcommand import ShellCommandFailed
+from functools import lru_cache, wraps
+from builder.common.shellcommand import ShellCommandFailed, ShellCommandTimedOut
+from .compiler_cache import CompilerCache
 
 _SubshellType = TypeVar("_SubshellType", bound="SDKSubshell")
 EchoFunc = Callable[[str], None]
 
 
+# big enough that a chatty compile is read in a few large chunks rather than
+# line by line
+_READ_SIZE = 2**16
+
+
+class _OutputPump:
+    """
+    Reads a subshell's output in chunks, as soon as there is any.
+
+    Builds can print hundreds of thousands of lines, so reading them one at a
+    time through a text wrapper is a measurable cost; this reads whatever is
+    available straight from the pipe and decodes it incrementally.
+    """
+
+    def __init__(self, stream: IO[Any]) -> None:
+        self._fd = stream.fileno()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._fd, selectors.EVENT_READ)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def read(self, timeout: float | None = None) -> str | None:
+        """Wait for output and return what there is. Returns an empty string
+        when the output is closed, or None if there was no output before the
+        timeout (in seconds)."""
+        if not self._selector.select(timeout):
+            return None
+        data = os.read(self._fd, _READ_SIZE)
+        return self._decoder.decode(data, final=not data)
+
+    def close(self) -> None:
+        if self._selector.get_map() is not None:
+            self._selector.close()
+
+
+@dataclass(frozen=True)
+class _TimeLimit:
+    at: float | None
+    #: The time.monotonic() time a command must finish by, if there is one
+    message: str
+    #: What to say if it doesn't
+
+    def remaining(self) -> float | None:
+        if self.at is None:
+            return None
+        return max(0.0, self.at - time.monotonic())
+
+
 @dataclass
 class _SubshellHandles:
     stdin: TextIOBase
-    stdout: TextIOBase
+    output: _OutputPump
 
 
 class SDKSubshell:
@@ -26,15 +78,19 @@ class SDKSubshell:
     Manages a concurrently-running subshell with the buildroot SDK
     active. Since the SDK manipulates the shell environment, we need
     to either activate it every time or keep a consistent subshell
-    for each package.
+    for each package. The SDK's environment is captured once per process
+    (see sdk_environment) and each subshell starts with it.
 
     Make an instance of this class for each package build.
 
-    Use the classmethod build to build this class so the SDK gets activated
-    correctly.
+    Use the classmethods scoped or persistent to build this class so the SDK
+    gets activated correctly.
     """
 
-    _result_re = re.compile(r"^xxxresultxxx:xxx(-?\d+)xxx$", flags=re.MULTILINE)
+    # the result marker is the last thing a command prints, so it's only looked
+    # for in the last few characters of output
+    _result_re = re.compile(r"xxxresultxxx:xxx(-?\d+)xxx\n\Z")
+    _result_window = 64
 
     @staticmethod
     def echo_wrap_prevent_double_newlines(echoer: EchoFunc) -> EchoFunc:
@@ -54,13 +110,23 @@ class SDKSubshell:
         sdk_path: Path,
         echo: EchoFunc | None = None,
         echo_verbose: EchoFunc | None = None,
+        *,
+        command_timeout: float | None = None,
+        deadline: float | None = None,
     ) -> Iterator[_SubshellType]:
         """
         Provides a context manager entry for the shell instance that automatically
         stops it when the context is left. For a persistent version without a context
         manager use persistent().
         """
-        instance = cls.persistent(in_directory, sdk_path, echo, echo_verbose)
+        instance = cls.persistent(
+            in_directory,
+            sdk_path,
+            echo,
+            echo_verbose,
+            command_timeout=command_timeout,
+            deadline=deadline,
+        )
         try:
             yield instance
         finally:
@@ -73,31 +139,61 @@ class SDKSubshell:
         sdk_path: Path,
         echo: EchoFunc | None = None,
         echo_verbose: EchoFunc | None = None,
+        *,
+        command_timeout: float | None = None,
+        deadline: float | None = None,
     ) -> _SubshellType:
         """
         Build a persistent subshell that can be passed around. Must be stopped
         explicitly. For a scoped instance that is a context manager, use scoped().
+
+        If command_timeout (in seconds) is given, any command that runs for longer
+        is killed and ShellCommandTimedOut is raised; likewise for any command
+        still running at deadline (a time.monotonic() time).
         """
-        subshell = cls(in_directory, echo, echo_verbose)
-        subshell._initiate_sdk(sdk_path)
-        return subshell
+        return cls(
+            in_directory,
+            echo,
+            echo_verbose,
+            sdk_environment(sdk_path),
+            command_timeout=command_timeout,
+            deadline=deadline,
+        )
 
     def stop(self) -> None:
-        """stops the running shell"""
-        self._proc.terminate()
-        while self._proc.poll():
-            time.sleep(0.1)
+        """stops the running shell, and everything running in it"""
+        if self._proc.returncode is None:
+            self._signal_commands(signal.SIGTERM)
+            try:
+                self._proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._signal_commands(signal.SIGKILL)
+                self._proc.wait()
+        self._output.close()
+
+    def _signal_commands(self, signum: int) -> None:
+        # the shell leads its own process group, so this reaches whatever it's
+        # running (and whatever that started) as well as the shell itself
+        try:
+            os.killpg(self._proc.pid, signum)
+        except ProcessLookupError:
+            pass
 
     def run(self, cmd: list[str]) -> str:
-        return "\n".join(self._guarded_shellcall(shlex.join(cmd)))
+        return self._guarded_shellcall(shlex.join(cmd))
 
-    def initiate_python_environment(self, sdk_path: Path) -> None:
+    def initiate_python_environment(
+        self, sdk_path: Path, compiler_cache: CompilerCache | None = None
+    ) -> None:
         """
         Prepare the shell environment for building python.
 
         This _must_ be called _before_ you try and build packages and _after_
         any python-side prep (activating venvs, installing dependencies) because
         it messes with extremely core python behavior in the shell.
+
+        If compiler_cache is given, the SDK's C and C++ compilers are run through
+        ccache with its configuration.
         """
         sysroot = sdk_path / "arm-buildroot-linux-gnueabihf" / "sysroot"
         sysconfigdata_name = "_sysconfigdata__linux_arm-linux-gnueabihf"
@@ -112,6 +208,15 @@ class SDKSubshell:
         self._guarded_shellcall("export _python_prefix=/usr")
         self._guarded_shellcall("export _python_exec_prefix=/usr")
         self._guarded_shellcall("export PYTHONNOUSERSITE=1")
+        if compiler_cache:
+            for name, value in compiler_cache.environment().items():
+                self._guarded_shellcall(f"export {name}={shlex.quote(value)}")
+            # distutils uses CC and CXX over the sysconfigdata compilers when
+            # they're set, which the sdk's environment-setup does
+            for compiler in ("CC", "CXX"):
+                self._guarded_shellcall(
+                    f'if [ -n "${compiler}" ]; then export {compiler}="ccache ${compiler}"; fi'
+                )
 
     def _shellcall(
         self,
@@ -119,13 +224,15 @@ class SDKSubshell:
         handles: _SubshellHandles,
         *,
         command_echo_is_verbose: bool = False,
-    ) -> tuple[int, list[str]]:
+    ) -> tuple[int, str]:
         """Run a call in the shell and check that it succeeded.
 
         return code detection only really works if the return code of cmd is
         relevant to the main thing that happens in cmd. that means that cmd shouldn't
         have || clauses and really should just have one actual command.
 
+        Output is echoed a batch of whole lines at a time, as it arrives.
+
         Returns a tuple of (call retcode, stdout + stderr)
         """
         if cmd.endswith("\n"):
@@ -136,54 +243,106 @@ class SDKSubshell:
         else:
             self._echo(cmd)
         handles.stdin.write(cmd)
-        stdout_lines: list[str] = []
-        while True:
-            stdout = handles.stdout.readline()
-            self._echo_verbose(stdout)
-            stdout_lines.append(stdout)
-            if match := self._result_re.search(stdout):
-                return int(match.group(1)), stdout_lines
+        limit = self._time_limit()
+        output: list[str] = []
+        # output that hasn't been echoed yet: at most a partial line, plus
+        # whatever arrived since
+        pending = ""
+        while chunk := handles.output.read(limit.remaining()):
+            pending += chunk
+            match = self._result_re.search(
+                pending, max(0, len(pending) - self._result_window)
+            )
+            if match:
+                self._emit(pending[: match.start()], output)
+                return int(match.group(1)), "".join(output)
+            complete = pending.rfind("\n") + 1
+            if complete:
+                self._emit(pending[:complete], output)
+                pending = pending[complete:]
+        self._emit(pending, output)
+        if chunk is None:
+            self.stop()
+            raise ShellCommandTimedOut(
+                command=cmd,
+                returncode=self._proc.returncode,
+                message=limit.message,
+                output="".join(output),
+            )
+        raise ShellCommandFailed(
+            command=cmd,
+            returncode=self._proc.wait(),
+            message="subshell exited",
+            output="".join(output),
+        )
+
+    def _time_limit(self) -> _TimeLimit:
+        """How long the next command may run for."""
+        now = time.monotonic()
+        if self._command_timeout is not None and (
+            self._deadline is None or now + self._command_timeout < self._deadline
+        ):
+            return _TimeLimit(
+                now + self._command_timeout,
+                f"timed out after {self._command_timeout:g}s",
+            )
+        if self._deadline is not None:
+            return _TimeLimit(self._deadline, "ran past the package's time limit")
+        return _TimeLimit(None, "")
+
+    def _emit(self, text: str, output: list[str]) -> None:
+        if not text:
+            return
+        output.append(text)
+        self._echo_verbose(text)
 
     def _guarded_shellcall(
         self, cmd: str, *, command_echo_is_verbose: bool = False
-    ) -> list[str]:
+    ) -> str:
         """run a shellcall and return its result. raise if the call failed."""
         with self._guard() as handles:
             result, stdout = self._shellcall(
                 cmd, handles, command_echo_is_verbose=command_echo_is_verbose
             )
             if result != 0:
-                stdout_log = "".join(stdout[:-1])
                 raise ShellCommandFailed(
                     command=cmd,
                     returncode=result,
                     message="command failed",
-                    output=stdout_log,
+                    output=stdout,
                 )
             return stdout
 
-    def _initiate_sdk(self, sdk_path: Path) -> None:
-        self._guarded_shellcall(
-            f"source {sdk_path}/environment-setup", command_echo_is_verbose=True
-        )
-
     def __init__(
         self,
         in_directory: Path,
         echo: EchoFunc | None,
         echo_verbose: EchoFunc | None,
+        env: dict[str, str] | None = None,
+        *,
+        command_timeout: float | None = None,
+        deadline: float | None = None,
     ) -> None:
+        # the sdk environment comes in through env, so there's no need for an
+        # interactive shell or any startup files
         self._proc = subprocess.Popen(
-            ["/usr/bin/env", "bash", "-i"],
+            ["/usr/bin/env", "bash", "--noprofile", "--norc"],
             cwd=in_directory,
+            env=env,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             stdin=subprocess.PIPE,
             bufsize=1,
             text=True,
+            # so the shell and everything it runs can be killed together, and so
+            # that they're left alone by a ctrl-c that stop() will clean up after
+            start_new_session=True,
         )
+        self._command_timeout = command_timeout
+        self._deadline = deadline
+        self._output = _OutputPump(cast(IO[Any], self._proc.stdout))
         self._echo: EchoFunc = echo or (lambda _: None)
-        self._echo_verbose: EchoFunc = echo or (lambda _: None)
+        self._echo_verbose: EchoFunc = echo_verbose or (lambda _: None)
 
     @contextmanager
     def _guard(self) -> Iterator[_SubshellHandles]:
@@ -192,6 +351,40 @@ class SDKSubshell:
         if self._proc.poll() is not None:
             raise RuntimeError("Subshell closed")
         yield _SubshellHandles(
-            stdin=cast(TextIOBase, self._proc.stdin),
-            stdout=cast(TextIOBase, self._proc.stdout),
+            stdin=cast(TextIOBase, self._proc.stdin), output=self._output
+        )
+
+
+@lru_cache(maxsize=None)
+def _captured_sdk_environment(sdk_path: Path) -> tuple[tuple[str, str], ...]:
+    setup = sdk_path / "environment-setup"
+    # anything environment-setup prints goes to stderr, so stdout is just env
+    command = f"source {shlex.quote(str(setup))} >&2 && env -0"
+    result = subprocess.run(
+        ["/usr/bin/env", "bash", "--noprofile", "--norc", "-c", command],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise ShellCommandFailed(
+            command=command,
+            returncode=result.returncode,
+            message="could not set up the sdk environment",
+            output=result.stderr.decode(errors="replace"),
         )
+    variables = (
+        entry.decode(errors="surrogateescape").partition("=")
+        for entry in result.stdout.split(b"\0")
+        if entry
+    )
+    return tuple((name, value) for name, _, value in variables)
+
+
+def sdk_environment(sdk_path: Path) -> dict[str, str]:
+    """
+    The environment variables the SDK's environment-setup script sets up.
+
+    The script is only sourced the first time this is called for an SDK in each
+    process; subshells start with a copy of the result rather than sourcing it
+    themselves.
+    """
+    return dict(_captured_sdk_environment(sdk_path.resolve()))
@@ -1,7 +1,7 @@
 """build.types - types for building everything"""
 
 from dataclasses import dataclass
-from typing import Protocol
+from typing import Literal, Protocol
 from io import TextIOBase
 import os
 from pathlib import Path
@@ -33,6 +33,44 @@ class GlobalBuildContext:
     #: Whether that output should be verbose
     sdk_path: Path
     #: The path to the buildroot sdk, containing setup_environment
+    jobs: int = 1
+    #: How many packages may build at the same time
+    force_rebuild: bool = False
+    #: Whether to build packages even if they're up to date with their last build
+    prefetch: int = 0
+    #: How many upcoming packages to fetch and unpack while one compiles
+    stream_unpack: bool = False
+    #: Whether to unpack tar sources as they download instead of afterwards
+    cache_root: Path | None = None
+    #: Where to keep caches that persist between builds, or None to not cache
+    download_cache_max_bytes: int = 10 * 2**30
+    #: How big the cache of downloaded sources may get
+    use_wheelhouse: bool = False
+    #: Whether to install build dependencies only from the wheelhouse
+    ccache: bool = True
+    #: Whether to cache compiles with ccache, if the build is caching
+    compile_jobs: int | None = None
+    #: How many files build_ext compiles at once, or None to use every CPU
+    #: available to the container, shared between the packages building at once
+    command_timeout: float | None = None
+    #: Seconds any one build command may run before it is killed, if limited
+    package_timeout: float | None = None
+    #: Seconds a package's compile may take before it is killed, if limited
+    keep_going: bool = False
+    #: Whether to keep building other packages after one fails
+    trace_path: Path | None = None
+    #: Where to write a timeline of the build's phases, or None to not record one
+    build_report: Path | None = None
+    #: Where the build report is written. The last build's report there is used
+    #: to start the longest packages first in parallel builds
+
+    @property
+    def wheelhouse(self) -> Path | None:
+        """Where prefetched build dependency wheels are kept, or None if the
+        build is not caching."""
+        if self.cache_root is None:
+            return None
+        return self.cache_root / "wheelhouse"
 
     def write(self, logstr: str) -> None:
         if not self.output:
@@ -53,7 +91,21 @@ class GlobalBuildContext:
             f"{prefix}Global build context:\n"
             f'\t{prefix}output: {getattr(self.output, "name", self.output)}\n'
             f"\t{prefix}verbose: {self.verbose}\n"
-            f"\t{prefix}sdk path: {str(self.sdk_path)}"
+            f"\t{prefix}sdk path: {str(self.sdk_path)}\n"
+            f"\t{prefix}jobs: {self.jobs}\n"
+            f"\t{prefix}force rebuild: {self.force_rebuild}\n"
+            f"\t{prefix}prefetch: {self.prefetch}\n"
+            f"\t{prefix}stream unpack: {self.stream_unpack}\n"
+            f"\t{prefix}cache root: {self.cache_root}\n"
+            f"\t{prefix}download cache size: {self.download_cache_max_bytes}\n"
+            f"\t{prefix}use wheelhouse: {self.use_wheelhouse}\n"
+            f"\t{prefix}ccache: {self.ccache}\n"
+            f"\t{prefix}compile jobs: {self.compile_jobs or 'auto'}\n"
+            f"\t{prefix}command timeout: {self.command_timeout or 'none'}\n"
+            f"\t{prefix}package timeout: {self.package_timeout or 'none'}\n"
+            f"\t{prefix}keep going: {self.keep_going}\n"
+            f"\t{prefix}trace: {self.trace_path or 'none'}\n"
+            f"\t{prefix}build report: {self.build_report or 'none'}"
         )
 
 
@@ -84,6 +136,10 @@ class HTTPFetchableSource(Protocol):
     def archive_name(self) -> str:
         ...
 
+    @property
+    def sha256(self) -> str | None:
+        ...
+
 
 class ShellBuild(Protocol):
     def command(self, path_to_unpacked: str) -> list[str]:
@@ -132,6 +188,9 @@ class GithubReleaseSDistSource(_GithubSource):
     for pandas 1.5.0)
     """
 
+    sha256: str | None = None
+    """The expected sha256 hex digest of the archive, if it is pinned"""
+
     def url(self) -> str:
         return f"https://github.com/{self.org}/{self.repo}/releases/download/{self.tag}/{self.package_name}"
 
@@ -144,6 +203,7 @@ class GithubReleaseSDistSource(_GithubSource):
             f"{super().prettyprint(prefix)}\n"
             f"{prefix}\tURL: {self.url()}\n"
             f"{prefix}\tArchive file name: {self.archive_name()}\n"
+            f"{prefix}\tsha256: {self.sha256 or 'not pinned'}\n"
         )
 
 
@@ -156,6 +216,9 @@ class GithubDevSource(_GithubSource):
 
     package_source_path: str | None = None
 
+    sha256: str | None = None
+    """The expected sha256 hex digest of the archive, if it is pinned"""
+
     def url(self) -> str:
         return f"https://github.com/{self.org}/{self.repo}/archive/refs/tags/{self.tag}.zip"
 
@@ -167,5 +230,31 @@ class GithubDevSource(_GithubSource):
             f"{prefix}Dev source from github:\n"
             f"{super().prettyprint(prefix)}\n"
             f"{prefix}\tURL: {self.url()}\n"
-            f"{prefix}\tarchive name: {self.archive_name()}"
+            f"{prefix}\tarchive name: {self.archive_name()}\n"
+            f"{prefix}\tsha256: {self.sha256 or 'not pinned'}"
         )
+
+
+BuildBackend = Literal["setup.py", "pep517"]
+
+
+@dataclass
+class PackageBuildSpec:
+    """Everything a package's build.py says about how to build it."""
+
+    source: GithubDevSource | GithubReleaseSDistSource
+    """Where to get the package source"""
+
+    setup_py_commands: list[str]
+    """The setup.py commands that build the package, in order"""
+
+    build_dependencies: list[str]
+    """Python packages that need to be installed to build the package"""
+
+    compile_jobs: int | None = None
+    """How many files build_ext compiles at once, if the package needs a
+    particular number"""
+
+    backend: BuildBackend = "setup.py"
+    """How to build the package: by running setup_py_commands, or by calling
+    the build backend in its pyproject.toml"""
@@ -0,0 +1,132 @@
+"""
+builder.package_build.venv_cache - reuse build venvs between package builds
+
+Making a build venv means installing every build dependency from pypi, which is
+slow (numpy especially). A venv is fully determined by the dependencies
+installed into it, the python that made it and the sdk it was made in, so after
+one is set up it is saved under a key made from those, and any later build that
+needs the same thing gets a clone of it instead.
+
+Clones are made with hardlinks where possible, since nothing in a venv is
+modified in place once it's set up, and fall back to copies. Venvs aren't
+relocatable - the activate scripts and the shebangs of installed scripts hold the
+venv's absolute path - so those files are rewritten in the clone.
+"""
+
+import json
+import os
+import platform
+import shutil
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+
+from .fingerprint import sdk_identity
+from .types import GlobalBuildContext
+
+_MANIFEST_NAME = "venv-cache.json"
+
+
+def normalize_dependencies(deps: Iterable[str]) -> list[str]:
+    """Dependencies in a canonical order and spelling, so that the same set
+    always makes the same key."""
+    return sorted({"".join(dep.split()).lower() for dep in deps})
+
+
+class VenvCache:
+    """
+    A cache of set-up build venvs, keyed by what went into them.
+
+    It's safe for several package builds to share one cache directory at the
+    same time: venvs are saved to a temporary directory and renamed into place,
+    and if two builds save the same venv, the first one wins.
+    """
+
+    def __init__(self, root: Path, sdk_path: Path) -> None:
+        self._root = root
+        self._sdk = sdk_identity(sdk_path)
+        self._root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def for_context(cls, context: GlobalBuildContext) -> "VenvCache | None":
+        """The venv cache for a build, or None if the build is not caching."""
+        if context.cache_root is None:
+            return None
+        return cls(context.cache_root / "venvs", context.sdk_path)
+
+    def key(self, deps: Iterable[str]) -> str:
+        """The key for a venv with these dependencies installed."""
+        identity = {
+            "dependencies": normalize_dependencies(deps),
+            "python": platform.python_version(),
+            "sdk": self._sdk,
+        }
+        return sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def restore(self, key: str, venv_dir: Path) -> bool:
+        """Clone the cached venv for a key to venv_dir, replacing anything
+        there. Returns False if there is no such venv."""
+        entry = self._root / key
+        try:
+            manifest = json.loads((entry / _MANIFEST_NAME).read_text())
+            prefix = str(manifest["prefix"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        shutil.rmtree(venv_dir, ignore_errors=True)
+        _clone_venv(entry, prefix, venv_dir)
+        (venv_dir / _MANIFEST_NAME).unlink()
+        return True
+
+    def save(self, key: str, venv_dir: Path, deps: Iterable[str]) -> None:
+        """Save a set-up venv under a key."""
+        entry = self._root / key
+        if entry.exists():
+            return
+        staging = self._root / f".{key}.{uuid.uuid4().hex}"
+        try:
+            # the venv is rewritten for where it will end up, not for staging,
+            # so it's correct as soon as it's renamed into place
+            _clone_venv(venv_dir, str(venv_dir), staging, rewrite_to=entry)
+            (staging / _MANIFEST_NAME).write_text(
+                json.dumps(
+                    {
+                        "prefix": str(entry),
+                        "dependencies": normalize_dependencies(deps),
+                    }
+                )
+            )
+            os.rename(staging, entry)
+        except OSError:
+            # someone else saved it first
+            if not entry.exists():
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def _clone_venv(
+    source: Path, source_prefix: str, to: Path, *, rewrite_to: Path | None = None
+) -> None:
+    shutil.copytree(source, to, symlinks=True, copy_function=_link_or_copy)
+    old = source_prefix.encode()
+    new = str(rewrite_to or to).encode()
+    for candidate in [to / "pyvenv.cfg", *(to / "bin").iterdir()]:
+        if candidate.is_symlink() or not candidate.is_file():
+            continue
+        content = candidate.read_bytes()
+        if old not in content:
+            continue
+        # the clone may be a hardlink to the original, so it must be replaced
+        # rather than written over
+        rewritten = candidate.with_name(f".{candidate.name}.rewrite")
+        rewritten.write_bytes(content.replace(old, new))
+        shutil.copymode(candidate, rewritten)
+        os.replace(rewritten, candidate)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
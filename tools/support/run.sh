@@ -32,6 +32,11 @@ if [[ "$uid" -ne "0" ]] ; then
     # user whatever name we want.
     groupadd -g $gid builder
     useradd -l -u $uid -g builder builder
+    # a cache volume is created owned by root, and may have been used by a
+    # different uid last time
+    if [[ -d /build-environment/cache ]] ; then
+        chown -R builder:builder /build-environment/cache
+    fi
     preamble="runuser -u builder --"
     echo 'Ownership changed, will run as builder'
 else
@@ -0,0 +1,43 @@
+from io import StringIO
+import sys
+import time
+
+import pytest
+
+from builder.common.shellcommand import ShellCommandFailed, run_simple
+
+
+def test_run_simple_echoes_when_verbose() -> None:
+    output = StringIO()
+    result = run_simple(
+        ["printf", "one\ntwo\n"], name="printf", output=output, verbose=True
+    )
+    assert result == "one\ntwo"
+    assert output.getvalue() == "printf one\ntwo\n\none\ntwo\n"
+
+
+def test_run_simple_quiet() -> None:
+    output = StringIO()
+    assert run_simple(["echo", "hi"], name="echo", output=output) == "hi"
+    assert output.getvalue() == ""
+
+
+def test_run_simple_failure_keeps_tail() -> None:
+    with pytest.raises(ShellCommandFailed) as exc_info:
+        run_simple(
+            [sys.executable, "-c", "[print(i) for i in range(100000)]; exit(3)"],
+            name="counting",
+            output=StringIO(),
+        )
+    assert exc_info.value.returncode == 3
+    assert exc_info.value.message == "counting failed"
+    lines = exc_info.value.output.split("\n")
+    assert len(lines) == 200
+    assert lines[-1] == "99999"
+
+
+def test_run_simple_returns_when_process_exits() -> None:
+    # the background sleep keeps the output pipe open after the shell exits
+    start = time.monotonic()
+    run_simple(["sh", "-c", "echo done; sleep 5 &"], name="sh", output=StringIO())
+    assert time.monotonic() - start < 3
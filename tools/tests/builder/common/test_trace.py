@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+import threading
+
+from builder.common import trace
+
+
+def test_spans_do_nothing_unless_recording() -> None:
+    with trace.span("phase"):
+        pass
+    with trace.recording() as recorded:
+        pass
+    assert recorded.events == []
+
+
+def _span_in_thread() -> None:
+    with trace.span("in thread"):
+        pass
+
+
+def test_spans_go_on_their_track(run_path: Path) -> None:
+    with trace.recording() as recorded:
+        with trace.span("outer"):
+            with trace.track("pandas/1.5.0"), trace.span("fetch", source="pandas"):
+                pass
+        other_thread = threading.Thread(target=_span_in_thread)
+        other_thread.start()
+        other_thread.join()
+        trace.merge(
+            [{"name": "from worker", "ph": "B", "ts": 1, "track": "numpy/1.16.6"}]
+        )
+    recorded.write(str(run_path / "trace.json"))
+    written = json.loads((run_path / "trace.json").read_text())["traceEvents"]
+
+    tracks = {
+        event["args"]["name"]: event["tid"]
+        for event in written
+        if event["name"] == "thread_name"
+    }
+    assert list(tracks) == ["build", "pandas/1.5.0", "numpy/1.16.6"]
+    phases = [
+        (event["name"], event["ph"], event["tid"])
+        for event in written
+        if event["ph"] != "M"
+    ]
+    assert phases == [
+        ("outer", "B", tracks["build"]),
+        ("fetch", "B", tracks["pandas/1.5.0"]),
+        ("fetch", "E", tracks["pandas/1.5.0"]),
+        ("outer", "E", tracks["build"]),
+        ("in thread", "B", tracks["build"]),
+        ("in thread", "E", tracks["build"]),
+        ("from worker", "B", tracks["numpy/1.16.6"]),
+    ]
+    fetch_begin = next(event for event in written if event["name"] == "fetch")
+    assert fetch_begin["args"] == {"source": "pandas"}
+    assert all(event["pid"] == 0 for event in written)
+
+
+def test_span_ends_when_block_raises() -> None:
+    with trace.recording() as recorded:
+        try:
+            with trace.span("failing"):
+                raise RuntimeError("oh no")
+        except RuntimeError:
+            pass
+    assert [event["ph"] for event in recorded.events] == ["B", "E"]
+    assert recorded.events[0]["ts"] <= recorded.events[1]["ts"]
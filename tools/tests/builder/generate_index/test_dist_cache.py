@@ -0,0 +1,57 @@
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+from unittest import mock
+
+from builder.generate_index import dist_cache
+from builder.generate_index.dist_cache import DistInfoCache, normalize_name
+
+
+def test_normalize_name() -> None:
+    assert normalize_name("Foo.Bar__baz-qux") == "foo-bar-baz-qux"
+
+
+def test_lookup_reads_distributions(dist_files: set[Path]) -> None:
+    infos = DistInfoCache().lookup(dist_files)
+    assert infos.keys() == dist_files
+    for dist, info in infos.items():
+        assert info.sha256 == sha256(dist.read_bytes()).hexdigest()
+        assert dist.name.startswith(f"{info.name}-{info.version}-")
+        assert f"Name: {info.name}" in info.metadata
+
+
+def test_cached_until_changed(run_path: Path, dist_files: set[Path]) -> None:
+    cache_path = run_path / "cache.json"
+    first = DistInfoCache(cache_path)
+    infos = first.lookup(dist_files)
+    first.save()
+
+    changed = sorted(dist_files)[0]
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with mock.patch.object(
+        dist_cache, "read_dist_info", wraps=dist_cache.read_dist_info
+    ) as read_dist_info:
+        assert DistInfoCache(cache_path).lookup(dist_files) == infos
+    assert [call.args[0] for call in read_dist_info.call_args_list] == [changed]
+
+
+def test_save_forgets_distributions_not_looked_up(
+    run_path: Path, dist_files: set[Path]
+) -> None:
+    cache_path = run_path / "cache.json"
+    first = DistInfoCache(cache_path)
+    first.lookup(dist_files)
+    first.save()
+    kept = sorted(dist_files)[0]
+    second = DistInfoCache(cache_path)
+    second.lookup([kept])
+    second.save()
+    assert list(json.loads(cache_path.read_text())) == [str(kept)]
+
+
+def test_unreadable_cache_is_ignored(run_path: Path, dist_files: set[Path]) -> None:
+    cache_path = run_path / "cache.json"
+    cache_path.write_text("{not json")
+    assert DistInfoCache(cache_path).lookup(dist_files).keys() == dist_files
@@ -1,5 +1,14 @@
 from pathlib import Path
-from builder.generate_index import orchestrate
+from unittest import mock
+import json
+import os
+import shutil
+
+import pytest
+from bs4 import BeautifulSoup
+
+from builder.generate_index import dist_cache, manifest, orchestrate
+from builder.generate_index.placement import DistPlacement
 
 
 def test_collate_to_packages(
@@ -13,3 +22,162 @@ def test_collate_to_packages(
             assert package_name in str(dist.name)
             dist_files.remove(dist)
     assert not dist_files, f"Some distributions were not captured: {dist_files}"
+
+
+def test_generate_reuses_dist_info(run_path: Path, dist_path: Path) -> None:
+    index_root = run_path / "index"
+    first = orchestrate.generate("http://localhost", index_root, dist_path)
+    assert (dist_path / dist_cache.CACHE_NAME).exists()
+    with mock.patch.object(dist_cache, "read_dist_info") as read_dist_info:
+        second = orchestrate.generate("http://localhost", index_root, dist_path)
+    read_dist_info.assert_not_called()
+    assert second == first
+
+
+def _age_index(index_root: Path) -> None:
+    """Date every file in the index to the epoch, to see what gets rewritten."""
+    for path in index_root.rglob("*"):
+        if path.is_file():
+            os.utime(path, ns=(0, 0))
+
+
+def _rewritten(index_root: Path) -> set[str]:
+    return {
+        str(path.relative_to(index_root))
+        for path in index_root.rglob("*")
+        if path.is_file() and path.stat().st_mtime_ns != 0
+    }
+
+
+def test_incremental_generate_leaves_unchanged_index_alone(
+    run_path: Path, dist_path: Path
+) -> None:
+    index_root = run_path / "index"
+    first = orchestrate.generate("http://localhost", index_root, dist_path)
+    _age_index(index_root)
+    second = orchestrate.generate(
+        "http://localhost", index_root, dist_path, incremental=True
+    )
+    assert second == first
+    assert _rewritten(index_root) == set()
+    # the manifest is kept out of the index, which gets published
+    assert not (index_root / manifest.MANIFEST_NAME).exists()
+    assert (dist_path / manifest.MANIFEST_NAME).exists()
+
+
+def test_incremental_generate_updates_changed_projects(
+    run_path: Path, dist_path: Path
+) -> None:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    _age_index(index_root)
+    # a version of pyudev is gone, and six is gone entirely
+    (dist_path / "pyudev" / "0.23.0" / "pyudev-0.23.0-py3-none-any.whl").unlink()
+    shutil.rmtree(dist_path / "six")
+    orchestrate.generate("http://localhost", index_root, dist_path, incremental=True)
+    assert _rewritten(index_root) == {
+        "simple/index.html",
+        "simple/index.json",
+        "simple/pyudev/index.html",
+        "simple/pyudev/index.json",
+    }
+    assert sorted(
+        path.name for path in (index_root / "simple" / "pyudev").iterdir()
+    ) == [
+        "index.html",
+        "index.json",
+        "pyudev-0.24.0-py3-none-any.whl",
+    ]
+    assert not (index_root / "simple" / "six").exists()
+    assert "six" not in (index_root / "simple" / "index.html").read_text()
+    assert "six" not in (index_root / "simple" / "index.json").read_text()
+
+
+def test_incremental_generate_into_another_index_writes_everything(
+    run_path: Path, dist_path: Path
+) -> None:
+    orchestrate.generate("http://localhost", run_path / "index", dist_path)
+    other_root = run_path / "other-index"
+    other_root.mkdir()
+    orchestrate.generate("http://localhost", other_root, dist_path, incremental=True)
+    assert (other_root / "simple" / "index.html").exists()
+    assert (other_root / "simple" / "pyudev" / "index.json").exists()
+
+
+def test_non_incremental_generate_rewrites_every_page(
+    run_path: Path, dist_path: Path
+) -> None:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    _age_index(index_root)
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    # distributions that are already there with the same content are left alone
+    every_page = {
+        f"simple/{project}index.{form}"
+        for project in ["", "airium/", "pyudev/", "six/"]
+        for form in ["html", "json"]
+    }
+    assert _rewritten(index_root) == every_page
+    _age_index(index_root)
+    # a different url changes every link
+    orchestrate.generate("http://example.com", index_root, dist_path, incremental=True)
+    assert _rewritten(index_root) == every_page
+
+
+@pytest.mark.parametrize(
+    "placement", ["auto", "copy", "hardlink", "reflink", "symlink"]
+)
+def test_generate_places_distributions(
+    run_path: Path, dist_path: Path, dist_files: set[Path], placement: DistPlacement
+) -> None:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path, placement=placement)
+    for dist in dist_files:
+        placed = index_root / "simple" / dist.name.split("-")[0] / dist.name
+        assert placed.read_bytes() == dist.read_bytes()
+        assert placed.is_symlink() == (placement == "symlink")
+        if placement == "hardlink":
+            assert placed.stat().st_ino == dist.stat().st_ino
+
+
+@pytest.mark.parametrize("placement", ["hardlink", "symlink"])
+def test_incremental_generate_places_again_when_placement_changes(
+    run_path: Path, dist_path: Path, dist_files: set[Path], placement: DistPlacement
+) -> None:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path, placement="copy")
+    orchestrate.generate(
+        "http://localhost",
+        index_root,
+        dist_path,
+        incremental=True,
+        placement=placement,
+    )
+    for dist in dist_files:
+        placed = index_root / "simple" / dist.name.split("-")[0] / dist.name
+        assert placed.is_symlink() == (placement == "symlink")
+        assert placed.samefile(dist)
+
+
+def test_generate_writes_html_and_json_alike(run_path: Path, dist_path: Path) -> None:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    simple = index_root / "simple"
+    root = json.loads((simple / "index.json").read_text())
+    assert [project["name"] for project in root["projects"]] == [
+        "airium",
+        "pyudev",
+        "six",
+    ]
+    for project in root["projects"]:
+        html_links = {
+            str(link.get("href"))
+            for link in BeautifulSoup(
+                (simple / project["name"] / "index.html").read_text(), "html.parser"
+            ).find_all("a")
+        }
+        page = json.loads((simple / project["name"] / "index.json").read_text())
+        assert page["name"] == project["name"]
+        assert {
+            f"{file['url']}#sha256={file['hashes']['sha256']}" for file in page["files"]
+        } == html_links
@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 from binascii import unhexlify
 from hashlib import sha256
@@ -54,3 +55,62 @@ def test_generate(
         algo, digest = link[1].fragment.split("=")
         assert algo == "sha256"
         assert sha256(distfile.read()).digest() == unhexlify(digest.encode())
+
+
+def test_hash_distributions(run_path: Path) -> None:
+    # bigger than a hashing chunk, and not a multiple of one
+    contents = {
+        run_path / f"dist{index}.whl": os.urandom(3 * 2**20 + index)
+        for index in range(5)
+    }
+    for path, content in contents.items():
+        path.write_bytes(content)
+    assert package_leaf.hash_distributions(contents.keys(), max_workers=3) == {
+        path: sha256(content).hexdigest() for path, content in contents.items()
+    }
+    assert package_leaf.hash_distributions([]) == {}
+
+
+def test_generate_uses_given_digests(
+    index_pyudev_package_dir: Path, index_pyudev_distributions: list[Path]
+) -> None:
+    index = package_leaf.generate(
+        "http://localhost/simple/pyudev/",
+        index_pyudev_package_dir,
+        index_pyudev_distributions,
+        {dist.name: "abc123" for dist in index_pyudev_distributions},
+    )
+    links = BeautifulSoup(index, "html.parser").find_all("a")
+    assert len(links) == len(index_pyudev_distributions)
+    assert all(str(link.get("href")).endswith("#sha256=abc123") for link in links)
+
+
+def test_generate_json(
+    index_pyudev_package_dir: Path, index_pyudev_distributions: list[Path]
+) -> None:
+    digests = {
+        dist.name: sha256(dist.read_bytes()).hexdigest()
+        for dist in index_pyudev_distributions
+    }
+    index = json.loads(
+        package_leaf.generate_json(
+            "http://localhost/simple/pyudev/",
+            index_pyudev_package_dir,
+            index_pyudev_distributions,
+            digests,
+            {"pyudev-0.24.0-py3-none-any.whl": ">=3.7"},
+        )
+    )
+    assert index["meta"] == {"api-version": "1.1"}
+    assert index["name"] == "pyudev"
+    assert index["versions"] == ["0.23.0", "0.24.0"]
+    files = {file["filename"]: file for file in index["files"]}
+    assert files.keys() == digests.keys()
+    for dist in index_pyudev_distributions:
+        file = files[dist.name]
+        assert file["url"] == f"http://localhost/simple/pyudev/{dist.name}"
+        assert file["hashes"] == {"sha256": digests[dist.name]}
+        assert file["size"] == dist.stat().st_size
+        assert file["yanked"] is False
+    assert files["pyudev-0.24.0-py3-none-any.whl"]["requires-python"] == ">=3.7"
+    assert "requires-python" not in files["pyudev-0.23.0-py3-none-any.whl"]
@@ -0,0 +1,78 @@
+import errno
+import inspect
+from hashlib import sha256
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from builder.common import args
+from builder.container.run import run_build
+from builder.generate_index import placement
+from builder.generate_index.placement import place_dist
+
+
+@pytest.fixture
+def dist(run_path: Path) -> Path:
+    path = run_path / "dist" / "pkg-1.0-py3-none-any.whl"
+    path.parent.mkdir()
+    path.write_bytes(b"wheel content" * 1000)
+    return path
+
+
+@pytest.fixture
+def leaf(run_path: Path) -> Path:
+    path = run_path / "index" / "simple" / "pkg"
+    path.mkdir(parents=True)
+    return path
+
+
+def _digest(path: Path) -> str:
+    return sha256(path.read_bytes()).hexdigest()
+
+
+def test_hardlink(dist: Path, leaf: Path) -> None:
+    target = leaf / dist.name
+    assert place_dist(dist, target, _digest(dist), "hardlink") == "hardlink"
+    assert target.stat().st_ino == dist.stat().st_ino
+    # it's already there
+    assert place_dist(dist, target, _digest(dist), "hardlink") is None
+
+
+def test_symlink_is_relative(dist: Path, leaf: Path) -> None:
+    target = leaf / dist.name
+    assert place_dist(dist, target, None, "symlink") == "symlink"
+    assert not Path(target.readlink()).is_absolute()
+    assert target.read_bytes() == dist.read_bytes()
+    # switching away from symlinks replaces them
+    assert place_dist(dist, target, _digest(dist), "copy") == "copy"
+    assert not target.is_symlink()
+
+
+def test_auto_falls_back_to_copy_across_filesystems(dist: Path, leaf: Path) -> None:
+    cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+    with mock.patch.object(placement, "_reflink", side_effect=cross_device), mock.patch(
+        "os.link", side_effect=cross_device
+    ):
+        assert place_dist(dist, leaf / dist.name, None, "auto") == "copy"
+    assert (leaf / dist.name).read_bytes() == dist.read_bytes()
+    assert not list(leaf.glob(".*.tmp"))
+
+
+def test_identical_copy_is_skipped(dist: Path, leaf: Path) -> None:
+    target = leaf / dist.name
+    target.write_bytes(dist.read_bytes())
+    assert place_dist(dist, target, _digest(dist), "copy") is None
+    # same size, different content
+    target.write_bytes(b"x" * dist.stat().st_size)
+    assert place_dist(dist, target, _digest(dist), "copy") == "copy"
+    assert target.read_bytes() == dist.read_bytes()
+
+
+def test_command_line_matches_placements() -> None:
+    assert args.DIST_PLACEMENTS == placement.DIST_PLACEMENTS
+    assert args.DEFAULT_DIST_PLACEMENT == placement.DEFAULT_DIST_PLACEMENT
+    assert (
+        inspect.signature(run_build).parameters["dist_placement"].default
+        == placement.DEFAULT_DIST_PLACEMENT
+    )
@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 from urllib.parse import urlparse
 
@@ -22,3 +23,10 @@ def test_generate(index_path: Path) -> None:
         assert parsed.path.startswith("/simple")
         package_links.add(index_path / Path(parsed.path).relative_to("/"))
     assert packages == package_links
+
+
+def test_generate_json(index_path: Path) -> None:
+    package_dirs = [index_path / dirname for dirname in sorted(os.listdir(index_path))]
+    index = json.loads(root_index.generate_json(package_dirs))
+    assert index["meta"] == {"api-version": root_index.API_VERSION}
+    assert index["projects"] == [{"name": package.name} for package in package_dirs]
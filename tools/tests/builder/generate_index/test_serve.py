@@ -0,0 +1,80 @@
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Iterator
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+import json
+
+import pytest
+
+from builder.generate_index import orchestrate, serve
+from builder.generate_index.serve import HTML_TYPE, JSON_TYPE
+
+
+@pytest.mark.parametrize(
+    "accept,served",
+    [
+        (None, ("index.html", "text/html")),
+        ("*/*", ("index.html", "text/html")),
+        (JSON_TYPE, ("index.json", JSON_TYPE)),
+        # what pip sends
+        (
+            f"{JSON_TYPE}, {HTML_TYPE}; q=0.1, text/html; q=0.01",
+            ("index.json", JSON_TYPE),
+        ),
+        (f"{JSON_TYPE}; q=0.5, {HTML_TYPE}", ("index.html", HTML_TYPE)),
+        ("application/vnd.pypi.simple.latest+json", ("index.json", JSON_TYPE)),
+        (f"{JSON_TYPE};q=0, text/html", ("index.html", "text/html")),
+        ("application/json", None),
+    ],
+)
+def test_negotiate(accept: str | None, served: tuple[str, str] | None) -> None:
+    assert serve.negotiate(accept) == served
+
+
+@pytest.fixture
+def index_url(run_path: Path, dist_path: Path) -> Iterator[str]:
+    index_root = run_path / "index"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    handler = partial(serve.IndexRequestHandler, directory=str(index_root))
+    with ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_address[1]}/"
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+def _get(url: str, accept: str | None = None) -> tuple[str, bytes]:
+    headers = {"Accept": accept} if accept else {}
+    with urlopen(Request(url, headers=headers)) as response:
+        assert response.headers["Vary"] == "Accept"
+        return response.headers["Content-Type"], response.read()
+
+
+def test_serve_negotiates_pages(index_url: str) -> None:
+    content_type, page = _get(f"{index_url}simple/pyudev/", JSON_TYPE)
+    assert content_type == JSON_TYPE
+    assert json.loads(page)["name"] == "pyudev"
+    content_type, page = _get(f"{index_url}simple/pyudev/")
+    assert content_type == "text/html"
+    assert page.startswith(b"<!DOCTYPE html>")
+    content_type, page = _get(
+        f"{index_url}simple/?format={quote(JSON_TYPE)}", "text/html"
+    )
+    assert content_type == JSON_TYPE
+    with pytest.raises(HTTPError) as error:
+        _get(f"{index_url}simple/", "application/json")
+    assert error.value.code == 406
+
+
+def test_serve_serves_distributions(index_url: str, dist_files: set[Path]) -> None:
+    dist = sorted(dist_files)[0]
+    package = dist.name.split("-")[0]
+    with urlopen(f"{index_url}simple/{package}/{dist.name}") as response:
+        assert response.read() == dist.read_bytes()
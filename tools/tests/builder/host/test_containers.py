@@ -15,3 +15,14 @@ def test_container_run_invoker() -> None:
     assert "my-cool-container" in invoke_str
     for arg in args:
         assert arg in invoke_str
+
+
+def test_container_run_invoker_cache_volume() -> None:
+    args = ["--cache-root=./somewhere"]
+    invoke_str = containers._container_run_invoke_cmd(
+        "my-cool-container", args, "", cache_volume="build-cache"
+    )
+    assert f"--volume=build-cache:{containers.CONTAINER_CACHE_PATH}:rw" in invoke_str
+    # the cache root inside the container comes after the forwarded one so it wins
+    assert invoke_str[-1] == f"--cache-root={containers.CONTAINER_CACHE_PATH}"
+    assert invoke_str.index("my-cool-container") < invoke_str.index(args[0])
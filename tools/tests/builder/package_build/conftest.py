@@ -1,8 +1,12 @@
 import pytest
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import StringIO
 from pathlib import Path
 from builder.package_build.types import GlobalBuildContext, BuildPaths
-from typing import Protocol
+from typing import Iterator, Protocol
 
 
 class PathsBuilder(Protocol):
@@ -25,3 +29,95 @@ def paths_builder(build_path: Path, dist_path: Path) -> PathsBuilder:
 @pytest.fixture
 def global_context() -> GlobalBuildContext:
     return GlobalBuildContext(StringIO(), True, Path("fake-sdk-path"))
+
+
+@dataclass
+class FlakyServer:
+    """A local stand-in for a file server that misbehaves on purpose."""
+
+    url: str
+    content: bytes = b""
+    #: What to serve
+    drops: int = 0
+    #: How many responses to cut off halfway through
+    stalls: int = 0
+    #: How many responses to stall before sending anything
+    stall_seconds: float = 1.0
+    statuses: list[int] = field(default_factory=list)
+    #: Statuses to respond with before serving anything
+    honour_range: bool = True
+    #: Whether Range requests get partial responses
+    ranges_requested: list[str | None] = field(default_factory=list)
+    #: The Range header of each request
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    server: "_FlakyHTTPServer"
+
+    def do_GET(self) -> None:
+        behavior = self.server.behavior
+        requested = self.headers.get("Range")
+        behavior.ranges_requested.append(requested)
+        if behavior.stalls:
+            behavior.stalls -= 1
+            time.sleep(behavior.stall_seconds)
+        if behavior.statuses:
+            self.send_response(behavior.statuses.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        if requested and behavior.honour_range:
+            start = int(requested.removeprefix("bytes=").removesuffix("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                f"bytes {start}-{len(behavior.content) - 1}/{len(behavior.content)}",
+            )
+        else:
+            self.send_response(200)
+        body = behavior.content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if behavior.drops:
+            behavior.drops -= 1
+            body = body[: len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class _FlakyHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    behavior: FlakyServer
+
+
+@pytest.fixture
+def flaky_server() -> Iterator[FlakyServer]:
+    server = _FlakyHTTPServer(("127.0.0.1", 0), _FlakyHandler)
+    server.behavior = FlakyServer(url=f"http://127.0.0.1:{server.server_port}/file")
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    try:
+        yield server.behavior
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@dataclass
+class ServedSource:
+    """A package source served by a local test server."""
+
+    served_url: str
+    name: str = "served"
+    sha256: str | None = None
+
+    def url(self) -> str:
+        return self.served_url
+
+    def archive_name(self) -> str:
+        return "served-1.0.0.tar.gz"
@@ -0,0 +1,99 @@
+from pathlib import Path
+from unittest import mock
+import subprocess
+import sys
+
+from builder.package_build import build_wheel
+from builder.package_build.types import GlobalBuildContext
+
+_PYPROJECT = """
+[build-system]
+requires = []
+build-backend = "local_backend:backend"
+backend-path = ["_build"]
+"""
+
+_BACKEND = """
+import os
+from pathlib import Path
+
+
+class backend:
+    @staticmethod
+    def get_requires_for_build_wheel(config_settings=None):
+        return ["some-requirement"]
+
+    @staticmethod
+    def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
+        name = "local-1.0.0-py3-none-{}.whl".format(
+            os.environ["_PYTHON_HOST_PLATFORM"].replace("-", "_")
+        )
+        (Path(wheel_directory) / name).write_text(os.getcwd())
+        return name
+"""
+
+
+def test_pep517_runner_calls_backend(run_path: Path) -> None:
+    source = run_path / "local-1.0.0"
+    (source / "_build").mkdir(parents=True)
+    (source / "pyproject.toml").write_text(_PYPROJECT)
+    (source / "_build" / "local_backend.py").write_text(_BACKEND)
+    wheels = run_path / "dist"
+    result = subprocess.run(
+        [sys.executable, str(build_wheel._PEP517_RUNNER), str(source), str(wheels)],
+        env={"_PYTHON_HOST_PLATFORM": build_wheel._PEP517_PLATFORM},
+        cwd=run_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert "build backend requires: some-requirement" in result.stdout
+    assert "built wheel: local-1.0.0-py3-none-linux_armv7l.whl" in result.stdout
+    # backends run from the source tree
+    assert (wheels / "local-1.0.0-py3-none-linux_armv7l.whl").read_text() == str(source)
+
+
+def test_build_venv_dependencies() -> None:
+    assert build_wheel.build_venv_dependencies(["numpy", "Cython"]) == [
+        "numpy",
+        "Cython",
+        "wheel",
+    ]
+    assert build_wheel.build_venv_dependencies(["meson-python"], "pep517") == [
+        "meson-python",
+        "wheel",
+        'tomli; python_version < "3.11"',
+    ]
+
+
+def test_build_ext_args() -> None:
+    build = Path("build")
+    assert build_wheel.args_for_command(
+        "build_ext", Path("src"), build, Path("dist")
+    ) == [
+        "--build-lib=build",
+        "--build-temp=build",
+    ]
+    assert build_wheel.args_for_command(
+        "build_ext", Path("src"), build, Path("dist"), 4
+    ) == ["--build-lib=build", "--build-temp=build", "--parallel=4"]
+
+
+def test_build_shell_makes_a_clean_venv(
+    run_path: Path, global_context: GlobalBuildContext
+) -> None:
+    venv_dir = run_path / "venv"
+    with mock.patch("builder.package_build.build_wheel.SDKSubshell.scoped") as scoped:
+        shell = scoped.return_value.__enter__.return_value
+        with build_wheel._build_shell(
+            run_path,
+            run_path / "build",
+            venv_dir,
+            ["Cython"],
+            context=global_context,
+            deadline=None,
+        ):
+            pass
+    commands = [call.args[0] for call in shell.run.call_args_list]
+    # a venv left from an earlier build might have other things installed
+    assert ["python", "-m", "venv", "--clear", str(venv_dir)] in commands
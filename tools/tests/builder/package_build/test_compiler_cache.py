@@ -0,0 +1,54 @@
+from dataclasses import replace
+from pathlib import Path
+from unittest import mock
+
+from builder.package_build.compiler_cache import CompilerCache, CompilerCacheStats
+from builder.package_build.types import GlobalBuildContext
+
+_STATS_LOG = """\
+# /build/pkg/unpack/pkg-1.0.0/src/a.c
+direct_cache_hit
+# /build/pkg/unpack/pkg-1.0.0/src/b.c
+direct_cache_miss
+preprocessed_cache_hit
+# /build/pkg/unpack/pkg-1.0.0/src/c.c
+cache_miss
+direct_cache_miss
+preprocessed_cache_miss
+# /build/pkg/build/a.o
+called_for_link
+"""
+
+
+def test_stats_from_log() -> None:
+    stats = CompilerCacheStats.from_stats_log(_STATS_LOG.splitlines())
+    assert stats == CompilerCacheStats(hits=2, misses=1, uncacheable=1)
+    assert stats.summary() == "ccache: 2 hits (67%), 1 misses, 1 uncacheable calls"
+
+
+def test_for_build(run_path: Path, global_context: GlobalBuildContext) -> None:
+    source_dir = run_path / "build" / "pkg" / "unpack" / "pkg-1.0.0"
+    build_dir = run_path / "build" / "pkg" / "build"
+    build_dir.mkdir(parents=True)
+    (build_dir / "ccache-stats.log").write_text(_STATS_LOG)
+    context = replace(global_context, cache_root=run_path / "cache")
+    with mock.patch("shutil.which", return_value="/usr/bin/ccache"):
+        assert (
+            CompilerCache.for_build(source_dir, build_dir, context=global_context)
+            is None
+        )
+        assert (
+            CompilerCache.for_build(
+                source_dir, build_dir, context=replace(context, ccache=False)
+            )
+            is None
+        )
+        cache = CompilerCache.for_build(source_dir, build_dir, context=context)
+    assert cache
+    assert cache.cache_dir.is_dir()
+    assert cache.base_dir == run_path / "build" / "pkg"
+    # each package build starts a fresh stats log
+    assert cache.stats() == CompilerCacheStats(hits=0, misses=0, uncacheable=0)
+    assert cache.environment()["CCACHE_STATSLOG"] == str(build_dir / "ccache-stats.log")
+    with mock.patch("shutil.which", return_value=None):
+        assert CompilerCache.for_build(source_dir, build_dir, context=context) is None
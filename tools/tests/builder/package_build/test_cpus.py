@@ -0,0 +1,35 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from builder.package_build.cpus import available_cpus, cgroup_cpu_quota
+
+
+def test_no_cgroup(run_path: Path) -> None:
+    assert cgroup_cpu_quota(run_path) is None
+
+
+@pytest.mark.parametrize(
+    "cpu_max,quota", [("max 100000\n", None), ("250000 100000\n", 2.5)]
+)
+def test_cgroup_v2_quota(run_path: Path, cpu_max: str, quota: float | None) -> None:
+    (run_path / "cpu.max").write_text(cpu_max)
+    assert cgroup_cpu_quota(run_path) == quota
+
+
+@pytest.mark.parametrize("quota_us,quota", [("-1\n", None), ("150000\n", 1.5)])
+def test_cgroup_v1_quota(run_path: Path, quota_us: str, quota: float | None) -> None:
+    (run_path / "cpu").mkdir()
+    (run_path / "cpu" / "cpu.cfs_quota_us").write_text(quota_us)
+    (run_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert cgroup_cpu_quota(run_path) == quota
+
+
+def test_available_cpus_limited_by_quota(run_path: Path) -> None:
+    (run_path / "cpu.max").write_text("250000 100000\n")
+    with mock.patch("os.sched_getaffinity", return_value=set(range(16))):
+        # a fraction of a cpu is still worth a compile job
+        assert available_cpus(run_path) == 3
+    with mock.patch("os.sched_getaffinity", return_value={0, 1}):
+        assert available_cpus(run_path) == 2
@@ -1,13 +1,25 @@
+from dataclasses import replace
+from hashlib import sha256
+from io import StringIO
 from pathlib import Path
 from unittest import mock
+import io
 import os
+import stat
 import tarfile
 import zipfile
 
-from builder.package_build.download import unpack_source
+import pytest
+
+from builder.package_build.download import (
+    fetch_source,
+    fetch_and_unpack_source,
+    unpack_source,
+    SourceDigestMismatch,
+)
 from builder.package_build.types import GlobalBuildContext
 
-from .conftest import PathsBuilder
+from .conftest import PathsBuilder, FlakyServer, ServedSource
 
 
 def test_unpack_source_selects_tar_extractor(
@@ -79,3 +91,231 @@ def test_zip_unpack_happypath(
         for element_name in filenames + dirnames:
             unpacked_set.add(Path(dirpath) / element_name)
     assert file_set == unpacked_set
+
+
+def test_fetch_source_checks_pinned_digest(
+    run_path: Path, global_context: GlobalBuildContext, flaky_server: FlakyServer
+) -> None:
+    flaky_server.content = b"expected content"
+    pinned = sha256(b"expected content").hexdigest()
+    fetched = fetch_source(
+        ServedSource(flaky_server.url, sha256=pinned.upper()),
+        run_path,
+        context=global_context,
+    )
+    assert fetched.read_bytes() == b"expected content"
+    flaky_server.content = b"corrupted"
+    with pytest.raises(SourceDigestMismatch):
+        fetch_source(
+            ServedSource(flaky_server.url, sha256=pinned),
+            run_path,
+            context=global_context,
+        )
+    # the previous good download is left alone
+    assert fetched.read_bytes() == b"expected content"
+
+
+def test_fetch_source_finds_pinned_digest_in_cache(
+    run_path: Path, global_context: GlobalBuildContext, flaky_server: FlakyServer
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    flaky_server.content = b"expected content"
+    pinned = sha256(b"expected content").hexdigest()
+    (run_path / "first").mkdir()
+    (run_path / "second").mkdir()
+    fetch_source(ServedSource(flaky_server.url), run_path / "first", context=context)
+    # the content is found by digest, so it doesn't matter what the url is
+    fetched = fetch_source(
+        ServedSource("http://127.0.0.1:1/elsewhere", sha256=pinned),
+        run_path / "second",
+        context=context,
+    )
+    assert fetched.read_bytes() == b"expected content"
+
+
+def _add_to_tar(tf: tarfile.TarFile, name: str, **attrs: object) -> None:
+    info = tarfile.TarInfo(name)
+    for attr, value in attrs.items():
+        setattr(info, attr, value)
+    content = b"contents of " + name.encode() if info.isreg() else b""
+    info.size = len(content)
+    tf.addfile(info, io.BytesIO(content))
+
+
+def test_tar_unpack_streams_and_sets_directory_attrs_last(
+    run_path: Path, global_context: GlobalBuildContext, paths_builder: PathsBuilder
+) -> None:
+    archive = run_path / "readonly.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        _add_to_tar(tf, "pkg-1.0", type=tarfile.DIRTYPE, mode=0o555)
+        _add_to_tar(tf, "pkg-1.0/setup.py", mode=0o644)
+        _add_to_tar(tf, "pkg-1.0/src", type=tarfile.DIRTYPE, mode=0o755)
+        _add_to_tar(tf, "pkg-1.0/src/module.py", mode=0o644)
+    paths = paths_builder("test-readonly")
+    with mock.patch.object(
+        tarfile.TarFile, "getmembers", side_effect=AssertionError("not streamed")
+    ):
+        unpacked = unpack_source(
+            paths.source_path, archive, Path("."), context=global_context
+        )
+    assert unpacked == paths.source_path / "pkg-1.0"
+    assert (unpacked / "src" / "module.py").read_bytes() == (
+        b"contents of pkg-1.0/src/module.py"
+    )
+    assert stat.S_IMODE(unpacked.stat().st_mode) == 0o555
+    unpacked.chmod(0o755)
+
+
+def test_tar_unpack_rejects_escaping_links(
+    run_path: Path, global_context: GlobalBuildContext, paths_builder: PathsBuilder
+) -> None:
+    archive = run_path / "escape.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        _add_to_tar(tf, "pkg-1.0", type=tarfile.DIRTYPE, mode=0o755)
+        _add_to_tar(tf, "pkg-1.0/passwd", type=tarfile.SYMTYPE, linkname="/etc/passwd")
+    paths = paths_builder("test-escape")
+    with pytest.raises(RuntimeError):
+        unpack_source(paths.source_path, archive, Path("."), context=global_context)
+    assert not (paths.source_path / "pkg-1.0" / "passwd").exists()
+
+
+@pytest.mark.parametrize("can_link", [True, False])
+def test_tar_unpack_hardlinks(
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+    can_link: bool,
+) -> None:
+    archive = run_path / "links.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        _add_to_tar(tf, "pkg-1.0", type=tarfile.DIRTYPE, mode=0o755)
+        _add_to_tar(tf, "pkg-1.0/setup.py", mode=0o644)
+        _add_to_tar(
+            tf, "pkg-1.0/setup2.py", type=tarfile.LNKTYPE, linkname="pkg-1.0/setup.py"
+        )
+    paths = paths_builder("test-links")
+    with mock.patch(
+        "os.link",
+        wraps=os.link,
+        side_effect=None if can_link else PermissionError("no links here"),
+    ):
+        # again over the first unpack, which left the links in place
+        for _ in range(2):
+            unpacked = unpack_source(
+                paths.source_path, archive, Path("."), context=global_context
+            )
+    assert (unpacked / "setup2.py").read_bytes() == b"contents of pkg-1.0/setup.py"
+    assert (unpacked / "setup2.py").samefile(unpacked / "setup.py") == can_link
+
+
+def test_stream_unpack_without_archive_file(
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+    flaky_server: FlakyServer,
+    downloaded_sdist_tar: Path,
+) -> None:
+    flaky_server.content = downloaded_sdist_tar.read_bytes()
+    paths = paths_builder("test-stream")
+    download_dir = paths.build_path / "download"
+    download_dir.mkdir(parents=True)
+    expected = {
+        paths.source_path / member.name
+        for member in tarfile.open(downloaded_sdist_tar).getmembers()
+    }
+    fetch_and_unpack_source(
+        ServedSource(flaky_server.url, sha256=sha256(flaky_server.content).hexdigest()),
+        download_dir,
+        paths.source_path,
+        Path("."),
+        context=global_context,
+    )
+    unpacked: set[Path] = set()
+    for dirpath, dirnames, filenames in os.walk(paths.source_path):
+        for element_name in filenames + dirnames:
+            unpacked.add(Path(dirpath) / element_name)
+    assert unpacked == expected
+    assert list(download_dir.iterdir()) == []
+
+
+def test_stream_unpack_tees_into_cache(
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+    flaky_server: FlakyServer,
+    downloaded_sdist_tar: Path,
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    flaky_server.content = downloaded_sdist_tar.read_bytes()
+    paths = paths_builder("test-stream-cache")
+    download_dir = paths.build_path / "download"
+    download_dir.mkdir(parents=True)
+    source = ServedSource(flaky_server.url)
+    first = fetch_and_unpack_source(
+        source, download_dir, paths.source_path, Path("."), context=context
+    )
+    second = fetch_and_unpack_source(
+        source, download_dir, paths.source_path, Path("."), context=context
+    )
+    assert first == second
+    assert len(flaky_server.ranges_requested) == 1
+    assert (download_dir / source.archive_name()).read_bytes() == flaky_server.content
+
+
+def test_stream_unpack_checks_pinned_digest(
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+    flaky_server: FlakyServer,
+    downloaded_sdist_tar: Path,
+) -> None:
+    flaky_server.content = downloaded_sdist_tar.read_bytes()
+    paths = paths_builder("test-stream-mismatch")
+    download_dir = paths.build_path / "download"
+    download_dir.mkdir(parents=True)
+    with pytest.raises(SourceDigestMismatch):
+        fetch_and_unpack_source(
+            ServedSource(flaky_server.url, sha256=sha256(b"other").hexdigest()),
+            download_dir,
+            paths.source_path,
+            Path("."),
+            context=global_context,
+        )
+    assert list(paths.source_path.iterdir()) == []
+
+
+def _repo_zip(run_path: Path) -> Path:
+    archive = run_path / "v1.0.0.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("repo-1.0.0/", "")
+        zf.writestr("repo-1.0.0/README.md", "readme")
+        zf.writestr("repo-1.0.0/package/", "")
+        zf.writestr("repo-1.0.0/package-other/setup.py", "not this one")
+        for index in range(20):
+            zf.writestr(f"repo-1.0.0/package/mod/m{index}.py", f"{index}\n" * index)
+        zf.writestr("repo-1.0.0/package/setup.py", "setup()")
+    return archive
+
+
+def test_zip_unpack_subdirectory(
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+) -> None:
+    output = StringIO()
+    context = replace(global_context, output=output)
+    paths = paths_builder("test-zip-subdirectory")
+    unpacked = unpack_source(
+        paths.source_path,
+        _repo_zip(run_path),
+        Path("repo-1.0.0/package"),
+        context=context,
+    )
+    assert unpacked == paths.source_path / "repo-1.0.0" / "package"
+    assert sorted(
+        str(p.relative_to(unpacked)) for p in unpacked.rglob("*") if p.is_file()
+    ) == sorted(["setup.py"] + [f"mod/m{index}.py" for index in range(20)])
+    assert (unpacked / "mod" / "m3.py").read_text() == "3\n3\n3\n"
+    assert not (paths.source_path / "repo-1.0.0" / "README.md").exists()
+    assert not (paths.source_path / "repo-1.0.0" / "package-other").exists()
+    assert "Unzipped 22 members" in output.getvalue()
+    assert "skipped 3 members (18 bytes)" in output.getvalue()
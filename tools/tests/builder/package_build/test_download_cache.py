@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from hashlib import sha256
+from pathlib import Path
+from threading import Barrier
+import os
+
+from builder.package_build.download import fetch_source
+from builder.package_build.download_cache import DownloadCache
+from builder.package_build.types import GlobalBuildContext
+
+from .conftest import FlakyServer, ServedSource
+
+
+def _add(cache: DownloadCache, run_path: Path, url: str, content: bytes) -> Path:
+    downloaded = run_path / "downloaded"
+    downloaded.write_bytes(content)
+    try:
+        return cache.store(url, downloaded, sha256(content).hexdigest())
+    finally:
+        downloaded.unlink()
+
+
+def test_store_and_lookup(run_path: Path) -> None:
+    cache = DownloadCache(run_path / "cache", 1024)
+    assert cache.lookup("https://example.com/a.tar.gz") is None
+    cached = _add(cache, run_path, "https://example.com/a.tar.gz", b"archive a")
+    assert cache.lookup("https://example.com/a.tar.gz") == cached
+    assert cache.lookup_digest(sha256(b"archive a").hexdigest()) == cached
+    assert cached.read_bytes() == b"archive a"
+
+
+def test_evicts_least_recently_used(run_path: Path) -> None:
+    cache = DownloadCache(run_path / "cache", 250)
+    first = _add(cache, run_path, "https://example.com/1", b"1" * 100)
+    second = _add(cache, run_path, "https://example.com/2", b"2" * 100)
+    os.utime(first, (1000, 1000))
+    os.utime(second, (2000, 2000))
+    # using the first entry makes the second the oldest
+    assert cache.lookup("https://example.com/1") == first
+    _add(cache, run_path, "https://example.com/3", b"3" * 100)
+    assert cache.lookup("https://example.com/2") is None
+    assert cache.lookup("https://example.com/1") == first
+    assert cache.lookup("https://example.com/3")
+
+
+def test_concurrent_stores_of_the_same_source(run_path: Path) -> None:
+    cache = DownloadCache(run_path / "cache", 2**20)
+    content = b"archive" * 10000
+    downloads = [run_path / f"downloaded{index}" for index in range(8)]
+    for downloaded in downloads:
+        downloaded.write_bytes(content)
+    barrier = Barrier(len(downloads))
+
+    def store(downloaded: Path) -> Path:
+        barrier.wait()
+        return cache.store(
+            "https://example.com/a.tar.gz", downloaded, sha256(content).hexdigest()
+        )
+
+    with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+        stored = set(executor.map(store, downloads))
+    assert len(stored) == 1
+    assert stored.pop().read_bytes() == content
+    assert cache.lookup("https://example.com/a.tar.gz")
+    assert not list((run_path / "cache").rglob("*.tmp"))
+
+
+def test_fetch_source_uses_cache(
+    run_path: Path, global_context: GlobalBuildContext, flaky_server: FlakyServer
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    flaky_server.content = b"some content"
+    source = ServedSource(flaky_server.url)
+    first_dir = run_path / "first"
+    second_dir = run_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+    first = fetch_source(source, first_dir, context=context)
+    second = fetch_source(source, second_dir, context=context)
+    assert len(flaky_server.ranges_requested) == 1
+    assert first.read_bytes() == b"some content"
+    assert second.read_bytes() == b"some content"
@@ -0,0 +1,85 @@
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+
+from builder.package_build import fingerprint
+from builder.package_build.types import GithubReleaseSDistSource
+
+
+@pytest.fixture
+def build_file(run_path: Path) -> Path:
+    build_file = run_path / "build.py"
+    build_file.write_text("print('hello')\n")
+    return build_file
+
+
+@pytest.fixture
+def source() -> GithubReleaseSDistSource:
+    return GithubReleaseSDistSource(
+        name="pandas",
+        org="pandas-dev",
+        repo="pandas",
+        tag="v1.5.0",
+        package_name="pandas-1.5.0.tar.gz",
+    )
+
+
+@pytest.fixture
+def current(
+    build_file: Path, source: GithubReleaseSDistSource
+) -> fingerprint.BuildFingerprint:
+    return fingerprint.fingerprint_package(
+        build_file, source, ["bdist_wheel"], ["numpy"], Path("fake-sdk-path")
+    )
+
+
+def test_matching_fingerprint_with_wheel_is_up_to_date(
+    run_path: Path, current: fingerprint.BuildFingerprint
+) -> None:
+    wheel = run_path / "pandas-1.5.0-cp310-cp310-linux_armv7l.whl"
+    wheel.write_bytes(b"not really a wheel")
+    manifest = run_path / fingerprint.MANIFEST_NAME
+    fingerprint.record_build(manifest, current, wheel)
+    assert fingerprint.up_to_date_wheel(manifest, current, run_path) == wheel
+
+    wheel.unlink()
+    assert fingerprint.up_to_date_wheel(manifest, current, run_path) is None
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"build_file_sha256": "0" * 64},
+        {"source_url": "https://example.com/other.tar.gz"},
+        {"setup_py_commands": ("build_ext", "bdist_wheel")},
+        {"build_dependencies": ("numpy", "Cython")},
+        {"sdk": "other-sdk"},
+        {"builder_version": "0.0.2"},
+    ],
+)
+def test_changed_fingerprint_needs_build(
+    run_path: Path, current: fingerprint.BuildFingerprint, change: dict[str, object]
+) -> None:
+    wheel = run_path / "pandas-1.5.0-cp310-cp310-linux_armv7l.whl"
+    wheel.write_bytes(b"not really a wheel")
+    manifest = run_path / fingerprint.MANIFEST_NAME
+    fingerprint.record_build(manifest, current, wheel)
+    changed = replace(current, **change)  # type: ignore[arg-type]
+    assert fingerprint.up_to_date_wheel(manifest, changed, run_path) is None
+
+
+def test_missing_or_corrupt_manifest_needs_build(
+    run_path: Path, current: fingerprint.BuildFingerprint
+) -> None:
+    manifest = run_path / fingerprint.MANIFEST_NAME
+    assert fingerprint.up_to_date_wheel(manifest, current, run_path) is None
+    manifest.write_text("{not json")
+    assert fingerprint.up_to_date_wheel(manifest, current, run_path) is None
+
+
+def test_sdk_identity_tracks_environment_setup(run_path: Path) -> None:
+    (run_path / "environment-setup").write_text("export CC=gcc\n")
+    first = fingerprint.sdk_identity(run_path)
+    (run_path / "environment-setup").write_text("export CC=clang\n")
+    assert fingerprint.sdk_identity(run_path) != first
@@ -0,0 +1,108 @@
+from hashlib import sha256
+from pathlib import Path
+
+import pytest
+
+from builder.package_build.http_download import (
+    download,
+    DownloadFailed,
+    RetryPolicy,
+    SourceDigestMismatch,
+)
+
+from .conftest import FlakyServer
+
+_CONTENT = bytes(range(256)) * 4096
+_QUICK = RetryPolicy(attempts=4, backoff_base=0, read_timeout=0.5)
+
+
+def test_download_happypath(flaky_server: FlakyServer, run_path: Path) -> None:
+    flaky_server.content = _CONTENT
+    destination = run_path / "archive.tar.gz"
+    digest = download(flaky_server.url, destination, policy=_QUICK)
+    assert destination.read_bytes() == _CONTENT
+    assert digest == sha256(_CONTENT).hexdigest()
+    assert flaky_server.ranges_requested == [None]
+
+
+def test_download_resumes_dropped_connection(
+    flaky_server: FlakyServer, run_path: Path
+) -> None:
+    flaky_server.content = _CONTENT
+    flaky_server.drops = 2
+    destination = run_path / "archive.tar.gz"
+    digest = download(flaky_server.url, destination, policy=_QUICK)
+    assert destination.read_bytes() == _CONTENT
+    assert digest == sha256(_CONTENT).hexdigest()
+    # each retry picks up from where the last one stopped
+    assert flaky_server.ranges_requested[0] is None
+    offsets = [
+        int(requested.removeprefix("bytes=").removesuffix("-"))
+        for requested in flaky_server.ranges_requested[1:]
+        if requested
+    ]
+    assert len(offsets) == 2
+    assert 0 < offsets[0] < offsets[1] < len(_CONTENT)
+
+
+def test_download_restarts_without_range_support(
+    flaky_server: FlakyServer, run_path: Path
+) -> None:
+    flaky_server.content = _CONTENT
+    flaky_server.drops = 1
+    flaky_server.honour_range = False
+    destination = run_path / "archive.tar.gz"
+    digest = download(flaky_server.url, destination, policy=_QUICK)
+    assert destination.read_bytes() == _CONTENT
+    assert digest == sha256(_CONTENT).hexdigest()
+
+
+def test_download_retries_server_errors_and_timeouts(
+    flaky_server: FlakyServer, run_path: Path
+) -> None:
+    flaky_server.content = _CONTENT
+    flaky_server.statuses = [503, 429]
+    flaky_server.stalls = 1
+    destination = run_path / "archive.tar.gz"
+    download(flaky_server.url, destination, policy=_QUICK)
+    assert destination.read_bytes() == _CONTENT
+
+
+def test_download_gives_up(flaky_server: FlakyServer, run_path: Path) -> None:
+    flaky_server.content = _CONTENT
+    flaky_server.drops = 10
+    destination = run_path / "archive.tar.gz"
+    with pytest.raises(DownloadFailed):
+        download(flaky_server.url, destination, policy=_QUICK)
+    assert list(run_path.iterdir()) == []
+
+
+def test_download_does_not_retry_client_errors(
+    flaky_server: FlakyServer, run_path: Path
+) -> None:
+    flaky_server.statuses = [404]
+    with pytest.raises(Exception) as exc_info:
+        download(flaky_server.url, run_path / "archive.tar.gz", policy=_QUICK)
+    assert not isinstance(exc_info.value, DownloadFailed)
+    assert len(flaky_server.ranges_requested) == 1
+
+
+def test_download_verifies_digest(flaky_server: FlakyServer, run_path: Path) -> None:
+    flaky_server.content = _CONTENT
+    flaky_server.drops = 1
+    destination = run_path / "archive.tar.gz"
+    with pytest.raises(SourceDigestMismatch):
+        download(
+            flaky_server.url,
+            destination,
+            policy=_QUICK,
+            expected_sha256=sha256(b"something else").hexdigest(),
+        )
+    assert list(run_path.iterdir()) == []
+    download(
+        flaky_server.url,
+        destination,
+        policy=_QUICK,
+        expected_sha256=sha256(_CONTENT).hexdigest().upper(),
+    )
+    assert destination.read_bytes() == _CONTENT
@@ -0,0 +1,355 @@
+from dataclasses import replace
+import json
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+import os
+import threading
+
+import pytest
+
+from builder.common import trace
+from builder.common.shellcommand import ShellCommandFailed
+from builder.package_build import orchestrate
+from builder.package_build.types import (
+    GlobalBuildContext,
+    PackageBuildContext,
+    PackageBuildSpec,
+)
+
+from .conftest import PathsBuilder
+
+_RECORDING_BUILD = """
+import time
+from builder.package_build.orchestrate import _package_build_context
+
+context = _package_build_context.get()
+name = context.paths.source_path.name
+context.context.write(f"start {name}")
+time.sleep(0.1)
+context.paths.dist_path.mkdir(parents=True, exist_ok=True)
+(context.paths.dist_path / "built").write_text(name)
+context.context.write(f"end {name}")
+"""
+
+_FAILING_BUILD = """
+from builder.common import trace
+from builder.common.shellcommand import ShellCommandFailed
+
+raise ShellCommandFailed("false", 1, "command failed", "some output")
+"""
+
+
+_SPEC_BUILD = """
+from builder import package_build
+
+package_build.build_package(
+    source=package_build.github_source(
+        org="test-org",
+        repo="{name}",
+        tag="v1.0.0",
+        sdist_archive="{name}-1.0.0.tar.gz",
+    ),
+    setup_py_commands=["build_ext", "bdist_wheel"],
+)
+"""
+
+
+@pytest.fixture
+def package_tree(run_path: Path) -> Path:
+    root = run_path / "packages"
+    for name in ("first", "second", "third"):
+        (root / name).mkdir(parents=True)
+        (root / name / "build.py").write_text(_RECORDING_BUILD)
+    return root
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_discover_build_packages_builds_all(
+    package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    jobs: int,
+) -> None:
+    output = StringIO()
+    context = replace(global_context, output=output, jobs=jobs)
+    dist_root = run_path / "test-dist"
+    orchestrate.discover_build_packages_sync(
+        package_tree, build_path, dist_root, context=context
+    )
+    for name in ("first", "second", "third"):
+        assert (dist_root / name / "built").read_text() == name
+    # each package's log is kept together even when they build at the same time
+    lines = [
+        line
+        for line in output.getvalue().splitlines()
+        if line.startswith(("start", "end"))
+    ]
+    assert len(lines) == 6
+    for start, end in zip(lines[::2], lines[1::2]):
+        assert start.split()[1] == end.split()[1]
+
+
+def test_build_context_does_not_leak(
+    package_tree: Path, build_path: Path, global_context: GlobalBuildContext
+) -> None:
+    orchestrate.discover_build_packages_sync(
+        package_tree, build_path, build_path / "dist", context=global_context
+    )
+    with pytest.raises(LookupError):
+        orchestrate._package_build_context.get()
+    assert "opentrons_package_build_context" not in vars(orchestrate)
+
+
+def test_parallel_build_failure_propagates(
+    package_tree: Path, build_path: Path, global_context: GlobalBuildContext
+) -> None:
+    (package_tree / "second" / "build.py").write_text(_FAILING_BUILD)
+    context = replace(global_context, jobs=2)
+    with pytest.raises(ShellCommandFailed) as exc_info:
+        orchestrate.discover_build_packages_sync(
+            package_tree, build_path, build_path / "dist", context=context
+        )
+    assert exc_info.value.output == "some output"
+
+
+def test_build_package_requires_context() -> None:
+    with pytest.raises(RuntimeError):
+        orchestrate.build_package(source=None)  # type: ignore[arg-type]
+
+
+@pytest.fixture
+def spec_package_tree(run_path: Path) -> Path:
+    root = run_path / "spec-packages"
+    for name in ("first", "second", "third"):
+        (root / name).mkdir(parents=True)
+        (root / name / "build.py").write_text(_SPEC_BUILD.format(name=name))
+    return root
+
+
+def test_load_package_spec(
+    spec_package_tree: Path, build_path: Path, global_context: GlobalBuildContext
+) -> None:
+    package = next(
+        orchestrate.discover_packages(
+            spec_package_tree, build_path, build_path / "dist", context=global_context
+        )
+    )
+    spec = orchestrate.load_package_spec(package, context=global_context)
+    assert spec.source.repo == package.source_path.name
+    assert spec.setup_py_commands == ["build_ext", "bdist_wheel"]
+    assert spec.build_dependencies == []
+    assert spec.compile_jobs is None
+
+
+def test_compile_jobs(global_context: GlobalBuildContext) -> None:
+    spec = PackageBuildSpec(
+        source=None, setup_py_commands=[], build_dependencies=[]  # type: ignore[arg-type]
+    )
+    with mock.patch.object(orchestrate, "available_cpus", return_value=8):
+        assert orchestrate._compile_jobs(spec, global_context) == 8
+        assert orchestrate._compile_jobs(spec, replace(global_context, jobs=3)) == 2
+        assert (
+            orchestrate._compile_jobs(spec, replace(global_context, compile_jobs=5))
+            == 5
+        )
+        assert (
+            orchestrate._compile_jobs(
+                replace(spec, compile_jobs=1), replace(global_context, compile_jobs=5)
+            )
+            == 1
+        )
+
+
+def test_rebuilt_wheel_replaces_shared_one(
+    build_path: Path,
+    global_context: GlobalBuildContext,
+    paths_builder: PathsBuilder,
+) -> None:
+    spec = PackageBuildSpec(
+        source=None,  # type: ignore[arg-type]
+        setup_py_commands=["bdist_wheel"],
+        build_dependencies=[],
+    )
+    context = PackageBuildContext(paths_builder("local"), global_context)
+    context.paths.dist_path.mkdir(parents=True)
+    published = context.paths.dist_path / "local-1.0-py3-none-linux_armv7l.whl"
+    published.write_bytes(b"first build")
+    # an index that shares the wheel, by hardlink
+    index_wheel = build_path / "index" / published.name
+    index_wheel.parent.mkdir(parents=True)
+    os.link(published, index_wheel)
+
+    def fake_build(commands, source, build, dist, *args, **kwargs):  # type: ignore[no-untyped-def]
+        assert dist != context.paths.dist_path
+        (dist / published.name).write_bytes(b"second build")
+        return dist / published.name
+
+    with mock.patch.object(orchestrate, "build_with_setup_py", side_effect=fake_build):
+        wheel = orchestrate.compile_package(spec, context, build_path / "unpacked")
+    assert wheel == published
+    assert published.read_bytes() == b"second build"
+    assert index_wheel.read_bytes() == b"first build"
+    assert [path.name for path in context.paths.dist_path.iterdir()] == [published.name]
+
+
+def test_pipelined_build_prefetches_in_background(
+    spec_package_tree: Path, build_path: Path, global_context: GlobalBuildContext
+) -> None:
+    context = replace(global_context, prefetch=2)
+    prepared_on: dict[str, threading.Thread] = {}
+
+    def fake_prepare(spec, package_context, session):  # type: ignore[no-untyped-def]
+        prepared_on[spec.source.name] = threading.current_thread()
+        return Path("unpacked") / spec.source.name
+
+    def fake_compile(spec, package_context, unpacked):  # type: ignore[no-untyped-def]
+        assert unpacked == Path("unpacked") / spec.source.name
+        package_context.paths.dist_path.mkdir(parents=True, exist_ok=True)
+        wheel = package_context.paths.dist_path / f"{spec.source.name}.whl"
+        wheel.write_bytes(b"")
+        return wheel
+
+    with (
+        mock.patch.object(orchestrate, "prepare_source", side_effect=fake_prepare),
+        mock.patch.object(
+            orchestrate, "compile_package", side_effect=fake_compile
+        ) as compile_package,
+    ):
+        orchestrate.discover_build_packages_sync(
+            spec_package_tree, build_path, build_path / "dist", context=context
+        )
+    assert compile_package.call_count == 3
+    assert sorted(prepared_on.keys()) == ["first", "second", "third"]
+    assert all(thread is not threading.main_thread() for thread in prepared_on.values())
+
+
+def test_prefetch_build_dependencies(
+    spec_package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+) -> None:
+    (spec_package_tree / "second" / "build.py").write_text(
+        _SPEC_BUILD.format(name="second").replace(
+            "setup_py_commands=",
+            "build_dependencies=['numpy', 'Cython'],\n    setup_py_commands=",
+        )
+    )
+    context = replace(global_context, cache_root=run_path / "cache")
+    with mock.patch.object(orchestrate, "fill_wheelhouse") as fill_wheelhouse:
+        orchestrate.prefetch_build_dependencies(
+            spec_package_tree, build_path, build_path / "dist", context=context
+        )
+    fill_wheelhouse.assert_called_once()
+    # packages with the same dependencies share one set
+    assert fill_wheelhouse.call_args.args[0] == [
+        ["cython", "numpy", "wheel"],
+        ["wheel"],
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_keep_going(
+    package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    jobs: int,
+) -> None:
+    (package_tree / "second" / "build.py").write_text(_FAILING_BUILD)
+    context = replace(global_context, jobs=jobs, keep_going=True)
+    dist_root = run_path / "test-dist"
+    with pytest.raises(orchestrate.PackageBuildsFailed) as exc_info:
+        orchestrate.discover_build_packages_sync(
+            package_tree, build_path, dist_root, context=context
+        )
+    assert [package.name for package, _ in exc_info.value.failures] == ["second"]
+    for name in ("first", "third"):
+        assert (dist_root / name / "built").read_text() == name
+
+
+def test_keep_going_past_unreadable_specs(
+    spec_package_tree: Path, build_path: Path, global_context: GlobalBuildContext
+) -> None:
+    (spec_package_tree / "second" / "build.py").write_text(_FAILING_BUILD)
+    context = replace(global_context, prefetch=1, keep_going=True)
+    with (
+        mock.patch.object(orchestrate, "prepare_source"),
+        mock.patch.object(orchestrate, "build_from_spec") as build_from_spec,
+        pytest.raises(orchestrate.PackageBuildsFailed) as exc_info,
+    ):
+        orchestrate.discover_build_packages_sync(
+            spec_package_tree, build_path, build_path / "dist", context=context
+        )
+    assert build_from_spec.call_count == 2
+    assert len(exc_info.value.failures) == 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_packages_traced_on_their_own_tracks(
+    package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+    jobs: int,
+) -> None:
+    context = replace(global_context, jobs=jobs, trace_path=run_path / "trace.json")
+    with trace.recording() as recorded:
+        orchestrate.discover_build_packages_sync(
+            package_tree, build_path, run_path / "test-dist", context=context
+        )
+    assert sorted(
+        event["track"] for event in recorded.events if event["ph"] == "B"
+    ) == ["packages/first", "packages/second", "packages/third"]
+    assert all(event["name"] == "build.py" for event in recorded.events)
+
+
+def test_failures_are_noted_for_the_report(
+    package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+) -> None:
+    (package_tree / "second" / "build.py").write_text(_FAILING_BUILD)
+    context = replace(global_context, jobs=2, keep_going=True)
+    with trace.recording() as recorded, pytest.raises(orchestrate.PackageBuildsFailed):
+        orchestrate.discover_build_packages_sync(
+            package_tree, build_path, run_path / "test-dist", context=context
+        )
+    (failed,) = [event for event in recorded.events if event["name"] == "status"]
+    assert failed["track"] == "packages/second"
+    assert failed["args"]["status"] == "failed"
+    assert failed["args"]["log_tail"] == ["some output"]
+
+
+def test_parallel_builds_start_longest_first(
+    package_tree: Path,
+    build_path: Path,
+    run_path: Path,
+    global_context: GlobalBuildContext,
+) -> None:
+    report = run_path / "build-report.json"
+    report.write_text(
+        json.dumps(
+            {
+                "packages": [
+                    {"package": "packages/first", "status": "built", "duration_s": 1},
+                    {"package": "packages/third", "status": "built", "duration_s": 9},
+                ]
+            }
+        )
+    )
+    context = replace(global_context, jobs=2, build_report=report)
+    with mock.patch.object(orchestrate, "build_packages") as build_packages:
+        orchestrate.discover_build_packages_sync(
+            package_tree, build_path, run_path / "test-dist", context=context
+        )
+    ((packages,), _) = build_packages.call_args
+    # second has no history, so it might be the longest
+    assert [package.source_path.name for package in packages] == [
+        "second",
+        "third",
+        "first",
+    ]
@@ -0,0 +1,140 @@
+import json
+from pathlib import Path
+
+from builder.common import trace
+from builder.package_build.report import (
+    historical_durations,
+    package_reports,
+    write_report,
+)
+
+
+def _span(name: str, track: str, begin_s: float, end_s: float) -> list[trace.Event]:
+    return [
+        {"name": name, "ph": "B", "ts": int(begin_s * 1e6), "track": track},
+        {"name": name, "ph": "E", "ts": int(end_s * 1e6), "track": track},
+    ]
+
+
+def _note(name: str, track: str, at_s: float, **args: object) -> trace.Event:
+    return {
+        "name": name,
+        "ph": "i",
+        "ts": int(at_s * 1e6),
+        "track": track,
+        "args": args,
+    }
+
+
+_EVENTS = (
+    # pandas was prefetched in one thread, then built on the main thread
+    _span("prefetch", "pandas/1.5.0", 0, 3)
+    + _span("fetch", "pandas/1.5.0", 0, 2)
+    + [_note("download", "pandas/1.5.0", 2, bytes=1000, cached=False)]
+    + _span("unpack", "pandas/1.5.0", 2, 3)
+    + [_note("unpacked", "pandas/1.5.0", 3, bytes=5000)]
+    + _span("build", "pandas/1.5.0", 10, 20)
+    + _span("setup.py build_ext", "pandas/1.5.0", 11, 17)
+    + _span("setup.py bdist_wheel", "pandas/1.5.0", 17, 19)
+    + [
+        _note("venv", "pandas/1.5.0", 11, cached=True),
+        _note("ccache", "pandas/1.5.0", 19, hits=3, misses=1, uncacheable=0),
+        _note("wheel", "pandas/1.5.0", 20, file="pandas.whl", bytes=300),
+        _note("status", "pandas/1.5.0", 20, status="built"),
+    ]
+    + _span("build.py", "numpy/1.16.6", 3, 4)
+    + [
+        _note(
+            "status",
+            "numpy/1.16.6",
+            4,
+            status="failed",
+            error="oh no",
+            log_tail=["error: oh no"],
+        )
+    ]
+    # the main and index tracks aren't packages
+    + _span("wait for prefetch", trace.MAIN_TRACK, 3, 10)
+    + _span("generate index", trace.INDEX_TRACK, 20, 21)
+)
+
+
+def test_package_reports() -> None:
+    # events are merged from workers a package at a time, out of order
+    pandas, numpy = package_reports(sorted(_EVENTS, key=lambda event: event["track"]))
+    assert pandas.package == "pandas/1.5.0"
+    assert pandas.status == "built"
+    assert pandas.duration_s == 13
+    assert pandas.phases_s == {
+        "prefetch": 3,
+        "fetch": 2,
+        "unpack": 1,
+        "build": 10,
+        "setup.py build_ext": 6,
+        "setup.py bdist_wheel": 2,
+    }
+    assert pandas.bytes_downloaded == 1000
+    assert pandas.unpacked_bytes == 5000
+    assert (pandas.wheel, pandas.wheel_bytes) == ("pandas.whl", 300)
+    assert pandas.cache_hits == {
+        "download": False,
+        "venv": True,
+        "ccache_hits": 3,
+        "ccache_misses": 1,
+    }
+    assert pandas.error is None
+    assert numpy.status == "failed"
+    assert numpy.error == "oh no"
+    assert numpy.log_tail == ["error: oh no"]
+
+
+def test_write_report_and_read_history(run_path: Path) -> None:
+    report_path = run_path / "build-report.json"
+    assert historical_durations(report_path) == {}
+    write_report(report_path, _EVENTS, duration_s=21.5)
+    report = json.loads(report_path.read_text())
+    assert report["totals"] == {
+        "duration_s": 21.5,
+        "packages": 2,
+        "statuses": {"built": 1, "failed": 1},
+        "phases_s": {
+            "prefetch": 3,
+            "fetch": 2,
+            "unpack": 1,
+            "build": 10,
+            "setup.py build_ext": 6,
+            "setup.py bdist_wheel": 2,
+            "build.py": 1,
+        },
+        "bytes_downloaded": 1000,
+        "wheel_bytes": 300,
+    }
+    assert [package["package"] for package in report["packages"]] == [
+        "pandas/1.5.0",
+        "numpy/1.16.6",
+    ]
+    # failed builds don't say how long a package takes
+    assert historical_durations(report_path) == {"pandas/1.5.0": 13}
+
+
+def test_history_survives_builds_that_skip_packages(run_path: Path) -> None:
+    report_path = run_path / "build-report.json"
+    write_report(report_path, _EVENTS, duration_s=21.5)
+    # nothing changed, so pandas was only checked, and numpy still fails
+    write_report(
+        report_path,
+        _span("build.py", "pandas/1.5.0", 0, 0.1)
+        + [_note("status", "pandas/1.5.0", 0.1, status="up to date")]
+        + _span("build.py", "numpy/1.16.6", 0, 0.1)
+        + [_note("status", "numpy/1.16.6", 0.1, status="failed")],
+        duration_s=0.5,
+    )
+    assert historical_durations(report_path) == {"pandas/1.5.0": 13}
+    # numpy builds this time
+    write_report(
+        report_path,
+        _span("build", "numpy/1.16.6", 0, 30)
+        + [_note("status", "numpy/1.16.6", 30, status="built")],
+        duration_s=30,
+    )
+    assert historical_durations(report_path)["numpy/1.16.6"] == 30
@@ -0,0 +1,105 @@
+from pathlib import Path
+import time
+
+import pytest
+
+from builder.common.shellcommand import ShellCommandFailed, ShellCommandTimedOut
+from builder.package_build.shell_environment import SDKSubshell, sdk_environment
+
+_ENVIRONMENT_SETUP = """
+echo "sourced" >> {sourced_log}
+echo "SDK environment now set up"
+export FAKE_SDK_CC="arm-buildroot-linux-gnueabihf-gcc --sysroot={sdk}"
+export FAKE_SDK_MULTILINE="first
+second"
+"""
+
+
+@pytest.fixture
+def fake_sdk(run_path: Path) -> Path:
+    sdk = run_path / "sdk"
+    sdk.mkdir()
+    (sdk / "environment-setup").write_text(
+        _ENVIRONMENT_SETUP.format(sourced_log=run_path / "sourced.log", sdk=sdk)
+    )
+    return sdk
+
+
+def test_sdk_environment_is_captured_once(fake_sdk: Path, run_path: Path) -> None:
+    env = sdk_environment(fake_sdk)
+    assert (
+        env["FAKE_SDK_CC"] == f"arm-buildroot-linux-gnueabihf-gcc --sysroot={fake_sdk}"
+    )
+    assert env["FAKE_SDK_MULTILINE"] == "first\nsecond"
+    for _ in range(2):
+        with SDKSubshell.scoped(run_path, fake_sdk) as shell:
+            assert "arm-buildroot" in shell.run(["printenv", "FAKE_SDK_CC"])
+    assert (run_path / "sourced.log").read_text() == "sourced\n"
+
+
+def test_sdk_environment_setup_failure(run_path: Path) -> None:
+    with pytest.raises(ShellCommandFailed):
+        sdk_environment(run_path / "no-sdk-here")
+
+
+def test_output_is_echoed_in_batches(fake_sdk: Path, run_path: Path) -> None:
+    echoed: list[str] = []
+    echoed_verbose: list[str] = []
+    with SDKSubshell.scoped(
+        run_path, fake_sdk, echoed.append, echoed_verbose.append
+    ) as shell:
+        output = shell.run(["seq", "100000"])
+        assert output == "".join(f"{n}\n" for n in range(1, 100001))
+        assert "".join(echoed_verbose) == output
+        assert len(echoed_verbose) < 1000
+        # commands are echoed normally, their output only verbosely
+        assert echoed == [
+            'seq 100000 ; echo "xxxresultxxx:xxx$?xxx"\n',
+        ]
+        assert shell.run(["printf", "no newline at the end"]) == "no newline at the end"
+
+
+def test_failures(fake_sdk: Path, run_path: Path) -> None:
+    with SDKSubshell.scoped(run_path, fake_sdk) as shell:
+        with pytest.raises(ShellCommandFailed) as exc_info:
+            shell.run(["bash", "-c", "echo some output; exit 3"])
+        assert exc_info.value.returncode == 3
+        assert exc_info.value.output == "some output\n"
+        with pytest.raises(ShellCommandFailed) as exc_info:
+            shell.run(["exit", "4"])
+        assert exc_info.value.message == "subshell exited"
+        assert exc_info.value.returncode == 4
+
+
+def _running(pid: int) -> bool:
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+def test_command_timeout_kills_everything(fake_sdk: Path, run_path: Path) -> None:
+    with SDKSubshell.scoped(run_path, fake_sdk, command_timeout=0.5) as shell:
+        start = time.monotonic()
+        with pytest.raises(ShellCommandTimedOut) as exc_info:
+            shell.run(["bash", "-c", "sleep 30 & echo $!; wait"])
+        assert time.monotonic() - start < 5
+    assert isinstance(exc_info.value, ShellCommandFailed)
+    assert exc_info.value.message == "timed out after 0.5s"
+    # signals are delivered asynchronously, so give the child a moment to go
+    child = int(exc_info.value.output)
+    give_up = time.monotonic() + 5
+    while _running(child) and time.monotonic() < give_up:
+        time.sleep(0.01)
+    assert not _running(child)
+
+
+def test_deadline(fake_sdk: Path, run_path: Path) -> None:
+    with SDKSubshell.scoped(
+        run_path, fake_sdk, command_timeout=10, deadline=time.monotonic() + 0.5
+    ) as shell:
+        shell.run(["sleep", "0.1"])
+        with pytest.raises(ShellCommandTimedOut) as exc_info:
+            shell.run(["sleep", "30"])
+    assert exc_info.value.message == "ran past the package's time limit"
@@ -0,0 +1,68 @@
+from pathlib import Path
+import subprocess
+import sys
+
+from builder.package_build.venv_cache import VenvCache
+
+
+def _make_venv(venv_dir: Path) -> None:
+    subprocess.run(
+        [sys.executable, "-m", "venv", "--without-pip", str(venv_dir)], check=True
+    )
+    script = venv_dir / "bin" / "some-tool"
+    script.write_text(f"#!{venv_dir}/bin/python\nprint('hi')\n")
+    script.chmod(0o755)
+
+
+def test_key_ignores_order_and_spelling(run_path: Path) -> None:
+    cache = VenvCache(run_path / "venvs", Path("fake-sdk-path"))
+    assert cache.key(["numpy==1.16.6", "Cython"]) == cache.key(
+        ["cython", "numpy == 1.16.6"]
+    )
+    assert cache.key(["numpy==1.16.6"]) != cache.key(["numpy==1.20.0"])
+    other_sdk = VenvCache(run_path / "venvs", Path("other-sdk-path"))
+    assert cache.key(["Cython"]) != other_sdk.key(["Cython"])
+
+
+def test_save_and_restore(run_path: Path) -> None:
+    cache = VenvCache(run_path / "venvs", Path("fake-sdk-path"))
+    key = cache.key(["wheel"])
+    assert not cache.restore(key, run_path / "first")
+    built = run_path / "built"
+    _make_venv(built)
+    cache.save(key, built, ["wheel"])
+
+    restored = run_path / "restored"
+    restored.mkdir()
+    (restored / "stale").write_text("left over from last time")
+    assert cache.restore(key, restored)
+    assert not (restored / "stale").exists()
+    assert str(built) not in (restored / "bin" / "activate").read_text()
+    assert (
+        (restored / "bin" / "some-tool")
+        .read_text()
+        .startswith(f"#!{restored}/bin/python\n")
+    )
+    assert (restored / "bin" / "some-tool").stat().st_mode & 0o111
+    # the original is untouched even though the clone shares its files
+    assert (
+        (built / "bin" / "some-tool").read_text().startswith(f"#!{built}/bin/python\n")
+    )
+    assert subprocess.run(
+        [str(restored / "bin" / "python"), "-c", "import sys; print(sys.prefix)"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip() == str(restored)
+
+
+def test_save_keeps_first_venv(run_path: Path) -> None:
+    cache = VenvCache(run_path / "venvs", Path("fake-sdk-path"))
+    key = cache.key(["wheel"])
+    first = run_path / "first"
+    second = run_path / "second"
+    _make_venv(first)
+    _make_venv(second)
+    cache.save(key, first, ["wheel"])
+    cache.save(key, second, ["wheel"])
+    assert [entry.name for entry in (run_path / "venvs").iterdir()] == [key]